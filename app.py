@@ -10,20 +10,36 @@
 # 1. IMPORTS
 # ------------------------------------------------------------
 import os
-import re
 import io
 import json
 import time
 import base64
 import random
-import unicodedata
 
-import requests
 import pandas as pd
 from fpdf import FPDF
-from PIL import Image
 import streamlit as st
 from rotinas_module import RotinasModule
+from storage_cache import SHARED_CACHE
+from blob_store import GitHubBlobStore, LocalBlobStore, sniff_ext
+from http_pool import FETCH_POOL, get_session, load_many
+from sharded_store import ShardedJSON
+from git_transaction import GitTransaction
+from write_behind import WriteBehindStore, get_queue
+from record_merge import MergeConflict, three_way_merge
+from storage_backends import GITHUB_API, make_backend
+from storage_telemetry import TELEMETRY
+from rate_limiter import BACKGROUND, RATE_LIMITER, WRITE, RateLimitDeferred
+from change_poller import get_poller
+from json_codec import SUFFIXES, check_encoding, pack, record_size, size_report, unpack
+from lazy_records import HEAVY_FIELDS, loads as lazy_loads
+from text_sanitizer import MEMO as SANITIZE_MEMO, sanitize_text
+from record_projections import CACHE as PROJECTION_CACHE, Projector
+from quill_ir import IMAGE_MARKER, list_prefix, sanitized_runs
+from text_wrap import WRAP_CACHE, wrap_text
+from pdf_fonts import DEJAVU_FILES, FONTS as PDF_FONTS
+from image_handles import REGISTRY as IMAGE_REGISTRY, handle_for, handle_for_field
+from print_images import PREPARED as PREPARED_IMAGES, prepare as prepare_image
 
 from streamlit_quill import st_quill
 from streamlit_paste_button import paste_image_button
@@ -37,22 +53,44 @@ from docx.oxml.ns import qn
 
 # ------------------------------------------------------------
 # 2. GITHUB DATABASE (Incluído no módulo — sem import externo)
-#    Seguro | Atômico | Anti-race | SHA locking | Cache curto
+#    Seguro | Atômico | Anti-race | SHA locking | Cache compartilhado
 # ------------------------------------------------------------
 class GitHubJSON:
-    API_URL = "https://api.github.com/repos/{owner}/{repo}/contents/{path}"
+    API_URL = "{base}/repos/{owner}/{repo}/contents/{path}"
+    COMMITS_URL = "{base}/repos/{owner}/{repo}/commits"
 
-    def __init__(self, token, owner, repo, path="dados.json", branch="main"):
+    def __init__(self, token, owner, repo, path="dados.json", branch="main", cache_ttl=None, session=None,
+                 api_base=GITHUB_API, encoding="json", legacy_path=None, lazy_fields=HEAVY_FIELDS):
         self.token = token
         self.owner = owner
         self.repo = repo
         self.path = path
         self.branch = branch
+        self.api_base = api_base.rstrip("/")
 
-        # Cache ultra-curto para evitar GET múltiplos desnecessários
-        self._cache_data = None
-        self._cache_sha = None
-        self._cache_time = 0.0
+        # Formato no repositório (json_codec): "json" (legado) ou comprimido;
+        # legacy_path é o JSON antigo, lido enquanto o comprimido não existir
+        self.encoding = check_encoding(encoding)
+        self.legacy_path = legacy_path
+
+        # Campos pesados (HTML, base64) só são decodificados quando lidos
+        self.lazy_fields = frozenset(lazy_fields or ())
+
+        # Conexões keep-alive compartilhadas por todas as instâncias
+        self.session = session or get_session()
+
+        # Cache compartilhado pelo processo (sobrevive a reruns/sessões)
+        self.cache_ttl = cache_ttl
+        self._cache_key = SHARED_CACHE.make_key(owner, repo, path, branch, self.api_base)
+
+    def invalidate(self):
+        """Descarta o snapshot compartilhado deste arquivo."""
+        SHARED_CACHE.invalidate(self._cache_key)
+
+    def _legacy(self):
+        """Cliente do arquivo JSON legado (texto), para leitura/migração."""
+        return GitHubJSON(self.token, self.owner, self.repo, self.legacy_path, self.branch,
+                          cache_ttl=self.cache_ttl, session=self.session, api_base=self.api_base)
 
     @property
     def headers(self):
@@ -61,24 +99,111 @@ class GitHubJSON:
             "Accept": "application/vnd.github.v3+json",
         }
 
-    # ============================
-    # LOAD — Leitura segura (200ms)
-    # ============================
+    # ============================================
+    # LOAD — Leitura segura (cache compartilhado)
+    # ============================================
     def load(self, force=False):
-        now = time.time()
-        if not force and self._cache_data is not None:
-            if (now - self._cache_time) < 0.2:  # cache curtíssimo
-                return self._cache_data, self._cache_sha
+        with TELEMETRY.trace("load", self.path) as tr:
+            if not force:
+                cached = SHARED_CACHE.get(self._cache_key, ttl=self.cache_ttl)
+                if cached is not None:
+                    tr.served("cache")
+                    return cached
+
+                # Stale-while-revalidate: snapshot vencido (ou do disco, na partida
+                # a frio) sai na hora e a revalidação roda em segundo plano
+                stale = SHARED_CACHE.get_stale(self._cache_key)
+                if stale is not None:
+                    if SHARED_CACHE.begin_refresh(self._cache_key):
+                        FETCH_POOL.submit(self._background_refresh)
+                    tr.served("stale")
+                    return stale
 
-        url = self.API_URL.format(owner=self.owner, repo=self.repo, path=self.path)
-        r = requests.get(url, headers=self.headers, params={"ref": self.branch})
+            try:
+                # Leituras simultâneas do mesmo arquivo viram uma requisição só
+                return RATE_LIMITER.collapse(self._cache_key, self._fetch)
+            except Exception:
+                # GitHub lento/fora/rate limit: cópia local só-leitura, se houver
+                stale = SHARED_CACHE.get_stale(self._cache_key)
+                if stale is None:
+                    raise
+                SHARED_CACHE.mark_offline(self._cache_key)
+                tr.served("offline")
+                return stale
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except RateLimitDeferred:
+            pass  # cota curta: o snapshot atual continua valendo
+        except Exception as e:
+            SHARED_CACHE.mark_offline(self._cache_key)
+            print(f"Revalidação de {self.path} falhou: {e}")
+        finally:
+            SHARED_CACHE.end_refresh(self._cache_key)
+
+    def refresh(self):
+        """Revalida o snapshot agora, com prioridade de 2º plano."""
+        with TELEMETRY.trace("refresh", self.path), RATE_LIMITER.priority(BACKGROUND):
+            return RATE_LIMITER.collapse(self._cache_key, self._fetch)
+
+    def head_commit(self, etag=None):
+        """
+        Último commit que tocou este arquivo (GET condicional, usado pelo
+        ChangePoller). Retorna (sha, etag); sha None quando nada mudou (304).
+        """
+        url = self.COMMITS_URL.format(base=self.api_base, owner=self.owner, repo=self.repo)
+        headers = dict(self.headers, **{"If-None-Match": etag}) if etag else self.headers
+        params = {"sha": self.branch, "path": self.path, "per_page": 1}
+
+        r = self._send(self.session.get, url, headers=headers, params=params)
+        if r.status_code == 304:
+            return None, etag
+        if r.status_code != 200:
+            raise Exception(f"GitHub GET commits error: {r.status_code} - {r.text}")
+        commits = r.json()
+        return (commits[0]["sha"] if commits else ""), r.headers.get("ETag")
+
+    def _send(self, method, *args, **kwargs):
+        """
+        Uma requisição HTTP: passa pelo agendador de rate limit (prioridade da
+        thread), é medida pela telemetria e sincroniza a cota com os cabeçalhos.
+        """
+        tr = TELEMETRY.current()
+        tr.sleep_s += RATE_LIMITER.acquire()
+        r = tr.call(method, *args, **kwargs)
+        RATE_LIMITER.observe(r)
+        return r
+
+    def _fetch(self):
+        tr = TELEMETRY.current()
+        url = self.API_URL.format(base=self.api_base, owner=self.owner, repo=self.repo, path=self.path)
+
+        # GET condicional: se o arquivo não mudou, o GitHub responde 304
+        # (sem corpo e sem consumir o rate limit) e reaproveitamos o parse
+        headers = self.headers
+        etag = SHARED_CACHE.etag(self._cache_key)
+        if etag:
+            headers = dict(headers, **{"If-None-Match": etag})
+
+        r = self._send(self.session.get, url, headers=headers, params={"ref": self.branch})
+
+        if r.status_code == 304:
+            cached = SHARED_CACHE.revalidate(self._cache_key)
+            if cached is not None:
+                tr.served("304")
+                return cached
+            # Snapshot invalidado no meio do caminho — refaz sem condicional
+            r = self._send(self.session.get, url, headers=self.headers, params={"ref": self.branch})
 
         if r.status_code == 404:
-            # Arquivo não existe — retorna base vazia
-            self._cache_data = []
-            self._cache_sha = None
-            self._cache_time = now
-            return [], None
+            # Arquivo não existe — base vazia; no formato comprimido ainda não
+            # migrado, lê o JSON legado (o próximo save já cria o novo arquivo)
+            data = []
+            if self.legacy_path:
+                data, _ = self._legacy().load(force=True)
+            SHARED_CACHE.put(self._cache_key, data, None)
+            return data, None
 
         if r.status_code != 200:
             raise Exception(f"GitHub GET error: {r.status_code} - {r.text}")
@@ -86,134 +211,411 @@ class GitHubJSON:
         body = r.json()
         sha = body.get("sha")
 
+        # Mesmo SHA do snapshot guardado (ex.: ETag perdido): dispensa o parse
+        known = SHARED_CACHE.parsed_for_sha(self._cache_key, sha)
+        if known is not None:
+            SHARED_CACHE.put(self._cache_key, known, sha, etag=r.headers.get("ETag"))
+            return known, sha
+
         # Pode vir vazio; garante string
         decoded_b64 = body.get("content") or ""
-        decoded = base64.b64decode(decoded_b64).decode("utf-8")
+        t0 = time.perf_counter()
+        stored = base64.b64decode(decoded_b64)
+        tr.b64_s += time.perf_counter() - t0
+        tr.b64_bytes += len(decoded_b64)
+        tr.raw_bytes += len(stored)
+
+        # Comprimido ou texto: detectado pelos bytes, não pela extensão
+        t0 = time.perf_counter()
+        raw = unpack(stored)
+        tr.json_s += time.perf_counter() - t0
+        record_size(self.path, len(stored), len(raw))
+        decoded = raw.decode("utf-8")
 
         # Auto-healing p/ arquivo vazio ou inválido
+        t0 = time.perf_counter()
         if not decoded.strip():
             data = []
         else:
             try:
-                data = json.loads(decoded)
+                data = lazy_loads(decoded, self.lazy_fields)
             except json.JSONDecodeError:
                 # remove possíveis BOMs e tenta de novo
                 decoded = decoded.lstrip("\ufeff")
                 try:
-                    data = json.loads(decoded)
+                    data = lazy_loads(decoded, self.lazy_fields)
                 except json.JSONDecodeError:
                     # fallback seguro: considera base vazia
                     data = []
+        tr.json_s += time.perf_counter() - t0
 
         # Garante tipo lista (se vier dict por engano)
         if not isinstance(data, list):
             data = []
 
-        self._cache_data = data
-        self._cache_sha = sha
-        self._cache_time = now
+        SHARED_CACHE.put(self._cache_key, data, sha, etag=r.headers.get("ETag"))
 
         return data, sha
 
     # ============================================
     # SAVE — Salvamento atômico com SHA locking
     # ============================================
+    def _put(self, new_data, sha):
+        """PUT único na contents API; em 200/201 atualiza o cache compartilhado."""
+        tr = TELEMETRY.current()
+        url = self.API_URL.format(base=self.api_base, owner=self.owner, repo=self.repo, path=self.path)
+
+        t0 = time.perf_counter()
+        raw = pack(new_data, self.encoding, indent=4, path=self.path)
+        t1 = time.perf_counter()
+        encoded = base64.b64encode(raw).decode("utf-8")
+        tr.json_s += t1 - t0
+        tr.b64_s += time.perf_counter() - t1
+        tr.raw_bytes += len(raw)
+        tr.b64_bytes += len(encoded)
+
+        payload = {
+            "message": "Atualização Manual Faturamento",
+            "content": encoded,
+            "sha": sha,
+            "branch": self.branch,
+        }
+
+        r = self._send(self.session.put, url, headers=self.headers, json=payload)
+
+        if r.status_code in (200, 201):
+            # Substitui o snapshot compartilhado pelo que acabamos de gravar
+            SHARED_CACHE.put(self._cache_key, new_data, r.json()["content"]["sha"])
+        return r
+
     def save(self, new_data, retries=8):
-        for attempt in range(retries):
-            # SHA sempre atualizado
-            _, sha = self.load(force=True)
-
-            url = self.API_URL.format(owner=self.owner, repo=self.repo, path=self.path)
-            encoded = base64.b64encode(
-                json.dumps(new_data, indent=4, ensure_ascii=False).encode("utf-8")
-            ).decode("utf-8")
-
-            payload = {
-                "message": "Atualização Manual Faturamento",
-                "content": encoded,
-                "sha": sha,
-                "branch": self.branch,
-            }
-
-            r = requests.put(url, headers=self.headers, json=payload)
-
-            # SALVO COM SUCESSO
-            if r.status_code in (200, 201):
-                body = r.json()
-                new_sha = body["content"]["sha"]
-
-                # Atualiza cache
-                self._cache_data = new_data
-                self._cache_sha = new_sha
-                self._cache_time = time.time()
-                return True
-
-            # SHA inválido => arquivo mudou no GitHub => retry exponencial
-            if r.status_code == 409:
-                time.sleep((2 ** attempt) * 0.15 + random.random() * 0.2)
-                continue
+        with TELEMETRY.trace("save", self.path) as tr, RATE_LIMITER.priority(WRITE):
+            for attempt in range(retries):
+                tr.attempts += 1
+                # SHA sempre atualizado (GET condicional: 304 quando nada mudou)
+                _, sha = self.load(force=True)
 
-            # Rate limit
-            if r.status_code == 403 and "rate" in r.text.lower():
-                time.sleep(2 + random.random())
-                continue
+                r = self._put(new_data, sha)
+
+                # SALVO COM SUCESSO
+                if r.status_code in (200, 201):
+                    return True
+
+                # SHA inválido => arquivo mudou no GitHub => retry exponencial
+                if r.status_code == 409:
+                    tr.sleep((2 ** attempt) * 0.15 + random.random() * 0.2)
+                    continue
 
-            raise Exception(f"GitHub PUT error: {r.status_code} - {r.text}")
+                # Rate limit: observe() já bloqueou o agendador até o reset /
+                # Retry-After; a próxima tentativa espera lá em vez de dormir fixo
+                if r.status_code == 403 and "rate" in r.text.lower():
+                    continue
 
-        raise TimeoutError("Falha ao salvar após múltiplas tentativas.")
+                raise Exception(f"GitHub PUT error: {r.status_code} - {r.text}")
+
+            raise TimeoutError("Falha ao salvar após múltiplas tentativas.")
 
     # =================================================
     # UPDATE — Carregar, alterar e salvar com atomicidade
+    #   409 => merge de três vias por registro (id), sem
+    #   reexecutar update_fn nem recarregar a cada tentativa
+    #   base => lista de quando a edição começou: o que
+    #   mudou no GitHub desde então também entra no merge
     # =================================================
-    def update(self, update_fn):
-        for attempt in range(8):
-            data, _ = self.load(force=True)
-            new_data = update_fn(data)
+    def update(self, update_fn, retries=8, base=None):
+        with TELEMETRY.trace("update", self.path) as tr, RATE_LIMITER.priority(WRITE):
+            theirs, sha = self.load(force=True)
+            if base is None:
+                base = theirs
+                mine = update_fn(list(base))
+            else:
+                mine = three_way_merge(base, update_fn(list(base)), theirs)
+                base = theirs
 
-            try:
-                self.save(new_data)
-                return True
-            except TimeoutError:
-                continue
-            except Exception:
-                time.sleep(0.2)
+            for attempt in range(retries):
+                tr.attempts += 1
+                r = self._put(mine, sha)
+
+                if r.status_code in (200, 201):
+                    return True
+
+                # Arquivo mudou no GitHub: combina a nossa alteração com a deles.
+                # Só o mesmo registro/campo alterado dos dois lados levanta MergeConflict
+                if r.status_code == 409:
+                    tr.sleep((2 ** attempt) * 0.15 + random.random() * 0.2)
+                    theirs, sha = self.load(force=True)
+                    mine = three_way_merge(base, mine, theirs)
+                    base = theirs
+                    continue
+
+                # Rate limit: observe() já bloqueou o agendador até o reset /
+                # Retry-After; a próxima tentativa espera lá em vez de dormir fixo
+                if r.status_code == 403 and "rate" in r.text.lower():
+                    continue
+
+                raise Exception(f"GitHub PUT error: {r.status_code} - {r.text}")
+
+            raise Exception("Falha ao atualizar após múltiplas tentativas.")
+
+    # =================================================
+    # TRANSAÇÃO — vários arquivos em um único commit
+    # =================================================
+    def transaction(self):
+        """Nova GitTransaction no mesmo repositório/branch deste arquivo."""
+        return GitTransaction(self.token, self.owner, self.repo, self.branch, session=self.session,
+                              api_base=self.api_base)
 
-        raise Exception("Falha ao atualizar após múltiplas tentativas.")
+    def stage(self, tx, new_data):
+        """
+        Prepara new_data em tx (mesma serialização do save) e devolve o SHA
+        do blob. O cache compartilhado só é atualizado depois do commit.
+        """
+        if self.encoding == "json":
+            blob_sha = tx.put_json(self.path, new_data, indent=4)
+        else:
+            blob_sha = tx.put_bytes(self.path, pack(new_data, self.encoding, path=self.path))
+        tx.on_commit(lambda shas: SHARED_CACHE.put(self._cache_key, new_data, shas.get(self.path)))
+        return blob_sha
+
+    # =================================================
+    # API POR REGISTRO — mesma interface do ShardedJSON
+    # =================================================
+    def load_index(self, force=False):
+        data, _ = self.load(force=force)
+        return data
+
+    def load_record(self, record_id, force=False):
+        data, _ = self.load(force=force)
+        return next((r for r in data if str(r.get("id")) == str(record_id)), None)
+
+    def load_all(self, force=False):
+        data, _ = self.load(force=force)
+        return data
+
+    def apply_batch(self, upserts=(), deletes=(), bases=None):
+        """
+        Vários upserts/remoções por id aplicados em um único update (1 commit).
+        bases: {id: registro como estava quando a edição começou}; campos que
+        outra pessoa alterou depois disso são preservados (merge de três vias).
+        """
+        novos = {str(r.get("id")): r for r in upserts}
+        removidos = {str(i) for i in deletes}
+        bases = {str(k): v for k, v in (bases or {}).items()}
+
+        def _apply(data):
+            pendentes = dict(novos)  # update() pode reexecutar esta função
+            out = []
+            for r in data or []:
+                rid = str(r.get("id"))
+                if rid in removidos:
+                    continue
+                novo = pendentes.pop(rid, None)
+                if novo is None:
+                    out.append(r)
+                elif rid in bases:
+                    out.extend(three_way_merge([bases[rid]], [novo], [r]))
+                else:
+                    out.append(novo)
+            for rid, novo in pendentes.items():
+                # Removido no GitHub enquanto era editado: o merge decide
+                out.extend(three_way_merge([bases[rid]], [novo], []) if rid in bases else [novo])
+            return out
+
+        return self.update(_apply)
+
+    def save_record(self, record, base=None):
+        """base: o registro como foi aberto no formulário (None = sobrescreve)."""
+        return self.apply_batch([record], (), {record.get("id"): base} if base is not None else None)
+
+    def delete_record(self, record_id):
+        return self.apply_batch((), [record_id])
 
 # ------------------------------------------------------------
 # 3. CONFIGURAÇÃO DE ACESSO (SECRETS)
 # ------------------------------------------------------------
+# Backend de armazenamento: "github" (padrão), "local" (pasta LOCAL_DATA_DIR,
+# sem rede) ou "emulador" (servidor HTTP local que imita a contents API, com
+# latência EMULATOR_LATENCY em segundos) — para demonstrações e testes de carga
+try:
+    STORAGE_BACKEND = str(st.secrets.get("STORAGE_BACKEND", "github")).lower()
+    LOCAL_DATA_DIR = st.secrets.get("LOCAL_DATA_DIR", ".local_data")
+    EMULATOR_LATENCY = float(st.secrets.get("EMULATOR_LATENCY", 0))
+except Exception:
+    STORAGE_BACKEND, LOCAL_DATA_DIR, EMULATOR_LATENCY = "github", ".local_data", 0.0
+
 try:
     GITHUB_TOKEN = st.secrets["GITHUB_TOKEN"]
     REPO_OWNER = st.secrets["REPO_OWNER"]
     REPO_NAME = st.secrets["REPO_NAME"]
 except Exception:
-    st.error("⚠️ Configure os Secrets: GITHUB_TOKEN, REPO_OWNER e REPO_NAME.")
-    st.stop()
+    if STORAGE_BACKEND == "github":
+        st.error("⚠️ Configure os Secrets: GITHUB_TOKEN, REPO_OWNER e REPO_NAME.")
+        st.stop()
+    GITHUB_TOKEN, REPO_OWNER, REPO_NAME = "local", "local", "manual-faturamento"
 
 FILE_PATH = "dados.json"
 BRANCH = "main"
 
-db = GitHubJSON(
-    token=GITHUB_TOKEN,
-    owner=REPO_OWNER,
-    repo=REPO_NAME,
-    path=FILE_PATH,
-    branch=BRANCH
-)
+# Validade (s) do snapshot compartilhado entre sessões; "Recarregar" invalida
+try:
+    CACHE_TTL = float(st.secrets.get("CACHE_TTL", 30))
+except Exception:
+    CACHE_TTL = 30.0
 
-# ------------------------------------------------------------
+# Cópia persistente dos snapshots (SQLite): partida a frio sem esperar o
+# GitHub e leitura de emergência quando ele estiver lento/fora do ar
+try:
+    SNAPSHOT_DIR = st.secrets.get("SNAPSHOT_DIR", ".snapshots")
+except Exception:
+    SNAPSHOT_DIR = ".snapshots"
+try:
+    SHARED_CACHE.attach_disk(os.path.join(SNAPSHOT_DIR, "snapshots.sqlite3"))
+except Exception as e:
+    print(f"Cache em disco desativado: {e}")
+
+# Painel de telemetria do armazenamento (latência, retries, cota) na barra lateral
+try:
+    ADMIN_MODE = str(st.secrets.get("ADMIN_MODE", "")).lower() in ("1", "true", "sim")
+except Exception:
+    ADMIN_MODE = False
 
 ROTINAS_FILE_PATH = "rotinas.json"
 
-db_rotinas = GitHubJSON(
-    token=GITHUB_TOKEN,
-    owner=REPO_OWNER,
-    repo=REPO_NAME,
-    path=ROTINAS_FILE_PATH,
-    branch=BRANCH
+# Pasta local começa com uma cópia dos JSON do repositório (demo instantânea)
+API_BASE, http_session = make_backend(
+    STORAGE_BACKEND,
+    data_dir=LOCAL_DATA_DIR,
+    latency=EMULATOR_LATENCY,
+    seed_files=(FILE_PATH, ROTINAS_FILE_PATH),
 )
 
+# Layout de armazenamento: "monolitico" (um JSON por banco, padrão) ou
+# "fatiado" (um JSON por registro + manifest.json em dados/ e rotinas/)
+try:
+    STORAGE_LAYOUT = str(st.secrets.get("STORAGE_LAYOUT", "monolitico")).lower()
+except Exception:
+    STORAGE_LAYOUT = "monolitico"
+
+# Codificação dos arquivos: "json" (texto, padrão) ou "gzip" / "zstd"
+# (compacto + comprimido: dados.json.gz). Enquanto o arquivo comprimido não
+# existir, o JSON legado é lido; o botão de migração regrava tudo de uma vez.
+try:
+    STORAGE_ENCODING = check_encoding(st.secrets.get("STORAGE_ENCODING", "json"))
+except Exception:
+    STORAGE_ENCODING = "json"
+
+def github_file(path, encoding=None):
+    encoding = encoding or STORAGE_ENCODING
+    suffix = SUFFIXES[encoding]
+    return GitHubJSON(
+        token=GITHUB_TOKEN,
+        owner=REPO_OWNER,
+        repo=REPO_NAME,
+        path=path + suffix,
+        branch=BRANCH,
+        cache_ttl=CACHE_TTL,
+        session=http_session,
+        api_base=API_BASE,
+        encoding=encoding,
+        legacy_path=path if suffix else None
+    )
+
+def migrar_codificacao():
+    """
+    Migração única para STORAGE_ENCODING: regrava os arquivos JSON legados no
+    formato comprimido, todos em um commit (os legados ficam como estão).
+    Retorna o relatório de bytes por arquivo.
+    """
+    if STORAGE_LAYOUT == "fatiado":
+        paths = []
+        for pasta in ("dados", "rotinas"):
+            manifesto = f"{pasta}/{ShardedJSON.MANIFEST_NAME}"
+            indice, _ = github_file(manifesto, "json").load(force=True)
+            paths += [manifesto] + [f"{pasta}/{e.get('id')}.json" for e in indice]
+    else:
+        paths = [FILE_PATH, ROTINAS_FILE_PATH]
+
+    destinos = [github_file(path) for path in paths]
+    legados = list(FETCH_POOL.map(lambda d: d._legacy().load(force=True), destinos))
+
+    tx = destinos[0].transaction()
+    relatorio = []
+    for destino, (dados, sha) in zip(destinos, legados):
+        if sha is None:
+            continue  # não existe no formato legado
+        antes = len(pack(dados, "json", indent=4))
+        depois = len(pack(dados, STORAGE_ENCODING))
+        destino.stage(tx, dados)
+        relatorio.append({
+            "arquivo": destino.path,
+            "kb_antes": antes / 1024,
+            "kb_depois": depois / 1024,
+            "economia": f"{1 - depois / antes:.0%}" if antes else "-",
+        })
+    tx.commit(f"Migração para {STORAGE_ENCODING} — Manual Faturamento")
+    return relatorio
+
+if STORAGE_LAYOUT == "fatiado":
+    db = ShardedJSON(github_file, "dados", index_fields=("id", "nome", "empresa", "sistema_utilizado"))
+    db_rotinas = ShardedJSON(github_file, "rotinas", index_fields=("id", "nome", "setor"))
+else:
+    db = github_file(FILE_PATH)
+    db_rotinas = github_file(ROTINAS_FILE_PATH)
+
+# Gravação assíncrona (opcional): "Salvar" grava num diário local e retorna;
+# um worker envia os lotes ao GitHub. Pasta do diário: WRITE_BEHIND_DIR.
+try:
+    WRITE_BEHIND = str(st.secrets.get("WRITE_BEHIND", "")).lower() in ("1", "true", "sim")
+    WRITE_BEHIND_DIR = st.secrets.get("WRITE_BEHIND_DIR", ".write_behind")
+except Exception:
+    WRITE_BEHIND, WRITE_BEHIND_DIR = False, ".write_behind"
+
+if WRITE_BEHIND:
+    fila_gravacao = get_queue(os.path.join(WRITE_BEHIND_DIR, "journal.jsonl"))
+    db = WriteBehindStore(db, fila_gravacao, "dados")
+    db_rotinas = WriteBehindStore(db_rotinas, fila_gravacao, "rotinas")
+else:
+    fila_gravacao = None
+
+# Detector de mudanças (um por processo): um GET condicional por arquivo a
+# cada POLL_INTERVAL s; quando outro commit altera o arquivo, o snapshot
+# compartilhado é recarregado e as sessões são avisadas. 0 desliga.
+try:
+    POLL_INTERVAL = float(st.secrets.get("POLL_INTERVAL", 20))
+except Exception:
+    POLL_INTERVAL = 20.0
+
+def _arquivo_monitorado(banco):
+    banco = getattr(banco, "store", banco)       # WriteBehindStore -> banco real
+    return getattr(banco, "manifest", banco)     # ShardedJSON -> manifesto
+
+if POLL_INTERVAL > 0:
+    poller = get_poller(POLL_INTERVAL)
+    poller.watch("convênios", _arquivo_monitorado(db))
+    poller.watch("rotinas", _arquivo_monitorado(db_rotinas))
+else:
+    poller = None
+
+# ------------------------------------------------------------
+# Imagens (Quill / print_b64) ficam fora do JSON, endereçadas por SHA-256.
+# BLOB_DIR (secret opcional) usa pasta local; senão, arquivos em blobs/ no repo.
+try:
+    BLOB_DIR = st.secrets.get("BLOB_DIR", "")
+except Exception:
+    BLOB_DIR = ""
+
+if BLOB_DIR:
+    blobs = LocalBlobStore(BLOB_DIR)
+else:
+    blobs = GitHubBlobStore(
+        token=GITHUB_TOKEN,
+        owner=REPO_OWNER,
+        repo=REPO_NAME,
+        branch=BRANCH,
+        session=http_session,
+        api_base=API_BASE
+    )
+
 # ------------------------------------------------------------
 # 4. CONSTANTES / PALETA
 # ------------------------------------------------------------
@@ -320,115 +722,20 @@ def image_to_base64(img):
     img.save(buffered, format="PNG", optimize=True)
     return base64.b64encode(buffered.getvalue()).decode()
 
-def clean_html(raw_html):
-    """Remove tags HTML e &nbsp; para processamento de texto puro (PDF/Word)"""
-    if not raw_html:
-        return ""
-    cleanr = re.compile('<.*?>|&nbsp;')
-    cleantext = re.sub(cleanr, ' ', raw_html)
-    return re.sub(r' +', ' ', cleantext).strip()
-
-def extract_images_from_html(html_content):
-    """
-    Extrai imagens base64 de tags <img> do HTML e retorna tupla (texto_sem_imagens, lista_imagens)
-    """
-    if not html_content:
-        return html_content, []
-
-    images = []
-
-    # Regex para encontrar tags <img src="data:image/...;base64,DATA">
-    img_pattern = r'<img[^>]+src="data:image/([^;]+);base64,([^"]+)"[^>]*>'
-
-    def replace_img(match):
-        image_format = match.group(1)  # png, jpeg, etc
-        base64_data = match.group(2)
+def image_handle_src(src):
+    """src de <img> da IR -> ImageHandle preguiçoso; None para URL externa (não embutida)."""
+    return handle_for(src, blobs)
 
+def image_url_src(src):
+    """src de <img> da IR -> URL exibível na tela (blob vira data URI)."""
+    if src.startswith("blob:sha256:"):
         try:
-            # Decodifica base64
-            img_data = base64.b64decode(base64_data)
-            # Cria objeto Image do Pillow
-            img = Image.open(io.BytesIO(img_data))
-            images.append(img)
-            # Retorna marcador de texto para manter espaçamento
-            return "\n[IMAGEM]\n"
+            data = blobs.get(src)
         except Exception as e:
-            print(f"Erro ao processar imagem: {e}")
-            return ""
-
-    # Substitui tags de imagem por marcador
-    html_without_images = re.sub(img_pattern, replace_img, html_content)
-
-    return html_without_images, images
-
-def fix_technical_spacing(txt: str) -> str:
-    if not txt:
-        return ""
-
-    urls = {}
-    def _url_replacer(match):
-        key = f"\u0000{len(urls)}\u0000"
-        urls[key] = match.group(0)
-        return key
-
-    # 1) Protege URLs para não inserir espaços no meio delas
-    txt = re.sub(r"https?://[^\s<>\"']+", _url_replacer, txt)
-
-    # 2) Espaço entre Números e Letras (ex: 90dias -> 90 dias)
-    txt = re.sub(r"(\d)([A-Za-zÁÉÍÓÚÂÊÔÃÕÀÇáéíóúâêôãõàç])", r"\1 \2", txt)
-    txt = re.sub(r"([A-Za-zÁÉÍÓÚÂÊÔÃÕÀÇáéíóúâêôãõàç])(\d)", r"\1 \2", txt)
-
-    # 3) Espaço após pontuação se estiver colado (ex: fechar.> -> fechar. >)
-    # Ignora pontos decimais em números
-    txt = re.sub(r"(?<!\d)\.(?=[^\s\d])", ". ", txt)
-    txt = re.sub(r":(?!\s)", ": ", txt)
-    txt = re.sub(r";(?!\s)", "; ", txt)
-
-    # 4) Espaços ao redor de operadores e delimitadores técnicos
-    txt = re.sub(r"\s*>\s*", " > ", txt)
-    txt = re.sub(r"\s*/\s*", " / ", txt)
-
-    # 5) Correções específicas de colagem comuns em faturamento
-    correcoes = {
-        r"PELASMARTKIDS": "PELA SMARTKIDS",
-        r"serpediatria": "ser pediatria",
-        r"depacote": "de pacote",
-        r"diasútil": "dias útil",
-        r"às12:00": "às 12:00",
-        r"sófechar": "só fechar",
-        r"gera oXML": "gera o XML",
-        r"noSisAmil": "no SisAmil"
-    }
-    for erro, certo in correcoes.items():
-        txt = re.sub(erro, certo, txt, flags=re.IGNORECASE)
-
-    # 6) Bullets coladas (•Texto -> • Texto)
-    txt = re.sub(r"([•\-–—\*→])([^\s])", r"\1 \2", txt)
-
-    # 7) Restaura URLs
-    for k, v in urls.items():
-        txt = txt.replace(k, v)
-
-    return txt
-
-def sanitize_text(text: str) -> str:
-    if not text:
-        return ""
-    txt = str(text)
-    # Normalização e remoção de caracteres invisíveis que causam colagem
-    txt = unicodedata.normalize("NFKC", txt)
-    txt = re.sub(r"[\u00A0\u200B-\u200F\uFEFF]", " ", txt)
-
-    # Aplica correções de espaçamento
-    txt = fix_technical_spacing(txt)
-
-    # Remove espaços duplos
-    txt = re.sub(r"[ \t]+", " ", txt)
-    return txt.strip()
-
-def normalize(value):
-    if not value: return ""
-    return sanitize_text(value).strip().lower()
+            print(f"Erro ao carregar blob {src}: {e}")
+            return None
+        return f"data:image/{sniff_ext(data)};base64,{base64.b64encode(data).decode()}"
+    return src
 
 def generate_id(dados_atuais):
     ids = []
@@ -452,113 +759,44 @@ def chunk_text(text, size):
     safe_size = int(size) if size and size >= 1 else 1
     return [text[i:i+safe_size] for i in range(0, len(text), safe_size)]
 
-def _split_token_preserving_delims(token: str):
-    """
-    Para tokens tipo URL/caminho, quebra por delimitadores mantendo-os
-    NO FIM do segmento (sem inserir espaços).
-    Ex.: 'https://a/b?x=1' -> ['https://a/', 'b?', 'x=', '1']
-    """
-    parts = re.split(r"([/?&=._-])", token)
-    segs = []
-    i = 0
-    while i < len(parts):
-        seg = parts[i]
-        if seg == "":
-            i += 1
-            continue
-        if i + 1 < len(parts) and re.fullmatch(r"[/?&=._-]", parts[i+1] or ""):
-            seg += parts[i+1]
-            i += 2
-        else:
-            i += 1
-        segs.append(seg)
-    return segs
-
-def wrap_text(text, pdf, max_width):
-    if not text:
-        return [""]
-
-    # Divide por espaços preservando a intenção original
-    words = text.split(" ")
-    lines, current = [], ""
-
-    def width(s): return pdf.get_string_width(s)
-
-    for w in words:
-        if not w: continue
-
-        # Se for uma URL ou texto com delimitadores, usamos a lógica de quebra por caractere
-        if any(ch in w for ch in "/?&=._-") and width(w) > max_width:
-            segments = _split_token_preserving_delims(w)
-            for seg in segments:
-                candidate = current + seg
-                if width(candidate) <= max_width:
-                    current = candidate
-                else:
-                    if current: lines.append(current)
-                    current = seg
-            continue
-
-        # Palavra normal
-        candidate = f"{current} {w}".strip() if current else w
-        if width(candidate) <= max_width:
-            current = candidate
-        else:
-            if current: lines.append(current)
-            current = w
-
-    if current:
-        lines.append(current)
-    return lines
-
 # ============================================================
 # 8. PDF — fontes e OBSERVAÇÕES (parágrafos + bullets + espaços)
 # ============================================================
 def _pdf_set_fonts(pdf: FPDF) -> str:
     """
     Tenta usar DejaVu (Unicode). Se não achar, cai em Helvetica.
-    Compatível com FPDF 1.x e fpdf2.
+    As fontes são analisadas uma vez por processo (pdf_fonts.FONTS).
     """
-    fonte_normal = "DejaVuSans.ttf"
-    fonte_bold = "DejaVuSans-Bold.ttf"
-    has_normal = os.path.exists(fonte_normal)
-    has_bold = os.path.exists(fonte_bold)
-
-    if has_normal:
-        try:
-            pdf.add_font("DejaVu", "", fonte_normal, uni=True)
-            if has_bold:
-                pdf.add_font("DejaVu", "B", fonte_bold, uni=True)
+    try:
+        if PDF_FONTS.attach(pdf, "DejaVu", DEJAVU_FILES):
             return "DejaVu"
-        except Exception:
-            pass
+    except Exception as e:
+        print(f"Erro ao carregar DejaVu: {e}")
     return "Helvetica"
 
-def build_wrapped_lines(text, pdf, usable_w, line_h, bullet_indent=4.0):
+def build_doc_lines(doc, pdf, usable_w, line_h, bullet_indent=4.0):
+    """
+    IR do campo rico (quill_ir) -> [(linha, recuo)] para o PDF. Cada bloco
+    de imagem vira (IMAGE_MARKER, None), na ordem de Projection.images.
+    """
     lines_out = []
-    if not text: return []
-
-    text = sanitize_text(text)  # ✅ UMA ÚNICA VEZ
-
-    paragraphs = text.split('\n')
-    bullet_re = re.compile(r"^\s*(?:[\u2022•\-–—\*]|->|→)\s*(.*)$")
+    for block in doc:
+        if block.kind == "img":
+            lines_out.append((IMAGE_MARKER, None))
+            continue
 
-    for p in paragraphs:
-        p = p.strip()
-        if not p:
+        text = block.text if block.sanitized else sanitize_text(block.text)
+        if not text:
             lines_out.append(("", 0.0))
             continue
 
-        m = bullet_re.match(p)
-        if m:
-            content = m.group(1).strip()
-            wrapped = wrap_text("• " + content, pdf, usable_w - bullet_indent)
-            for wline in wrapped:
-                lines_out.append((wline, bullet_indent))
+        if block.kind == "li":
+            indent = bullet_indent * (1 + block.indent)
+            text = list_prefix(block) + text
         else:
-            wrapped = wrap_text(p, pdf, usable_w)
-            for wline in wrapped:
-                lines_out.append((wline, 0.0))
+            indent = bullet_indent * block.indent
+        for wline in wrap_text(text, pdf, usable_w - indent):
+            lines_out.append((wline, indent))
     return lines_out
 
 # ============================================================
@@ -587,12 +825,10 @@ def gerar_pdf(dados):
     bullet_indent = 4.0
     usable_w = CONTENT_W - 2 * padding
 
-    # 2. PROCESSAMENTO DO TEXTO RICO E IMAGENS
-    obs_text_raw = safe_get(dados, "observacoes")
-    # Extrai imagens antes de limpar HTML
-    obs_text_with_markers, obs_images = extract_images_from_html(obs_text_raw)
-    obs_text = clean_html(obs_text_with_markers)
-    wrapped_lines = build_wrapped_lines(obs_text, pdf, usable_w, line_h, bullet_indent=bullet_indent)
+    # 2. PROCESSAMENTO DO TEXTO RICO E IMAGENS (projeção: uma vez por versão)
+    proj = projetor.project(dados)
+    obs_images = proj.images
+    wrapped_lines = build_doc_lines(proj.doc, pdf, usable_w, line_h, bullet_indent=bullet_indent)
 
     # ---------- HELPERS INTERNOS ----------
     def apply_font(size=10, bold=False):
@@ -675,7 +911,7 @@ def gerar_pdf(dados):
             pdf.ln(row_h)
 
     # ---------- RENDERIZAÇÃO ----------
-    nome_conv = sanitize_text(safe_get(dados, "nome")).upper()
+    nome_conv = proj.get("nome").upper()
     pdf.set_fill_color(*BLUE)
     pdf.set_text_color(255, 255, 255)
     apply_font(18, True)
@@ -715,17 +951,17 @@ def gerar_pdf(dados):
     img_idx = 0
     while idx < len(wrapped_lines):
         # Verifica se a linha atual contém marcador de imagem
-        if idx < len(wrapped_lines) and "[IMAGEM]" in wrapped_lines[idx][0]:
-            # Adiciona imagem se houver
-            if img_idx < len(obs_images):
-                img = obs_images[img_idx]
-                # Salva imagem temporariamente
-                temp_img_path = f"/tmp/temp_img_{img_idx}.png"
-                img.save(temp_img_path, "PNG")
-
-                # Calcula dimensões para caber na largura disponível
-                img_width = CONTENT_W - 10  # margem de 5mm de cada lado
-                aspect_ratio = img.height / img.width
+        if wrapped_lines[idx][1] is None:
+            # Adiciona imagem se houver (None = não carregou)
+            handle = obs_images[img_idx] if img_idx < len(obs_images) else None
+            img_idx += 1
+            # Calcula dimensões para caber na largura disponível
+            img_width = CONTENT_W - 10  # margem de 5mm de cada lado
+            # Reduzida para impressão (cache por conteúdo e largura); JPEG/PNG vão
+            # da memória direto para o fpdf, sem arquivo em /tmp
+            prepared = prepare_image(handle, img_width)
+            if prepared is not None:
+                aspect_ratio = prepared.height / prepared.width
                 img_height = img_width * aspect_ratio
 
                 # Verifica se cabe na página
@@ -737,16 +973,8 @@ def gerar_pdf(dados):
 
                 # Adiciona imagem centralizada
                 x_img = pdf.l_margin + 5
-                pdf.image(temp_img_path, x=x_img, y=y_curr, w=img_width)
+                pdf.image(io.BytesIO(prepared.data), x=x_img, y=y_curr, w=img_width)
                 pdf.set_y(y_curr + img_height + 5)  # espaço após imagem
-
-                # Remove arquivo temporário
-                try:
-                    os.remove(temp_img_path)
-                except:
-                    pass
-
-                img_idx += 1
             # Pula linha com marcador
             idx += 1
             continue
@@ -763,8 +991,12 @@ def gerar_pdf(dados):
         fim = min(len(wrapped_lines), idx + linhas_possiveis)
         chunk = wrapped_lines[idx:fim]
 
-        # Filtra linhas com marcador de imagem
-        chunk = [(txt, ind) for (txt, ind) in chunk if "[IMAGEM]" not in txt]
+        # Para antes do próximo bloco de imagem
+        for k, (_, ind) in enumerate(chunk):
+            if ind is None:
+                chunk = chunk[:k]
+                fim = idx + k
+                break
         if not chunk:
             idx = fim
             continue
@@ -797,7 +1029,8 @@ def gerar_docx(dados):
     - Observações Críticas com parágrafos + bullets + imagens coladas no Quill
     - (Opcional) Print de Tela/Evidência salvo no campo print_b64
     """
-    nome_conv = sanitize_text(safe_get(dados, "nome")).upper()
+    proj = projetor.project(dados)
+    nome_conv = proj.get("nome").upper()
 
     # --- Documento e margens ---
     doc = Document()
@@ -932,11 +1165,9 @@ def gerar_docx(dados):
         # Espaço após a tabela
         doc.add_paragraph()
 
-    def add_observacoes_box(html):
-        # Extrai imagens e marcações
-        html_with_markers, imgs = extract_images_from_html(html)
-        text = clean_html(html_with_markers)
-        text = sanitize_text(text)
+    def add_observacoes_box(proj):
+        # Renderiza a IR do Quill: parágrafos, listas, negrito/itálico, imagens
+        imgs = proj.images
 
         # Caixa com borda: tabela 1x1
         box = doc.add_table(rows=1, cols=1)
@@ -944,44 +1175,45 @@ def gerar_docx(dados):
         box.columns[0].width = Cm(content_w_cm)
         cell = box.cell(0, 0)
 
-        bullet_re = re.compile(r"^\s*(?:[\u2022•\-–—\*]|-&gt;|->|→)\s*(.*)$")
-        paragraphs = text.split('\n')
         img_idx = 0
-        for ptxt in paragraphs:
-            ptxt = (ptxt or "").strip()
-            if not ptxt:
-                set_paragraph_spacing(cell.add_paragraph(), before_pt=0, after_pt=0)
-                continue
-
-            if "[IMAGEM]" in ptxt:
-                if img_idx < len(imgs):
-                    img = imgs[img_idx]; img_idx += 1
-                    # redimensiona para caber na largura do conteúdo
-                    stream = io.BytesIO()
-                    max_width_cm = content_w_cm - 0.8
-                    max_width_px = int(max_width_cm * 37.7952755906)  # ~96 dpi
-                    if img.width > max_width_px:
-                        ratio = max_width_px / float(img.width)
-                        new_h = int(img.height * ratio)
-                        img = img.resize((max_width_px, new_h))
-                    img.save(stream, format="PNG", optimize=True)
-                    stream.seek(0)
+        for block in proj.doc:
+            if block.kind == "img":
+                handle = imgs[img_idx] if img_idx < len(imgs) else None
+                img_idx += 1
+                # reduzida para a largura do conteúdo (cache compartilhado com o PDF)
+                max_width_cm = content_w_cm - 0.8
+                prepared = prepare_image(handle, max_width_cm * 10)
+                if prepared is not None:
                     p = cell.add_paragraph()
                     set_paragraph_spacing(p, before_pt=0, after_pt=6)
                     run = p.add_run()
-                    run.add_picture(stream, width=Cm(max_width_cm))
+                    run.add_picture(io.BytesIO(prepared.data), width=Cm(max_width_cm))
                 continue
 
-            m = bullet_re.match(ptxt)
-            if m:
-                content = sanitize_text(m.group(1))
-                p = cell.add_paragraph(style='List Bullet')
-                set_paragraph_spacing(p, before_pt=0, after_pt=3)
-                p.add_run(content)
+            runs = sanitized_runs(block, sanitize_text)
+            if not runs:
+                set_paragraph_spacing(cell.add_paragraph(), before_pt=0, after_pt=0)
+                continue
+
+            if block.kind == "li":
+                style = "List Number" if block.list_type == "ordered" else "List Bullet"
+                p = cell.add_paragraph(style=style)
+                if block.indent:
+                    p.paragraph_format.left_indent = Cm(0.63 * (1 + block.indent))
             else:
                 p = cell.add_paragraph()
-                set_paragraph_spacing(p, before_pt=0, after_pt=3)
-                p.add_run(ptxt)
+                if block.indent:
+                    p.paragraph_format.left_indent = Cm(0.63 * block.indent)
+            set_paragraph_spacing(p, before_pt=0, after_pt=3)
+            heading = block.kind.startswith("h")
+            for r in runs:
+                run = p.add_run(r.text)
+                run.bold = r.bold or heading
+                run.italic = r.italic
+                run.underline = r.underline or bool(r.link)
+                run.font.strike = r.strike
+                if r.link:
+                    run.font.color.rgb = RGBColor(0x1F, 0x49, 0x7D)
 
         doc.add_paragraph()
 
@@ -1021,29 +1253,21 @@ def gerar_docx(dados):
 
     # Observações Críticas
     add_section_bar("Observações Críticas")
-    add_observacoes_box(safe_get(dados, "observacoes"))
+    add_observacoes_box(proj)
 
     # (Opcional) Print de Tela / Evidência (imagem fora do Quill)
     img_b64 = safe_get(dados, "print_b64")
     if img_b64:
         try:
-            img_data = base64.b64decode(img_b64)
-            img = Image.open(io.BytesIO(img_data))
-            doc.add_paragraph()  # espaço
-            add_section_bar("Print de Tela / Evidência")
-            stream = io.BytesIO()
             max_width_cm = content_w_cm - 0.8
-            max_width_px = int(max_width_cm * 37.7952755906)
-            if img.width > max_width_px:
-                ratio = max_width_px / float(img.width)
-                new_h = int(img.height * ratio)
-                img = img.resize((max_width_px, new_h))
-            img.save(stream, format="PNG", optimize=True)
-            stream.seek(0)
-            p = doc.add_paragraph()
-            set_paragraph_spacing(p, before_pt=0, after_pt=6)
-            run = p.add_run()
-            run.add_picture(stream, width=Cm(max_width_cm))
+            prepared = prepare_image(handle_for_field(img_b64, blobs), max_width_cm * 10)
+            if prepared is not None:
+                doc.add_paragraph()  # espaço
+                add_section_bar("Print de Tela / Evidência")
+                p = doc.add_paragraph()
+                set_paragraph_spacing(p, before_pt=0, after_pt=6)
+                run = p.add_run()
+                run.add_picture(io.BytesIO(prepared.data), width=Cm(max_width_cm))
         except Exception:
             pass
 
@@ -1065,7 +1289,7 @@ def ui_card_start(title: str):
 def ui_card_end():
     st.markdown("</div>", unsafe_allow_html=True)
 
-def ui_section_title(text: str):
+def ui_section_title(text: str, sanitized=False):
     st.markdown(
         f"""
         <div style="
@@ -1077,24 +1301,24 @@ def ui_section_title(text: str):
             border-radius:10px;
             font-size:26px;
             font-weight:700;">
-            {ui_text(text).upper()}
+            {(text if sanitized else ui_text(text)).upper()}
         </div>
         """,
         unsafe_allow_html=True
     )
 
-def ui_info_line(label: str, value: str):
+def ui_info_line(label: str, value: str, sanitized=False):
     st.markdown(
         f"""
         <div style="margin:6px 0; font-size:15px; line-height:1.5;">
             <strong>{ui_text(label)}:</strong>
-            <span>{ui_text(value)}</span>
+            <span>{value if sanitized else ui_text(value)}</span>
         </div>
         """,
         unsafe_allow_html=True
     )
 
-def ui_block_info(title: str, content: str):
+def ui_block_info(title: str, content: str, sanitized=False):
     if not content:
         return
     ui_card_start(title)
@@ -1107,7 +1331,7 @@ def ui_block_info(title: str, content: str):
             border-radius:6px;
             font-size:15px;
             line-height:1.5;">
-            {sanitize_text(content).replace("\n", "<br>")}
+            {(content if sanitized else sanitize_text(content)).replace("\n", "<br>")}
         </div>
         """,
         unsafe_allow_html=True,
@@ -1121,8 +1345,9 @@ def page_cadastro():
     from streamlit_quill import st_quill
     from streamlit_paste_button import paste_image_button
 
-    dados_atuais, _ = db.load(force=True)
-    dados_atuais = list(dados_atuais)
+    # Índice (lista completa ou manifesto) basta para o menu
+    # Sem ir à rede: snapshot compartilhado, que o poller e os saves atualizam
+    dados_atuais = list(db.load_index())
 
     ui_card_start("📝 Gestão de Convênios")
 
@@ -1137,10 +1362,29 @@ def page_cadastro():
         dados_conv = None
     else:
         conv_id = escolha.split(" — ")[0]
-        dados_conv = next(
-            (c for c in dados_atuais if str(c.get('id')) == str(conv_id)),
-            None
-        )
+        dados_conv = db.load_record(conv_id)
+        if getattr(db, "write_behind", False) and db.is_pending(conv_id):
+            st.caption("⏳ Alterações deste convênio ainda não foram enviadas ao GitHub.")
+        conflito = db.conflict(conv_id) if getattr(db, "write_behind", False) else None
+        if conflito is not None:
+            campos = conflito["conflict"] if isinstance(conflito["conflict"], list) else []
+            st.warning(
+                "⚠️ Sua última alteração deste convênio não foi enviada: outra pessoa mudou "
+                + (f"os mesmos campos ({', '.join(campos)})" if campos else "o mesmo registro")
+                + ". O formulário mostra a versão atual — refaça a edição e salve, ou descarte a pendência."
+            )
+            for campo in campos:
+                st.caption(f"Seu valor para **{campo}**: {str(safe_get(conflito.get('record') or {}, campo))[:200]}")
+            if st.button("Descartar minha alteração pendente", key=f"descartar_{conv_id}"):
+                db.discard(conv_id)
+                st.rerun()
+
+    # Versão aberta no formulário = base do merge ao salvar: o snapshot pode
+    # trazer a edição de outra pessoa antes do clique em Salvar
+    edicao = st.session_state.get("edicao_convenio")
+    if edicao is None or edicao[0] != conv_id:
+        st.session_state["edicao_convenio"] = edicao = (conv_id, dados_conv)
+    base_conv = edicao[1]
 
     ui_card_end()
 
@@ -1199,7 +1443,7 @@ def page_cadastro():
         # --- BLOCO 3: EDITOR RICO ---
         st.markdown("##### 🖋️ Observações Críticas")
         observacoes_html = st_quill(
-            value=safe_get(dados_conv, "observacoes"),
+            value=blobs.inline_html(safe_get(dados_conv, "observacoes")),
             placeholder="Digite as regras detalhadas de faturamento aqui...",
             key=f"quill_{conv_id}"
         )
@@ -1220,7 +1464,7 @@ def page_cadastro():
             img_para_salvar = image_to_base64(pasted_img.image_data)
         elif img_b64_salva:
             with c_preview:
-                st.image(base64.b64decode(img_b64_salva), caption="Imagem Atual", use_container_width=True)
+                st.image(blobs.resolve_bytes(img_b64_salva), caption="Imagem Atual", use_container_width=True)
             img_para_salvar = img_b64_salva
         else:
             img_para_salvar = ""
@@ -1255,17 +1499,33 @@ def page_cadastro():
                     "doc_digitalizacao": safe_get(dados_conv, "doc_digitalizacao")
                 }
 
-                if conv_id is None:
-                    dados_atuais.append(novo_reg)
-                else:
-                    for i, c in enumerate(dados_atuais):
-                        if str(c.get("id")) == str(conv_id):
-                            dados_atuais[i] = novo_reg
-                            break
-
-                if db.save(dados_atuais):
-                    st.success("✔ Dados atualizados com sucesso!")
-                    time.sleep(0.8)
+                # Imagens saem do JSON: grava os blobs ANTES do registro que os referencia
+                novo_reg = blobs.externalize_record(
+                    novo_reg, html_fields=("observacoes",), b64_fields=("print_b64",)
+                )
+
+                # Grava só este registro (no layout fatiado, só o arquivo dele)
+                try:
+                    salvo = db.save_record(novo_reg, base=base_conv)
+                    if salvo:
+                        projetor.warm(novo_reg)
+                        st.session_state.pop("edicao_convenio", None)
+                except MergeConflict as e:
+                    st.error(f"⚠️ {e}. Outra pessoa alterou os mesmos campos — recarregue e refaça a edição.")
+                    # A próxima tentativa compara com a versão atual (a que o
+                    # formulário vai mostrar), não com a de quando foi aberto
+                    st.session_state["edicao_convenio"] = (conv_id, db.load_record(conv_id, force=True))
+                    salvo = False
+                except RateLimitDeferred:
+                    st.warning("⏳ Limite de requisições do GitHub quase no fim — o convênio não foi salvo. Tente novamente em alguns minutos.")
+                    salvo = False
+
+                if salvo:
+                    if getattr(db, "write_behind", False):
+                        st.toast("✔ Salvo — enviando ao GitHub em segundo plano")
+                    else:
+                        st.success("✔ Dados atualizados com sucesso!")
+                        time.sleep(0.8)
                     st.rerun()
 
     # BOTÃO PDF
@@ -1312,23 +1572,19 @@ def page_cadastro():
                 key=f"btn_del_conv_{conv_id_str}"
             ):
                 try:
-                    def _update(data):
-                        # remove o registro cujo id == conv_id_str
-                        return [c for c in (data or []) if str(c.get("id")) != conv_id_str]
-
-                    # Atualiza no GitHub de forma atômica (SHA locking)
-                    db.update(_update)
+                    # Remove no GitHub de forma atômica (SHA locking)
+                    db.delete_record(conv_id_str)
 
                     st.success(f"✔ Convênio {conv_id_str} excluído com sucesso!")
 
                     # Limpa caches e estado da UI; recarrega a app
-                    db._cache_data = None
-                    db._cache_sha = None
-                    db._cache_time = 0.0
+                    db.invalidate()
                     st.session_state.clear()
                     time.sleep(1)
                     st.rerun()
 
+                except RateLimitDeferred:
+                    st.warning("⏳ Limite de requisições do GitHub quase no fim — o convênio não foi excluído. Tente novamente em alguns minutos.")
                 except Exception as e:
                     st.error(f"Falha ao excluir convênio {conv_id_str}: {e}")
 
@@ -1344,38 +1600,41 @@ def page_consulta(dados_atuais):
     escolha = st.selectbox("Selecione o convênio:", opcoes)
     conv_id = escolha.split(" || ")[0]
 
-    dados = next((c for c in dados_atuais if str(c.get("id")) == str(conv_id)), None)
+    dados = db.load_record(conv_id)
     if not dados:
         st.error("Erro: convênio não encontrado no banco.")
         return
 
-    ui_section_title(safe_get(dados, "nome"))
+    # Valores já sanitizados (projeção por versão do registro)
+    proj = projetor.project(dados)
+
+    ui_section_title(proj.get("nome"), sanitized=True)
 
     ui_card_start("🧾 Dados de Identificação")
-    ui_info_line("Empresa", safe_get(dados, "empresa"))
-    ui_info_line("Código", safe_get(dados, "codigo"))
-    ui_info_line("Sistema", safe_get(dados, "sistema_utilizado"))
-    ui_info_line("Prazo de Retorno", safe_get(dados, "prazo_retorno"))
+    ui_info_line("Empresa", proj.get("empresa"), sanitized=True)
+    ui_info_line("Código", proj.get("codigo"), sanitized=True)
+    ui_info_line("Sistema", proj.get("sistema_utilizado"), sanitized=True)
+    ui_info_line("Prazo de Retorno", proj.get("prazo_retorno"), sanitized=True)
     ui_card_end()
 
     ui_card_start("🔐 Acesso ao Portal")
-    ui_info_line("Portal", safe_get(dados, "site"))
-    ui_info_line("Login", safe_get(dados, "login"))
-    ui_info_line("Senha", safe_get(dados, "senha"))
+    ui_info_line("Portal", proj.get("site"), sanitized=True)
+    ui_info_line("Login", proj.get("login"), sanitized=True)
+    ui_info_line("Senha", proj.get("senha"), sanitized=True)
     ui_card_end()
 
     ui_card_start("📦 Regras Técnicas")
-    ui_info_line("Prazo Envio", safe_get(dados, "envio"))
-    ui_info_line("Validade da Guia", safe_get(dados, "validade"))
-    ui_info_line("Envia XML?", safe_get(dados, "xml"))
-    ui_info_line("Versão XML", safe_get(dados, "versao_xml"))
-    ui_info_line("Exige NF?", safe_get(dados, "nf"))
-    ui_info_line("Fluxo da Nota", safe_get(dados, "fluxo_nf"))
+    ui_info_line("Prazo Envio", proj.get("envio"), sanitized=True)
+    ui_info_line("Validade da Guia", proj.get("validade"), sanitized=True)
+    ui_info_line("Envia XML?", proj.get("xml"), sanitized=True)
+    ui_info_line("Versão XML", proj.get("versao_xml"), sanitized=True)
+    ui_info_line("Exige NF?", proj.get("nf"), sanitized=True)
+    ui_info_line("Fluxo da Nota", proj.get("fluxo_nf"), sanitized=True)
     ui_card_end()
 
-    ui_block_info("⚙️ Configuração XML", safe_get(dados, "config_gerador"))
-    ui_block_info("🗂 Digitalização e Documentação", safe_get(dados, "doc_digitalizacao"))
-    ui_block_info("⚠️ Observações Críticas", safe_get(dados, "observacoes"))
+    ui_block_info("⚙️ Configuração XML", proj.get("config_gerador"), sanitized=True)
+    ui_block_info("🗂 Digitalização e Documentação", proj.get("doc_digitalizacao"), sanitized=True)
+    ui_block_info("⚠️ Observações Críticas", proj.html, sanitized=True)
 
     st.caption("Manual de Faturamento — Visualização Premium")
 
@@ -1388,14 +1647,35 @@ def page_visualizar_banco(dados_atuais):
         st.info("⚠️ Banco vazio.")
     ui_card_end()
 
+def aviso_atualizacoes():
+    """Toast na sessão quando o poller detecta versão nova no GitHub."""
+    versoes = poller.versions()
+    vistas = st.session_state.setdefault("versoes_vistas", versoes)
+    mudaram = [nome for nome, v in versoes.items() if v != vistas.get(nome)]
+    if mudaram:
+        st.session_state["versoes_vistas"] = versoes
+        st.toast(f"🔄 {', '.join(mudaram).capitalize()} atualizado(s) por outra pessoa — a próxima ação já usa a versão nova.")
+
+# Roda sozinho a cada POLL_INTERVAL s (fragment), sem recarregar a página
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+if poller is not None and _fragment is not None:
+    aviso_atualizacoes = _fragment(run_every=POLL_INTERVAL)(aviso_atualizacoes)
+
 # >>>>>>>>>>> INSTÂNCIA DO MÓDULO DE ROTINAS <<<<<<<<<<
+# Projeções dos convênios (valores sanitizados, observações limpas, imagens)
+projetor = Projector(
+    "convenios", "observacoes", image_handle=image_handle_src, image_url=image_url_src,
+    search_fields=("nome", "codigo", "empresa"),
+)
+
 rotinas_module = RotinasModule(
     db_rotinas=db_rotinas,
     sanitize_text=sanitize_text,
-    build_wrapped_lines=build_wrapped_lines,
+    build_doc_lines=build_doc_lines,
     _pdf_set_fonts=_pdf_set_fonts,
     generate_id=generate_id,
     safe_get=safe_get,
+    blob_store=blobs,
     primary_color=PRIMARY_COLOR,
     setores_opcoes=SETORES_ROTINA,
 )
@@ -1408,7 +1688,21 @@ def main():
     # Aplica CSS e header somente após set_page_config
     st.markdown(CSS_GLOBAL, unsafe_allow_html=True)
 
-    dados_atuais, _ = db.load()
+    # Busca os dois bancos em paralelo (rotinas só aquece o cache compartilhado)
+    res_dados, _ = load_many([db, db_rotinas], return_exceptions=True)
+    if isinstance(res_dados, Exception):
+        raise res_dados
+    dados_atuais, _ = res_dados
+
+    offline_desde = SHARED_CACHE.offline_since()
+    if offline_desde:
+        st.warning(
+            "⚠️ GitHub indisponível ou no limite de requisições — exibindo a última "
+            f"cópia local (somente leitura) desde {time.strftime('%H:%M:%S', time.localtime(offline_desde))}."
+        )
+
+    if poller is not None:
+        aviso_atualizacoes()
 
     st.sidebar.title("📚 Navegação")
 
@@ -1420,14 +1714,139 @@ def main():
     st.sidebar.markdown("---")
     st.sidebar.markdown("### 🔄 Atualizar Sistema")
     if st.sidebar.button("Recarregar"):
+        db.invalidate()
+        db_rotinas.invalidate()
+        # Formulários reabertos passam a usar a versão recarregada como base do merge
+        st.session_state.pop("edicao_convenio", None)
+        st.session_state.pop("edicao_rotina", None)
         st.rerun()
 
+    if STORAGE_LAYOUT == "fatiado" and not dados_atuais:
+        st.sidebar.markdown("### 🧩 Layout fatiado")
+        if st.sidebar.button("Migrar dados.json / rotinas.json"):
+            origem_dados, _ = github_file(FILE_PATH).load(force=True)
+            origem_rotinas, _ = github_file(ROTINAS_FILE_PATH).load(force=True)
+            # Um commit por banco: fragmentos + manifesto + imagens extraídas
+            getattr(db, "store", db).import_records(origem_dados, prepare=lambda rec, tx: blobs.externalize_record(
+                rec, html_fields=("observacoes",), b64_fields=("print_b64",), transaction=tx
+            ))
+            getattr(db_rotinas, "store", db_rotinas).import_records(origem_rotinas, prepare=lambda rec, tx: blobs.externalize_record(
+                rec, html_fields=("descricao",), transaction=tx
+            ))
+            st.sidebar.success(f"✔ {len(origem_dados)} convênios e {len(origem_rotinas)} rotinas migrados.")
+            st.rerun()
+
+    if STORAGE_ENCODING != "json" and _arquivo_monitorado(db).load()[1] is None:
+        st.sidebar.markdown("### 🗜️ Compressão")
+        if st.sidebar.button(f"Migrar JSON legado para {STORAGE_ENCODING}"):
+            relatorio = migrar_codificacao()
+            antes = sum(r["kb_antes"] for r in relatorio)
+            depois = sum(r["kb_depois"] for r in relatorio)
+            st.sidebar.success(
+                f"✔ {len(relatorio)} arquivo(s) migrados: {antes:.0f} KB → {depois:.0f} KB "
+                f"({1 - depois / antes:.0%} menor)" if antes else "✔ Nada a migrar."
+            )
+            st.sidebar.dataframe(pd.DataFrame(relatorio).round(1), hide_index=True, use_container_width=True)
+
+    if fila_gravacao is not None:
+        st.sidebar.markdown("### 📝 Sincronização")
+        fila_status = fila_gravacao.status()
+        if fila_status["pending"]:
+            st.sidebar.warning(f"⏳ {fila_status['pending']} alteração(ões) pendente(s) de envio")
+        elif not fila_status["conflicts"]:
+            st.sidebar.success("✔ Tudo enviado ao GitHub")
+        if fila_status["last_flush"]:
+            st.sidebar.caption(
+                f"Último envio: {time.strftime('%H:%M:%S', time.localtime(fila_status['last_flush']))} • "
+                f"{fila_status['flushed']} registro(s) enviados"
+            )
+        if fila_status["last_error"]:
+            st.sidebar.error(f"Falha no envio (nova tentativa automática): {fila_status['last_error']}")
+        for nome_db, ids in fila_status["conflicts"].items():
+            st.sidebar.error(
+                f"Conflito de edição ({nome_db}): {', '.join(sorted(ids))} — "
+                "abra o registro para refazer a edição ou descartar."
+            )
+
+    cache_stats = SHARED_CACHE.stats()
+    st.sidebar.caption(
+        f"Cache: {cache_stats['hits']} hits • {cache_stats['misses']} misses "
+        f"({cache_stats['hit_rate']:.0%}) • {cache_stats['not_modified']} × 304"
+    )
+
+    if ADMIN_MODE:
+        with st.sidebar.expander("📈 Telemetria do armazenamento", expanded=False):
+            if TELEMETRY.rate_remaining is not None:
+                st.caption(f"Cota restante do GitHub: {TELEMETRY.rate_remaining} requisições")
+            agenda = RATE_LIMITER.stats()
+            st.caption(
+                f"Agendador: {agenda['rate']} req/s • {agenda['deferred']} adiadas • "
+                f"{agenda['collapsed']} leituras coalescidas • {agenda['waited_s']} s de espera"
+            )
+            memo = SANITIZE_MEMO.stats()
+            st.caption(
+                f"Memo de texto: {memo['entries']} entradas • {memo['bytes'] / 1024:.0f} KB de "
+                f"{memo['max_bytes'] / 1048576:.0f} MB • acerto {memo['hit_rate']:.0%} • "
+                f"{memo['evictions']} descartes"
+            )
+            projecoes = PROJECTION_CACHE.stats()
+            st.caption(
+                f"Projeções: {projecoes['entries']} registro(s) • {projecoes['bytes'] / 1024:.0f} KB de "
+                f"{projecoes['max_bytes'] / 1048576:.0f} MB • acerto {projecoes['hit_rate']:.0%} • "
+                f"{projecoes['evictions']} descartes"
+            )
+            quebras = WRAP_CACHE.stats()
+            st.caption(
+                f"Quebra de linhas (PDF): {quebras['entries']} parágrafo(s) • {quebras['bytes'] / 1024:.0f} KB • "
+                f"acerto {quebras['hit_rate']:.0%}"
+            )
+            fontes = PDF_FONTS.stats()
+            if fontes["clone"]:
+                st.caption(
+                    f"Fontes do PDF: {fontes['fonts']} analisada(s) uma vez ({fontes['parse_ms']:.0f} ms) • "
+                    f"{fontes['documents']} PDF(s) • {fontes['saved_ms_per_pdf']:.0f} ms economizados por PDF"
+                )
+            else:
+                st.caption("Fontes do PDF: add_font por PDF (versão do fpdf2 fora da faixa conferida)")
+            imagens = IMAGE_REGISTRY.stats()
+            preparadas = PREPARED_IMAGES.stats()
+            st.caption(
+                f"Imagens: {imagens['entries']} handle(s) • {imagens['bytes'] / 1024:.0f} KB de src retido • "
+                f"dedup {imagens['hit_rate']:.0%} • preparadas p/ impressão: {preparadas['entries']} "
+                f"({preparadas['bytes'] / 1024:.0f} KB, {preparadas['ratio']:.0%} do original, "
+                f"acerto {preparadas['hit_rate']:.0%})"
+            )
+            if poller is not None and poller.last_poll:
+                st.caption(
+                    f"Detector de mudanças: última consulta {time.strftime('%H:%M:%S', time.localtime(poller.last_poll))}"
+                    + (f" • erro: {poller.last_error}" if poller.last_error else "")
+                )
+            resumo = TELEMETRY.summary()
+            if resumo:
+                st.dataframe(pd.DataFrame(resumo).round(1), hide_index=True, use_container_width=True)
+                lentas = sorted(TELEMETRY.recent(200), key=lambda t: t["total_ms"], reverse=True)[:5]
+                st.markdown("**Chamadas mais lentas**")
+                st.dataframe(
+                    pd.DataFrame(lentas)[[
+                        "op", "path", "total_ms", "http_ms", "sleep_ms", "json_ms",
+                        "attempts", "statuses", "rate_remaining", "error",
+                    ]].round(1),
+                    hide_index=True,
+                    use_container_width=True,
+                )
+            else:
+                st.caption("Nenhuma chamada registrada ainda.")
+            tamanhos = size_report()
+            if tamanhos:
+                st.markdown("**Tamanho por arquivo (armazenado × JSON)**")
+                st.dataframe(pd.DataFrame(tamanhos).round(2), hide_index=True, use_container_width=True)
+
     if menu == "Cadastrar / Editar":
         page_cadastro()
     elif menu == "Consulta de Convênios":
         page_consulta(dados_atuais)
     elif menu == "Visualizar Banco":
-        page_visualizar_banco(dados_atuais)
+        page_visualizar_banco(db.load_all())
     elif menu == "Rotinas do Setor":
         rotinas_module.page()
 
@@ -0,0 +1,148 @@
+# bench_sanitizer.py
+# Equivalência e vazão do sanitize_text compilado (text_sanitizer.py)
+#
+#   python bench_sanitizer.py [--arquivo dados.json] [--repeticoes 5] [--fuzz 20000]
+#
+# Compara, byte a byte, a saída de text_sanitizer com a implementação antiga
+# (copiada abaixo como referência) em todos os campos texto do arquivo e em
+# textos aleatórios montados com os caracteres que os passes tratam. Depois
+# mede MB/s (UTF-8 de entrada) das duas versões.
+
+import argparse
+import json
+import random
+import re
+import time
+import unicodedata
+
+import text_sanitizer
+
+
+# ------------------------------------------------------------
+# Referência: versão anterior do app.py, sem alterações
+# ------------------------------------------------------------
+def ref_fix_technical_spacing(txt: str) -> str:
+    if not txt:
+        return ""
+
+    urls = {}
+    def _url_replacer(match):
+        key = f"\u0000{len(urls)}\u0000"
+        urls[key] = match.group(0)
+        return key
+
+    txt = re.sub(r"https?://[^\s<>\"']+", _url_replacer, txt)
+    txt = re.sub(r"(\d)([A-Za-zÁÉÍÓÚÂÊÔÃÕÀÇáéíóúâêôãõàç])", r"\1 \2", txt)
+    txt = re.sub(r"([A-Za-zÁÉÍÓÚÂÊÔÃÕÀÇáéíóúâêôãõàç])(\d)", r"\1 \2", txt)
+    txt = re.sub(r"(?<!\d)\.(?=[^\s\d])", ". ", txt)
+    txt = re.sub(r":(?!\s)", ": ", txt)
+    txt = re.sub(r";(?!\s)", "; ", txt)
+    txt = re.sub(r"\s*>\s*", " > ", txt)
+    txt = re.sub(r"\s*/\s*", " / ", txt)
+    correcoes = {
+        r"PELASMARTKIDS": "PELA SMARTKIDS",
+        r"serpediatria": "ser pediatria",
+        r"depacote": "de pacote",
+        r"diasútil": "dias útil",
+        r"às12:00": "às 12:00",
+        r"sófechar": "só fechar",
+        r"gera oXML": "gera o XML",
+        r"noSisAmil": "no SisAmil"
+    }
+    for erro, certo in correcoes.items():
+        txt = re.sub(erro, certo, txt, flags=re.IGNORECASE)
+    txt = re.sub(r"([•\-–—\*→])([^\s])", r"\1 \2", txt)
+    for k, v in urls.items():
+        txt = txt.replace(k, v)
+    return txt
+
+
+def ref_sanitize_text(text: str) -> str:
+    if not text:
+        return ""
+    txt = str(text)
+    txt = unicodedata.normalize("NFKC", txt)
+    txt = re.sub(r"[\u00A0\u200B-\u200F\uFEFF]", " ", txt)
+    txt = ref_fix_technical_spacing(txt)
+    txt = re.sub(r"[ \t]+", " ", txt)
+    return txt.strip()
+
+
+# ------------------------------------------------------------
+# Entradas
+# ------------------------------------------------------------
+def campos_texto(obj, out):
+    """Todas as strings do JSON (valores de campos, células de tabela...)."""
+    if isinstance(obj, str):
+        out.append(obj)
+    elif isinstance(obj, dict):
+        for v in obj.values():
+            campos_texto(v, out)
+    elif isinstance(obj, list):
+        for v in obj:
+            campos_texto(v, out)
+    return out
+
+
+_PECAS = [
+    "a", "Z", "ç", "É", "1", "90", "3.5", ".", ":", ";", ",", ">", "/", " ", "  ", "\t", "\n",
+    "•", "-", "–", "—", "*", "→", "\u00A0", "\u200B", "\uFEFF", "\uFB01", "http://x.com/a/b", "https://e.org?q=1:2",
+    "PELASMARTKIDS", "serPediatria", "DEPACOTE", "diasútil", "às12:00", "sófechar", "gera oXML",
+    "nosisamil", "ſófechar", "NOSİSAMİL", "dıasútil", "\u0000", "\u00000\u0000", "<b>", "'",
+]
+
+
+def fuzz(n, seed=7):
+    rnd = random.Random(seed)
+    return ["".join(rnd.choice(_PECAS) for _ in range(rnd.randint(1, 25))) for _ in range(n)]
+
+
+def mbps(fn, textos, repeticoes):
+    total = sum(len(t.encode("utf-8")) for t in textos)
+    melhor = float("inf")
+    for _ in range(repeticoes):
+        t0 = time.perf_counter()
+        for t in textos:
+            fn(t)
+        melhor = min(melhor, time.perf_counter() - t0)
+    return total / melhor / 1e6
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--arquivo", default="dados.json")
+    ap.add_argument("--repeticoes", type=int, default=5)
+    ap.add_argument("--fuzz", type=int, default=20000)
+    args = ap.parse_args()
+
+    with open(args.arquivo, encoding="utf-8") as f:
+        textos = campos_texto(json.load(f), [])
+
+    divergencias = 0
+    for t in textos + fuzz(args.fuzz):
+        for novo, ref in (
+            (text_sanitizer._sanitize, ref_sanitize_text),
+            (text_sanitizer.sanitize_text, ref_sanitize_text),
+            (text_sanitizer.fix_technical_spacing, ref_fix_technical_spacing),
+        ):
+            if novo(t) != ref(t):
+                divergencias += 1
+                if divergencias <= 5:
+                    print(f"DIVERGE ({novo.__name__}): {t!r}\n  novo: {novo(t)!r}\n  ref:  {ref(t)!r}")
+    print(f"{len(textos)} campos + {args.fuzz} textos aleatórios: {divergencias} divergências")
+
+    tamanho = sum(len(t.encode("utf-8")) for t in textos) / 1e6
+    antes = mbps(ref_sanitize_text, textos, args.repeticoes)
+    depois = mbps(text_sanitizer._sanitize, textos, args.repeticoes)
+    text_sanitizer.MEMO.clear()
+    memo = mbps(text_sanitizer.sanitize_text, textos, args.repeticoes)
+    print(f"sanitize_text em {args.arquivo} ({tamanho:.2f} MB de texto):")
+    print(f"  anterior : {antes:8.1f} MB/s")
+    print(f"  compilado: {depois:8.1f} MB/s  ({depois / antes:.1f}x)")
+    print(f"  com memo : {memo:8.1f} MB/s  ({memo / antes:.1f}x, reexecução)")
+    print(f"  memo     : {text_sanitizer.MEMO.stats()}")
+    return 1 if divergencias else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
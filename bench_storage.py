@@ -0,0 +1,84 @@
+# bench_storage.py
+# Benchmark de carga do armazenamento contra o emulador local da contents API
+#
+#   python bench_storage.py [--latencia 0.08] [--escritores 8] [--saves 10]
+#
+# Sobe um ContentsAPIEmulator numa pasta temporária (cópia de dados.json),
+# mede leituras (frias e condicionais/304) e dispara escritores concorrentes
+# com update() para medir vazão, conflitos 409 e merges.
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from github_database import GitHubJSON
+from storage_backends import ContentsAPIEmulator, LocalContentsRepo
+from storage_cache import SHARED_CACHE
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--arquivo", default="dados.json")
+    ap.add_argument("--latencia", type=float, default=0.08, help="latência por requisição (s)")
+    ap.add_argument("--leituras", type=int, default=20)
+    ap.add_argument("--escritores", type=int, default=8)
+    ap.add_argument("--saves", type=int, default=5, help="saves por escritor")
+    args = ap.parse_args()
+
+    pasta = tempfile.mkdtemp(prefix="gh-emulador-")
+    try:
+        if os.path.exists(args.arquivo):
+            shutil.copyfile(args.arquivo, os.path.join(pasta, "dados.json"))
+
+        repo = LocalContentsRepo(pasta, latency=args.latencia)
+        emu = ContentsAPIEmulator(repo).start()
+
+        def cliente():
+            return GitHubJSON("local", "local", "bench", "dados.json", api_base=emu.base_url)
+
+        # Leituras: a 1ª baixa o arquivo; as demais são GET condicional (304)
+        db = cliente()
+        t0 = time.perf_counter()
+        dados, _ = db.load(force=True)
+        fria = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        for _ in range(args.leituras):
+            db.load(force=True)
+        quente = (time.perf_counter() - t0) / args.leituras
+        print(f"Leitura fria: {fria * 1000:.1f} ms ({len(dados)} registros)")
+        print(f"Leitura condicional (304): {quente * 1000:.1f} ms/leitura")
+
+        # Escritores concorrentes, cada um editando o próprio registro
+        def escritor(n):
+            db_n = cliente()
+            for i in range(args.saves):
+                def _apply(regs, n=n, i=i):
+                    regs = [r for r in regs if r.get("id") != f"bench-{n}"]
+                    return regs + [{"id": f"bench-{n}", "nome": f"Escritor {n}", "versao": i}]
+                db_n.update(_apply)
+
+        repo.conflicts = 0
+        antes = repo.requests
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(args.escritores) as pool:
+            list(pool.map(escritor, range(args.escritores)))
+        total = time.perf_counter() - t0
+        n_saves = args.escritores * args.saves
+
+        SHARED_CACHE.invalidate()
+        final, _ = cliente().load(force=True)
+        ok = sum(1 for r in final if str(r.get("id", "")).startswith("bench-"))
+        print(f"Saves: {n_saves} em {total:.2f} s ({n_saves / total:.1f} saves/s)")
+        print(f"Conflitos 409: {repo.conflicts} | requisições: {repo.requests - antes}")
+        print(f"Registros de escritores presentes: {ok}/{args.escritores}")
+
+        emu.stop()
+    finally:
+        shutil.rmtree(pasta, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+# bench_wrap.py
+# Equivalência e tempo do wrap_text com tabela de larguras (text_wrap.py)
+#
+#   python bench_wrap.py [--rotinas rotinas.json] [--arquivo dados.json] [--repeticoes 3]
+#
+# Compara, linha a linha, text_wrap.wrap_text com a implementação antiga
+# (copiada abaixo) nos parágrafos da descricao das rotinas, em todos os campos
+# texto do dados.json, numa descricao de 400 KB montada com esses textos e em
+# textos aleatórios com URLs e espaços "estranhos", para várias fontes,
+# tamanhos e larguras. Depois mede o tempo das duas versões e da reexportação
+# (linhas já no WRAP_CACHE).
+
+import argparse
+import json
+import random
+import re
+import time
+
+from fpdf import FPDF
+
+import quill_ir
+import text_wrap
+from bench_sanitizer import campos_texto
+from text_sanitizer import sanitize_text
+
+
+# ------------------------------------------------------------
+# Referência: versão anterior do app.py, sem alterações
+# ------------------------------------------------------------
+def ref_split_token_preserving_delims(token: str):
+    parts = re.split(r"([/?&=._-])", token)
+    segs = []
+    i = 0
+    while i < len(parts):
+        seg = parts[i]
+        if seg == "":
+            i += 1
+            continue
+        if i + 1 < len(parts) and re.fullmatch(r"[/?&=._-]", parts[i+1] or ""):
+            seg += parts[i+1]
+            i += 2
+        else:
+            i += 1
+        segs.append(seg)
+    return segs
+
+
+def ref_wrap_text(text, pdf, max_width):
+    if not text:
+        return [""]
+
+    words = text.split(" ")
+    lines, current = [], ""
+
+    def width(s): return pdf.get_string_width(s)
+
+    for w in words:
+        if not w: continue
+
+        if any(ch in w for ch in "/?&=._-") and width(w) > max_width:
+            segments = ref_split_token_preserving_delims(w)
+            for seg in segments:
+                candidate = current + seg
+                if width(candidate) <= max_width:
+                    current = candidate
+                else:
+                    if current: lines.append(current)
+                    current = seg
+            continue
+
+        candidate = f"{current} {w}".strip() if current else w
+        if width(candidate) <= max_width:
+            current = candidate
+        else:
+            if current: lines.append(current)
+            current = w
+
+    if current:
+        lines.append(current)
+    return lines
+
+
+# ------------------------------------------------------------
+# Entradas
+# ------------------------------------------------------------
+def paragrafos(html):
+    return [sanitize_text(b.text) for b in quill_ir.parse(html) if b.kind != "img"]
+
+
+def descricao_sintetica(textos, tamanho=400 * 1024):
+    """Parágrafos longos (como uma descricao colada de 400 KB) feitos dos textos reais."""
+    rnd = random.Random(3)
+    out, total = [], 0
+    while total < tamanho:
+        par = " ".join(rnd.choice(textos) for _ in range(rnd.randint(5, 60)))
+        out.append(par)
+        total += len(par.encode("utf-8"))
+    return out
+
+
+_PECAS = [
+    "palavra", "Convênio", "çãõ", "90", "DIAS", " ", " ", "  ", "\n", "\t", "\u2028", "\u00a0",
+    "https://portal.exemplo.com.br/faturamento/guia?id=123&tipo=sadt", "C:/pasta/arquivo_final-v2.pdf",
+    "a.b.c.d.e.f.g.h.i.j.k.l.m.n.o.p", "SUPERCALIFRAGILISTICEXPIALIDOCIOUS" * 3, "{nb}", "•", "→", "漢字",
+]
+
+
+def fuzz(n, seed=11):
+    rnd = random.Random(seed)
+    return ["".join(rnd.choice(_PECAS) for _ in range(rnd.randint(1, 40))) for _ in range(n)]
+
+
+def novo_pdf():
+    pdf = FPDF(orientation="P", unit="mm", format="A4")
+    pdf.add_font("DejaVu", "", "DejaVuSans.ttf")
+    pdf.add_font("DejaVu", "B", "DejaVuSans-Bold.ttf")
+    pdf.add_page()
+    return pdf
+
+
+# Fonte/tamanho/largura usados por gerar_pdf e gerar_pdf_rotina (+ extremos)
+_CASOS = [("", 10, 176.4), ("", 10, 172.4), ("", 10, 146.0), ("B", 13, 176.4), ("", 8, 40.0), ("", 10, 3.0)]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rotinas", default="rotinas.json")
+    ap.add_argument("--arquivo", default="dados.json")
+    ap.add_argument("--repeticoes", type=int, default=3)
+    ap.add_argument("--fuzz", type=int, default=3000)
+    args = ap.parse_args()
+
+    with open(args.rotinas, encoding="utf-8") as f:
+        rotinas = json.load(f)
+    with open(args.arquivo, encoding="utf-8") as f:
+        campos = [sanitize_text(t) for t in campos_texto(json.load(f), []) if t]
+
+    descricoes = [p for r in rotinas for p in paragrafos(r.get("descricao") or "")]
+    tamanho_desc = sum(len((r.get("descricao") or "").encode("utf-8")) for r in rotinas)
+    sintetica = descricao_sintetica([c for c in campos if len(c) > 3])
+    pdf = novo_pdf()
+
+    divergencias = 0
+    for textos in (descricoes, campos, sintetica[:200], fuzz(args.fuzz)):
+        for estilo, tamanho, largura in _CASOS:
+            pdf.set_font("DejaVu", estilo, tamanho)
+            for t in textos:
+                novo, ref = text_wrap.wrap_text(t, pdf, largura), ref_wrap_text(t, pdf, largura)
+                if novo != ref:
+                    divergencias += 1
+                    if divergencias <= 5:
+                        print(f"DIVERGE ({estilo or 'R'} {tamanho}pt, {largura} mm): {t[:80]!r}\n  novo: {novo[:3]}\n  ref:  {ref[:3]}")
+    print(f"{len(descricoes)} parágrafos de rotina + {len(campos)} campos + 200 parágrafos longos + "
+          f"{args.fuzz} aleatórios, {len(_CASOS)} fontes/larguras: {divergencias} divergências")
+
+    def tempo(fn, textos, largura=176.4, limpar=True):
+        pdf.set_font("DejaVu", "", 10)
+        melhor = float("inf")
+        for _ in range(args.repeticoes):
+            if limpar:
+                text_wrap.WRAP_CACHE.clear()
+            t0 = time.perf_counter()
+            for t in textos:
+                fn(t, pdf, largura)
+            melhor = min(melhor, time.perf_counter() - t0)
+        return melhor
+
+    for nome, textos in (
+        (f"descricao das rotinas ({tamanho_desc / 1024:.0f} KB de HTML, "
+         f"{sum(map(len, descricoes))} caracteres de texto)", descricoes),
+        (f"campos do {args.arquivo}", campos),
+        (f"descricao sintética ({sum(len(p.encode()) for p in sintetica) / 1024:.0f} KB de texto, "
+         f"{len(sintetica)} parágrafos)", sintetica),
+    ):
+        antes, depois = tempo(ref_wrap_text, textos), tempo(text_wrap.wrap_text, textos)
+        cache = tempo(text_wrap.wrap_text, textos, limpar=False)
+        print(f"{nome}:\n  anterior: {antes * 1000:9.1f} ms\n  tabela  : {depois * 1000:9.1f} ms  "
+              f"({antes / depois if depois else float('inf'):.1f}x)\n  em cache: {cache * 1000:9.1f} ms  "
+              f"({antes / cache if cache else float('inf'):.1f}x, reexportação)")
+    print(f"  cache   : {text_wrap.WRAP_CACHE.stats()}")
+    return 1 if divergencias else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,298 @@
+# blob_store.py
+# Imagens fora do JSON — armazenamento endereçado por conteúdo (SHA-256)
+# Dedup automático | Referência leve no JSON | Resolução preguiçosa (lazy)
+#
+# No salvamento, cada <img src="data:image/...;base64,..."> do Quill e o
+# campo print_b64 viram "blob:sha256:<hex>.<ext>". Os bytes vão para um
+# arquivo separado (pasta local ou blobs/ no repositório GitHub) e só são
+# lidos quando um exportador/editor realmente precisa da imagem.
+
+import base64
+import binascii
+import hashlib
+import os
+import re
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from http_pool import get_session
+from rate_limiter import RATE_LIMITER, WRITE
+
+BLOB_PREFIX = "blob:sha256:"
+BLOB_REF_RE = re.compile(r"blob:sha256:([0-9a-f]{64})\.([a-z0-9]+)")
+
+# src="data:image/png;base64,AAAA" dentro do HTML do Quill
+_DATA_SRC_RE = re.compile(r'src="data:image/([^;"]+);base64,([^"]+)"')
+# src="blob:sha256:<hex>.<ext>"
+_BLOB_SRC_RE = re.compile(r'src="(blob:sha256:[0-9a-f]{64}\.[a-z0-9]+)"')
+
+_EXT_BY_SUBTYPE = {"jpeg": "jpg", "jpg": "jpg", "png": "png", "gif": "gif", "webp": "webp"}
+_SUBTYPE_BY_EXT = {"jpg": "jpeg", "png": "png", "gif": "gif", "webp": "webp"}
+
+
+def is_blob_ref(value) -> bool:
+    return isinstance(value, str) and value.startswith(BLOB_PREFIX)
+
+
+def sniff_ext(data: bytes) -> str:
+    """Detecta a extensão pelos bytes mágicos (fallback: png)."""
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    if data[:3] == b"\xff\xd8\xff":
+        return "jpg"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return "png"
+
+
+# ------------------------------------------------------------
+# Cache de bytes por processo — blobs são imutáveis, então é
+# seguro compartilhar entre sessões e entre instâncias de store
+# ------------------------------------------------------------
+class _BlobMemoryCache:
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._items = OrderedDict()  # digest -> bytes
+        self._size = 0
+
+    def get(self, digest):
+        with self._lock:
+            data = self._items.get(digest)
+            if data is not None:
+                self._items.move_to_end(digest)
+            return data
+
+    def put(self, digest, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(digest, None)
+            if old is not None:
+                self._size -= len(old)
+            self._items[digest] = data
+            self._size += len(data)
+            while self._size > self.max_bytes and self._items:
+                _, evicted = self._items.popitem(last=False)
+                self._size -= len(evicted)
+
+
+_MEMORY = _BlobMemoryCache()
+_KNOWN = set()          # (location, digest) já gravados neste processo
+_KNOWN_LOCK = threading.Lock()
+
+
+def _remember(key):
+    with _KNOWN_LOCK:
+        _KNOWN.add(key)
+
+
+class BlobStore(ABC):
+    """
+    Base comum: endereçamento por SHA-256, dedup e (des)referência de
+    HTML/base64. Subclasses implementam apenas _write(name, data) e
+    _read(name) — abstratos: sem eles a classe nem instancia.
+    """
+
+    location = "memory"
+
+    # ============================================================
+    # API BÁSICA
+    # ============================================================
+    def put(self, data: bytes, ext=None, transaction=None) -> str:
+        """
+        Grava o blob (se ainda não conhecido) e devolve a referência.
+        Com transaction (GitTransaction), o arquivo entra no mesmo commit do
+        JSON em vez de ser gravado na hora.
+        """
+        ext = ext or sniff_ext(data)
+        digest = hashlib.sha256(data).hexdigest()
+        ref = f"{BLOB_PREFIX}{digest}.{ext}"
+
+        key = (self.location, digest)
+        with _KNOWN_LOCK:
+            already = key in _KNOWN
+        if not already:
+            if transaction is not None and self._stage(transaction, f"{digest}.{ext}", data):
+                transaction.on_commit(lambda shas: _remember(key))
+            else:
+                self._write(f"{digest}.{ext}", data)
+                _remember(key)
+        _MEMORY.put(digest, data)
+        return ref
+
+    def get(self, ref: str) -> bytes:
+        m = BLOB_REF_RE.fullmatch(ref or "")
+        if not m:
+            raise ValueError(f"Referência de blob inválida: {ref!r}")
+        digest, ext = m.group(1), m.group(2)
+        data = _MEMORY.get(digest)
+        if data is None:
+            data = self._read(f"{digest}.{ext}")
+            if hashlib.sha256(data).hexdigest() != digest:
+                raise ValueError(f"Blob corrompido: {digest}")
+            _MEMORY.put(digest, data)
+        return data
+
+    @abstractmethod
+    def _write(self, name, data):
+        """Grava os bytes do blob `name` (<sha256>.<ext>) no armazenamento."""
+
+    @abstractmethod
+    def _read(self, name):
+        """Bytes do blob `name`; levanta exceção se não existir."""
+
+    def _stage(self, tx, name, data):
+        """Prepara o blob em uma GitTransaction; False = não suportado."""
+        return False
+
+    # ============================================================
+    # HTML DO QUILL
+    # ============================================================
+    def externalize_html(self, html, transaction=None):
+        """data:image;base64 -> blob:sha256 (usado no momento do save)."""
+        if not html or "data:image/" not in html:
+            return html
+
+        def _sub(match):
+            try:
+                data = base64.b64decode(match.group(2))
+            except (binascii.Error, ValueError):
+                return match.group(0)
+            ext = _EXT_BY_SUBTYPE.get(match.group(1).lower()) or sniff_ext(data)
+            return f'src="{self.put(data, ext, transaction)}"'
+
+        return _DATA_SRC_RE.sub(_sub, html)
+
+    def inline_html(self, html):
+        """blob:sha256 -> data:image;base64 (para o editor Quill exibir)."""
+        if not html or BLOB_PREFIX not in html:
+            return html
+
+        def _sub(match):
+            ref = match.group(1)
+            try:
+                data = self.get(ref)
+            except Exception as e:
+                print(f"Erro ao carregar blob {ref}: {e}")
+                return match.group(0)
+            subtype = _SUBTYPE_BY_EXT.get(ref.rsplit(".", 1)[-1], "png")
+            return f'src="data:image/{subtype};base64,{base64.b64encode(data).decode()}"'
+
+        return _BLOB_SRC_RE.sub(_sub, html)
+
+    # ============================================================
+    # CAMPOS BASE64 (print_b64)
+    # ============================================================
+    def externalize_b64(self, value, transaction=None):
+        if not value or is_blob_ref(value):
+            return value
+        try:
+            data = base64.b64decode(value)
+        except (binascii.Error, ValueError):
+            return value
+        return self.put(data, transaction=transaction)
+
+    def resolve_bytes(self, value) -> bytes:
+        """Aceita tanto referência de blob quanto base64 legado."""
+        if not value:
+            return b""
+        if is_blob_ref(value):
+            return self.get(value)
+        return base64.b64decode(value)
+
+    def externalize_record(self, record, html_fields=(), b64_fields=(), transaction=None):
+        """Cópia do registro com todas as imagens trocadas por referências."""
+        out = dict(record)
+        for f in html_fields:
+            if out.get(f):
+                out[f] = self.externalize_html(out[f], transaction)
+        for f in b64_fields:
+            if out.get(f):
+                out[f] = self.externalize_b64(out[f], transaction)
+        return out
+
+
+class LocalBlobStore(BlobStore):
+    """Blobs em uma pasta local (um arquivo por SHA-256)."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.location = f"file:{os.path.abspath(directory)}"
+        os.makedirs(directory, exist_ok=True)
+
+    def _write(self, name, data):
+        path = os.path.join(self.directory, name)
+        if os.path.exists(path):
+            return
+        tmp = f"{path}.tmp{os.getpid()}"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _read(self, name):
+        with open(os.path.join(self.directory, name), "rb") as f:
+            return f.read()
+
+
+class GitHubBlobStore(BlobStore):
+    """Blobs como arquivos separados no repositório (pasta blobs/)."""
+
+    API_URL = "{base}/repos/{owner}/{repo}/contents/{path}"
+
+    def __init__(self, token, owner, repo, branch="main", prefix="blobs", session=None,
+                 api_base="https://api.github.com"):
+        self.session = session or get_session()
+        self.token = token
+        self.owner = owner
+        self.repo = repo
+        self.branch = branch
+        self.api_base = api_base.rstrip("/")
+        self.prefix = prefix.strip("/")
+        self.location = f"github:{owner}/{repo}@{branch}/{self.prefix}"
+        if "api.github.com" not in self.api_base:
+            self.location = f"{self.api_base}|{self.location}"
+
+    def _url(self, name):
+        return self.API_URL.format(base=self.api_base, owner=self.owner, repo=self.repo, path=f"{self.prefix}/{name}")
+
+    def _write(self, name, data):
+        payload = {
+            "message": f"Imagem {name[:12]} — Manual Faturamento",
+            "content": base64.b64encode(data).decode("utf-8"),
+            "branch": self.branch,
+        }
+        headers = {
+            "Authorization": f"Bearer {self.token}",
+            "Accept": "application/vnd.github.v3+json",
+        }
+        with RATE_LIMITER.priority(WRITE):
+            RATE_LIMITER.acquire()
+            r = self.session.put(self._url(name), headers=headers, json=payload, timeout=(6, 60))
+        RATE_LIMITER.observe(r)
+        if r.status_code in (200, 201):
+            return
+        # 422 "sha wasn't supplied" = arquivo já existe; como o nome é o hash,
+        # o conteúdo é idêntico e não há nada a fazer
+        if r.status_code == 422 and "sha" in r.text.lower():
+            return
+        raise Exception(f"GitHub PUT blob error: {r.status_code} - {r.text}")
+
+    def _stage(self, tx, name, data):
+        tx.put_bytes(f"{self.prefix}/{name}", data)
+        return True
+
+    def _read(self, name):
+        headers = {
+            "Authorization": f"Bearer {self.token}",
+            "Accept": "application/vnd.github.raw",  # bytes crus (aceita > 1 MB)
+        }
+        RATE_LIMITER.acquire()
+        r = self.session.get(self._url(name), headers=headers, params={"ref": self.branch}, timeout=(6, 60))
+        RATE_LIMITER.observe(r)
+        if r.status_code != 200:
+            raise Exception(f"GitHub GET blob error: {r.status_code} - {r.text}")
+        return r.content
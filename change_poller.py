@@ -0,0 +1,104 @@
+# change_poller.py
+# Detector de mudanças no GitHub — um por processo, em 2º plano
+# GET condicional do último commit de cada arquivo | 304 não gasta cota
+#
+# Em vez de cada sessão revalidar dados.json / rotinas.json por conta própria,
+# uma thread pergunta a cada `interval` segundos qual o último commit que tocou
+# cada arquivo (commits?path=...&per_page=1 com If-None-Match). Só quando o
+# commit muda o snapshot compartilhado é recarregado — uma vez para todas as
+# sessões — e a versão do arquivo sobe, para as sessões avisarem o usuário.
+
+import threading
+import time
+
+from rate_limiter import BACKGROUND, RATE_LIMITER, RateLimitDeferred
+from storage_telemetry import TELEMETRY
+
+
+class ChangePoller:
+    def __init__(self, interval=20.0):
+        self.interval = float(interval)
+
+        self._lock = threading.Lock()
+        self._files = {}      # nome -> cliente com head_commit() / refresh()
+        self._etags = {}      # nome -> ETag da consulta de commits
+        self._commits = {}    # nome -> último commit visto
+        self._versions = {}   # nome -> nº de mudanças detectadas
+        self._worker = None
+
+        # Status para a UI
+        self.last_poll = None
+        self.last_change = None
+        self.last_error = None
+
+    def watch(self, name, client):
+        """Passa a acompanhar um arquivo (GitHubJSON ou compatível)."""
+        with self._lock:
+            if name not in self._files:
+                self._files[name] = client
+                self._versions.setdefault(name, 0)
+        self.start()
+
+    def versions(self):
+        with self._lock:
+            return dict(self._versions)
+
+    # ============================================================
+    # CONSULTA
+    # ============================================================
+    def poll_once(self):
+        """Uma rodada de consultas. Retorna os nomes que mudaram."""
+        with self._lock:
+            files = list(self._files.items())
+
+        changed = []
+        for name, client in files:
+            try:
+                with TELEMETRY.trace("poll", client.path), RATE_LIMITER.priority(BACKGROUND):
+                    commit, etag = client.head_commit(self._etags.get(name))
+                    if commit is None or commit == self._commits.get(name):
+                        continue  # 304 ou mesmo commit
+                    first = name not in self._commits
+                    if not first:
+                        client.refresh()  # se falhar, a próxima rodada repete
+                    self._etags[name] = etag
+                    self._commits[name] = commit
+                if first:
+                    continue  # 1ª rodada só registra o ponto de partida
+                with self._lock:
+                    self._versions[name] += 1
+                changed.append(name)
+                self.last_change = time.time()
+            except RateLimitDeferred:
+                pass  # cota curta: tenta na próxima rodada
+            except Exception as e:
+                self.last_error = f"{name}: {e}"
+                continue
+            self.last_error = None
+
+        self.last_poll = time.time()
+        return changed
+
+    def _run(self):
+        while True:
+            self.poll_once()
+            time.sleep(self.interval)
+
+    def start(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="change-poller", daemon=True)
+                self._worker.start()
+
+
+_POLLER = None
+_POLLER_LOCK = threading.Lock()
+
+
+def get_poller(interval=20.0):
+    """Um poller por processo (o app.py é reexecutado a cada rerun)."""
+    global _POLLER
+    with _POLLER_LOCK:
+        if _POLLER is None:
+            _POLLER = ChangePoller(interval)
+        return _POLLER
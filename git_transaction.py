@@ -0,0 +1,169 @@
+# git_transaction.py
+# Commit atômico de vários arquivos via Git Data API (trees/commits/refs)
+# N arquivos -> 1 commit | Nº fixo de chamadas HTTP | Fast-forward com retry
+#
+# Fluxo do commit (5 chamadas, independe de quantos arquivos de texto):
+#   1. GET   git/ref/heads/<branch>      -> commit atual
+#   2. GET   git/commits/<sha>           -> tree base
+#   3. POST  git/trees                   -> nova tree (conteúdo inline)
+#   4. POST  git/commits                 -> novo commit
+#   5. PATCH git/refs/heads/<branch>     -> fast-forward (force=False)
+# Arquivos binários (imagens) precisam de 1 POST git/blobs cada, feito uma
+# única vez antes do laço de tentativas.
+
+import base64
+import hashlib
+import json
+import random
+
+from http_pool import get_session
+from rate_limiter import RATE_LIMITER, WRITE
+from storage_telemetry import TELEMETRY
+
+
+def git_blob_sha(data: bytes) -> str:
+    """SHA que o Git (e a contents API) atribui ao conteúdo."""
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+class GitTransaction:
+    """
+    Acumula alterações de arquivos e publica tudo em um único commit.
+
+    Semântica de substituição: cada arquivo preparado substitui o conteúdo
+    do branch no momento do commit (como um save sem SHA locking). O
+    fast-forward garante que nenhum commit alheio é descartado.
+    """
+
+    API_ROOT = "{base}/repos/{owner}/{repo}/git"
+
+    def __init__(self, token, owner, repo, branch="main", session=None, api_base="https://api.github.com"):
+        self.token = token
+        self.owner = owner
+        self.repo = repo
+        self.branch = branch
+        self.api_base = api_base.rstrip("/")
+        self.session = session or get_session()
+
+        self._changes = {}      # path -> {"content"| "bytes" | "delete"}
+        self._callbacks = []    # funções(blob_shas) chamadas após o commit
+
+    @property
+    def headers(self):
+        return {
+            "Authorization": f"Bearer {self.token}",
+            "Accept": "application/vnd.github.v3+json",
+        }
+
+    def _url(self, suffix):
+        return self.API_ROOT.format(base=self.api_base, owner=self.owner, repo=self.repo) + suffix
+
+    def __len__(self):
+        return len(self._changes)
+
+    # ============================================================
+    # PREPARAÇÃO (stage)
+    # ============================================================
+    def put_text(self, path, text):
+        """Prepara um arquivo UTF-8; devolve o SHA do blob (calculado local)."""
+        raw = text.encode("utf-8")
+        self._changes[path] = {"content": text, "sha": git_blob_sha(raw)}
+        return self._changes[path]["sha"]
+
+    def put_json(self, path, data, indent=4):
+        return self.put_text(path, json.dumps(data, indent=indent, ensure_ascii=False))
+
+    def put_bytes(self, path, data: bytes):
+        """Prepara um arquivo binário (ex.: imagem do blob store)."""
+        self._changes[path] = {"bytes": data, "sha": git_blob_sha(data)}
+        return self._changes[path]["sha"]
+
+    def delete(self, path):
+        self._changes[path] = {"delete": True, "sha": None}
+
+    def on_commit(self, fn):
+        """Registra fn(blob_shas: dict path->sha) para rodar após o sucesso."""
+        self._callbacks.append(fn)
+
+    # ============================================================
+    # PUBLICAÇÃO
+    # ============================================================
+    def _send(self, method, suffix, **kwargs):
+        """Requisição agendada (rate limit), medida e com a cota sincronizada."""
+        tr = TELEMETRY.current()
+        tr.sleep_s += RATE_LIMITER.acquire()
+        r = tr.call(self.session.request, method, self._url(suffix), headers=self.headers, timeout=(6, 60), **kwargs)
+        RATE_LIMITER.observe(r)
+        return r
+
+    def _request(self, method, suffix, expected, **kwargs):
+        r = self._send(method, suffix, **kwargs)
+        if r.status_code not in expected:
+            raise Exception(f"GitHub {method} {suffix} error: {r.status_code} - {r.text}")
+        return r.json()
+
+    def _upload_binaries(self):
+        for change in self._changes.values():
+            if "bytes" in change and not change.get("uploaded"):
+                self._request("POST", "/blobs", (201,), json={
+                    "content": base64.b64encode(change["bytes"]).decode("utf-8"),
+                    "encoding": "base64",
+                })
+                change["uploaded"] = True
+
+    def _tree_entries(self):
+        entries = []
+        for path, change in self._changes.items():
+            entry = {"path": path, "mode": "100644", "type": "blob"}
+            if "content" in change:
+                entry["content"] = change["content"]
+            else:
+                entry["sha"] = change["sha"]  # None remove o arquivo
+            entries.append(entry)
+        return entries
+
+    def commit(self, message, retries=6):
+        """
+        Publica as alterações em um único commit. Se o branch andar entre a
+        leitura e o PATCH (422 não fast-forward), refaz a tree sobre o novo
+        topo. Retorna dict {path: blob_sha} (None para removidos).
+        """
+        if not self._changes:
+            return {}
+
+        with TELEMETRY.trace("commit", f"{len(self._changes)} arquivo(s)") as tr, RATE_LIMITER.priority(WRITE):
+            self._upload_binaries()
+            ref_suffix = f"/refs/heads/{self.branch}"
+
+            for attempt in range(retries):
+                tr.attempts += 1
+                head = self._request("GET", f"/ref/heads/{self.branch}", (200,))["object"]["sha"]
+                base_tree = self._request("GET", f"/commits/{head}", (200,))["tree"]["sha"]
+
+                tree = self._request("POST", "/trees", (201,), json={
+                    "base_tree": base_tree,
+                    "tree": self._tree_entries(),
+                })
+                new_commit = self._request("POST", "/commits", (201,), json={
+                    "message": message,
+                    "tree": tree["sha"],
+                    "parents": [head],
+                })
+
+                r = self._send("PATCH", ref_suffix, json={"sha": new_commit["sha"], "force": False})
+                if r.status_code == 200:
+                    shas = {path: change["sha"] for path, change in self._changes.items()}
+                    for fn in self._callbacks:
+                        fn(shas)
+                    self._changes.clear()
+                    self._callbacks.clear()
+                    return shas
+
+                # Branch andou (outro commit entrou no meio) — tenta sobre o novo topo
+                if r.status_code in (409, 422):
+                    tr.sleep((2 ** attempt) * 0.15 + random.random() * 0.2)
+                    continue
+
+                raise Exception(f"GitHub PATCH ref error: {r.status_code} - {r.text}")
+
+            raise TimeoutError("Falha ao publicar o commit após múltiplas tentativas.")
@@ -2,14 +2,24 @@
 # github_database.py — Versão Premium Estável (robusta)
 # Seguro | Atômico | Anti-race | SHA locking real | Timeouts | Auto-healing JSON
 
-import requests
 import base64
 import json
 import time
 import random
 
+from storage_cache import SHARED_CACHE
+from http_pool import FETCH_POOL, get_session
+from storage_backends import GITHUB_API
+from storage_telemetry import TELEMETRY
+from rate_limiter import BACKGROUND, RATE_LIMITER, WRITE, RateLimitDeferred
+from git_transaction import GitTransaction
+from record_merge import three_way_merge
+from json_codec import check_encoding, pack, record_size, unpack
+from lazy_records import HEAVY_FIELDS, loads as lazy_loads
+
 class GitHubJSON:
-    API_URL = "https://api.github.com/repos/{owner}/{repo}/contents/{path}"
+    API_URL = "{base}/repos/{owner}/{repo}/contents/{path}"
+    COMMITS_URL = "{base}/repos/{owner}/{repo}/commits"
 
     def __init__(
         self,
@@ -19,7 +29,13 @@ class GitHubJSON:
         path="dados.json",
         branch="main",
         max_bytes=None,               # opcional: limite de tamanho do JSON
-        user_agent="GABMA-Manual/1.0" # User-Agent p/ diagnósticos
+        user_agent="GABMA-Manual/1.0", # User-Agent p/ diagnósticos
+        cache_ttl=None,               # opcional: TTL do cache compartilhado
+        session=None,                 # opcional: requests.Session própria
+        api_base=GITHUB_API,          # opcional: emulador local (storage_backends)
+        encoding="json",              # opcional: "gzip"/"zstd" (json_codec)
+        legacy_path=None,             # opcional: JSON legado lido até a migração
+        lazy_fields=HEAVY_FIELDS,     # campos decodificados só no 1º acesso
     ):
         self.token = token
         self.owner = owner
@@ -28,11 +44,29 @@ class GitHubJSON:
         self.branch = branch
         self.max_bytes = max_bytes
         self.user_agent = user_agent
-
-        # Cache ultra-curto para evitar GET múltiplos desnecessários
-        self._cache_data = None
-        self._cache_sha = None
-        self._cache_time = 0.0
+        self.api_base = api_base.rstrip("/")
+        self.encoding = check_encoding(encoding)
+        self.legacy_path = legacy_path
+        self.lazy_fields = frozenset(lazy_fields or ())
+
+        # Conexões keep-alive compartilhadas por todas as instâncias
+        self.session = session or get_session()
+
+        # Cache compartilhado pelo processo (chave owner/repo/path/branch)
+        self.cache_ttl = cache_ttl
+        self._cache_key = SHARED_CACHE.make_key(owner, repo, path, branch, self.api_base)
+
+    def invalidate(self):
+        """Descarta o snapshot compartilhado deste arquivo."""
+        SHARED_CACHE.invalidate(self._cache_key)
+
+    def _legacy(self):
+        """Cliente do arquivo JSON legado (texto), para leitura/migração."""
+        return GitHubJSON(
+            self.token, self.owner, self.repo, self.legacy_path, self.branch,
+            max_bytes=self.max_bytes, user_agent=self.user_agent, cache_ttl=self.cache_ttl,
+            session=self.session, api_base=self.api_base,
+        )
 
     # ============================================================
     # HEADERS
@@ -46,54 +80,166 @@ class GitHubJSON:
         }
 
     # ============================================================
-    # LOAD — Leitura segura do JSON (Cache 200ms) + Auto-healing
+    # LOAD — Leitura segura do JSON (Cache compartilhado) + Auto-healing
     # ============================================================
     def load(self, force=False):
-        now = time.time()
-        if not force and self._cache_data is not None:
-            if (now - self._cache_time) < 0.2:  # cache curtíssimo
-                return self._cache_data, self._cache_sha
+        with TELEMETRY.trace("load", self.path) as tr:
+            if not force:
+                cached = SHARED_CACHE.get(self._cache_key, ttl=self.cache_ttl)
+                if cached is not None:
+                    tr.served("cache")
+                    return cached
+
+                # Stale-while-revalidate: snapshot vencido (ou do disco, na partida
+                # a frio) sai na hora e a revalidação roda em segundo plano
+                stale = SHARED_CACHE.get_stale(self._cache_key)
+                if stale is not None:
+                    if SHARED_CACHE.begin_refresh(self._cache_key):
+                        FETCH_POOL.submit(self._background_refresh)
+                    tr.served("stale")
+                    return stale
+
+            try:
+                # Leituras simultâneas do mesmo arquivo viram uma requisição só
+                return RATE_LIMITER.collapse(self._cache_key, self._fetch)
+            except Exception:
+                # GitHub lento/fora/rate limit: cópia local só-leitura, se houver
+                stale = SHARED_CACHE.get_stale(self._cache_key)
+                if stale is None:
+                    raise
+                SHARED_CACHE.mark_offline(self._cache_key)
+                tr.served("offline")
+                return stale
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except RateLimitDeferred:
+            pass  # cota curta: o snapshot atual continua valendo
+        except Exception as e:
+            SHARED_CACHE.mark_offline(self._cache_key)
+            print(f"Revalidação de {self.path} falhou: {e}")
+        finally:
+            SHARED_CACHE.end_refresh(self._cache_key)
+
+    def refresh(self):
+        """Revalida o snapshot agora, com prioridade de 2º plano."""
+        with TELEMETRY.trace("refresh", self.path), RATE_LIMITER.priority(BACKGROUND):
+            return RATE_LIMITER.collapse(self._cache_key, self._fetch)
+
+    def head_commit(self, etag=None):
+        """
+        Último commit que tocou este arquivo (GET condicional, usado pelo
+        ChangePoller). Retorna (sha, etag); sha None quando nada mudou (304).
+        """
+        url = self.COMMITS_URL.format(base=self.api_base, owner=self.owner, repo=self.repo)
+        headers = dict(self.headers, **{"If-None-Match": etag}) if etag else self.headers
+        params = {"sha": self.branch, "path": self.path, "per_page": 1}
 
-        url = self.API_URL.format(owner=self.owner, repo=self.repo, path=self.path)
-        r = requests.get(
+        r = self._send(self.session.get, url, headers=headers, params=params, timeout=(6, 30))
+        if r.status_code == 304:
+            return None, etag
+        if r.status_code != 200:
+            raise Exception(f"GitHub GET commits error: {r.status_code} - {r.text}")
+        commits = r.json()
+        return (commits[0]["sha"] if commits else ""), r.headers.get("ETag")
+
+    def _send(self, method, *args, **kwargs):
+        """
+        Uma requisição HTTP: passa pelo agendador de rate limit (prioridade da
+        thread), é medida pela telemetria e sincroniza a cota com os cabeçalhos.
+        """
+        tr = TELEMETRY.current()
+        tr.sleep_s += RATE_LIMITER.acquire()
+        r = tr.call(method, *args, **kwargs)
+        RATE_LIMITER.observe(r)
+        return r
+
+    def _fetch(self):
+        tr = TELEMETRY.current()
+        url = self.API_URL.format(base=self.api_base, owner=self.owner, repo=self.repo, path=self.path)
+
+        # GET condicional: 304 não traz corpo nem consome rate limit
+        headers = self.headers
+        etag = SHARED_CACHE.etag(self._cache_key)
+        if etag:
+            headers = dict(headers, **{"If-None-Match": etag})
+
+        r = self._send(
+            self.session.get,
             url,
-            headers=self.headers,
+            headers=headers,
             params={"ref": self.branch},
             timeout=(6, 30),
         )
 
+        if r.status_code == 304:
+            cached = SHARED_CACHE.revalidate(self._cache_key)
+            if cached is not None:
+                tr.served("304")
+                return cached
+            # Snapshot invalidado no meio do caminho — refaz sem condicional
+            r = self._send(
+                self.session.get,
+                url,
+                headers=self.headers,
+                params={"ref": self.branch},
+                timeout=(6, 30),
+            )
+
         if r.status_code == 404:
-            # Arquivo não existe — retorna base vazia
-            self._cache_data = []
-            self._cache_sha = None
-            self._cache_time = now
-            return [], None
+            # Arquivo não existe — base vazia; no formato comprimido ainda não
+            # migrado, lê o JSON legado (o próximo save já cria o novo arquivo)
+            parsed = []
+            if self.legacy_path:
+                parsed, _ = self._legacy().load(force=True)
+            SHARED_CACHE.put(self._cache_key, parsed, None)
+            return parsed, None
 
         if r.status_code != 200:
             raise Exception(f"GitHub GET error: {r.status_code} - {r.text}")
 
         body = r.json()
         sha = body.get("sha")
+
+        # Mesmo SHA do snapshot guardado (ex.: ETag perdido): dispensa o parse
+        known = SHARED_CACHE.parsed_for_sha(self._cache_key, sha)
+        if known is not None:
+            SHARED_CACHE.put(self._cache_key, known, sha, etag=r.headers.get("ETag"))
+            return known, sha
+
         content_b64 = body.get("content") or ""
+        t0 = time.perf_counter()
         try:
-            decoded = base64.b64decode(content_b64).decode("utf-8")
+            stored = base64.b64decode(content_b64)
+            tr.b64_s += time.perf_counter() - t0
+            # Comprimido ou texto: detectado pelos bytes, não pela extensão
+            t0 = time.perf_counter()
+            raw = unpack(stored)
+            tr.json_s += time.perf_counter() - t0
+            decoded = raw.decode("utf-8")
         except Exception:
             # Conteúdo ilegível: assume base vazia
-            decoded = ""
+            stored, raw, decoded = b"", b"", ""
+        tr.b64_bytes += len(content_b64)
+        tr.raw_bytes += len(stored)
+        record_size(self.path, len(stored), len(raw))
 
         # Auto-healing p/ arquivo vazio/ inválido
+        t0 = time.perf_counter()
         parsed = []
         if decoded.strip():
             try:
-                parsed = json.loads(decoded)
+                parsed = lazy_loads(decoded, self.lazy_fields)
             except json.JSONDecodeError:
                 # Remove BOM, tenta de novo
                 decoded2 = decoded.lstrip("\ufeff").strip()
                 try:
-                    parsed = json.loads(decoded2)
+                    parsed = lazy_loads(decoded2, self.lazy_fields)
                 except json.JSONDecodeError:
                     # Não deu: mantém como lista vazia (auto-healing na memória)
                     parsed = []
+        tr.json_s += time.perf_counter() - t0
 
         if not isinstance(parsed, list):
             parsed = []
@@ -106,12 +252,42 @@ class GitHubJSON:
                 # Se não conseguimos medir, seguimos, mas é raro
                 pass
 
-        # Atualiza cache
-        self._cache_data = parsed
-        self._cache_sha = sha
-        self._cache_time = now
+        # Atualiza cache compartilhado
+        SHARED_CACHE.put(self._cache_key, parsed, sha, etag=r.headers.get("ETag"))
         return parsed, sha
 
+    # ============================================================
+    # PUT — Uma gravação na contents API (usada por save e update)
+    # ============================================================
+    def _put(self, new_data, sha, commit_message=None, encoded_json_bytes=None):
+        tr = TELEMETRY.current()
+        if encoded_json_bytes is None:
+            t0 = time.perf_counter()
+            encoded_json_bytes = pack(new_data, self.encoding, indent=2, path=self.path)
+            tr.json_s += time.perf_counter() - t0
+            if self.max_bytes is not None and len(encoded_json_bytes) > self.max_bytes:
+                raise ValueError("new_data excede o limite de tamanho configurado.")
+
+        url = self.API_URL.format(base=self.api_base, owner=self.owner, repo=self.repo, path=self.path)
+        t0 = time.perf_counter()
+        content_b64 = base64.b64encode(encoded_json_bytes).decode("utf-8")
+        tr.b64_s += time.perf_counter() - t0
+        tr.raw_bytes += len(encoded_json_bytes)
+        tr.b64_bytes += len(content_b64)
+        payload = {
+            "message": commit_message or "Atualização Manual Faturamento — GABMA",
+            "content": content_b64,
+            "sha": sha,           # None cria arquivo; SHA válido atualiza
+            "branch": self.branch,
+        }
+
+        r = self._send(self.session.put, url, headers=self.headers, json=payload, timeout=(6, 30))
+
+        if r.status_code in (200, 201):
+            # Substitui o snapshot compartilhado pelo que acabamos de gravar
+            SHARED_CACHE.put(self._cache_key, new_data, r.json()["content"]["sha"])
+        return r
+
     # ============================================================
     # SAVE — Salvamento 100% atômico com SHA locking real
     # ============================================================
@@ -119,92 +295,116 @@ class GitHubJSON:
         if not isinstance(new_data, list):
             raise ValueError("new_data deve ser uma lista JSON serializável.")
 
-        # Serializa já no início (para detectar erros cedo)
-        encoded_json_bytes = json.dumps(new_data, indent=2, ensure_ascii=False).encode("utf-8")
-        if self.max_bytes is not None and len(encoded_json_bytes) > self.max_bytes:
-            raise ValueError("new_data excede o limite de tamanho configurado.")
-
-        encoded_b64 = base64.b64encode(encoded_json_bytes).decode("utf-8")
-        msg = commit_message or "Atualização Manual Faturamento — GABMA"
-
-        for attempt in range(retries):
-            # SHA sempre atualizado (evita cache sujo)
-            _, sha = self.load(force=True)
-
-            url = self.API_URL.format(owner=self.owner, repo=self.repo, path=self.path)
-            payload = {
-                "message": msg,
-                "content": encoded_b64,
-                "sha": sha,           # None cria arquivo; SHA válido atualiza
-                "branch": self.branch,
-            }
-
-            r = requests.put(url, headers=self.headers, json=payload, timeout=(6, 30))
-
-            if r.status_code in (200, 201):
-                body = r.json()
-                new_sha = body["content"]["sha"]
-
-                # Atualiza cache local
-                self._cache_data = new_data
-                self._cache_sha = new_sha
-                self._cache_time = time.time()
-                return True
-
-            # Conflito (arquivo mudou no GitHub) — backoff exponencial com jitter
-            if r.status_code == 409:
-                time.sleep((2 ** attempt) * 0.2 + random.random() * 0.3)
-                continue
-
-            # Rate limit — se tiver reset, aguarda (fallback 3s)
-            if r.status_code == 403 and "rate" in r.text.lower():
-                reset = r.headers.get("X-RateLimit-Reset")
-                if reset:
-                    try:
-                        wait = max(0.0, float(reset) - time.time()) + 1.0
-                        time.sleep(min(wait, 10.0))
-                    except Exception:
-                        time.sleep(3 + random.random())
-                else:
-                    time.sleep(3 + random.random())
-                continue
-
-            # Demais erros: levanta exceção com detalhes
-            raise Exception(f"GitHub PUT error: {r.status_code} - {r.text}")
-
-        raise TimeoutError("Falha ao salvar após múltiplas tentativas.")
+        with TELEMETRY.trace("save", self.path) as tr, RATE_LIMITER.priority(WRITE):
+            # Serializa já no início (para detectar erros cedo)
+            t0 = time.perf_counter()
+            encoded_json_bytes = pack(new_data, self.encoding, indent=2, path=self.path)
+            tr.json_s += time.perf_counter() - t0
+            if self.max_bytes is not None and len(encoded_json_bytes) > self.max_bytes:
+                raise ValueError("new_data excede o limite de tamanho configurado.")
+
+            for attempt in range(retries):
+                tr.attempts += 1
+                # SHA sempre atualizado (GET condicional: 304 quando nada mudou)
+                _, sha = self.load(force=True)
+
+                r = self._put(new_data, sha, commit_message, encoded_json_bytes)
+
+                if r.status_code in (200, 201):
+                    return True
+
+                # Conflito (arquivo mudou no GitHub) — backoff exponencial com jitter
+                if r.status_code == 409:
+                    tr.sleep((2 ** attempt) * 0.2 + random.random() * 0.3)
+                    continue
+
+                # Rate limit: observe() já bloqueou o agendador até o reset /
+                # Retry-After; a próxima tentativa espera lá em vez de dormir fixo
+                if r.status_code == 403 and "rate" in r.text.lower():
+                    continue
+
+                # Demais erros: levanta exceção com detalhes
+                raise Exception(f"GitHub PUT error: {r.status_code} - {r.text}")
+
+            raise TimeoutError("Falha ao salvar após múltiplas tentativas.")
 
     # ============================================================
     # UPDATE — Carregar, alterar e salvar com atomicidade real
     # ============================================================
-    def update(self, update_fn, retries=8, commit_message=None):
+    def update(self, update_fn, retries=8, commit_message=None, base=None):
         """
         update_fn: função que recebe (list) e retorna (list) o novo conteúdo.
+
+        Em 409 não reexecuta update_fn: faz merge de três vias por registro
+        (base / nossa / deles, chave "id") e reenvia. Só alterações
+        divergentes no mesmo campo do mesmo registro levantam MergeConflict.
+
+        base: lista de quando a edição começou (ex.: o formulário foi aberto).
+        update_fn é aplicada sobre ela e o resultado é combinado com a versão
+        atual, preservando o que outra pessoa gravou nesse meio-tempo.
         """
         if not callable(update_fn):
             raise ValueError("update_fn deve ser uma função (callable).")
 
-        for attempt in range(retries):
-            data, _ = self.load(force=True)
+        with TELEMETRY.trace("update", self.path) as tr, RATE_LIMITER.priority(WRITE):
+            theirs, sha = self.load(force=True)
+            theirs = theirs if isinstance(theirs, list) else []
+            start = theirs if base is None else base
             try:
-                new_data = update_fn(list(data) if isinstance(data, list) else [])
+                mine = update_fn(list(start))
             except Exception as e:
                 raise Exception(f"update_fn falhou: {e}")
 
-            if not isinstance(new_data, list):
+            if not isinstance(mine, list):
                 raise ValueError("update_fn deve retornar uma lista JSON serializável.")
 
-            try:
-                self.save(new_data, commit_message=commit_message)
-                return True
-            except TimeoutError:
-                # tenta novamente
-                continue
-            except Exception:
-                # conflito momentâneo ou erro transitório
-                time.sleep(0.3 + random.random() * 0.3)
+            if base is not None:
+                mine = three_way_merge(base, mine, theirs)
+            base = theirs
+
+            for attempt in range(retries):
+                tr.attempts += 1
+                r = self._put(mine, sha, commit_message)
 
-        raise Exception("Falha ao atualizar após múltiplas tentativas.")
+                if r.status_code in (200, 201):
+                    return True
+
+                # Conflito: combina com a versão atual em vez de recomeçar do zero
+                if r.status_code == 409:
+                    tr.sleep((2 ** attempt) * 0.15 + random.random() * 0.2)
+                    theirs, sha = self.load(force=True)
+                    mine = three_way_merge(base, mine, theirs)
+                    base = theirs
+                    continue
+
+                if r.status_code == 403 and "rate" in r.text.lower():
+                    continue
+
+                raise Exception(f"GitHub PUT error: {r.status_code} - {r.text}")
+
+            raise Exception("Falha ao atualizar após múltiplas tentativas.")
+
+    # ============================================================
+    # TRANSAÇÃO — vários arquivos em um único commit (Git Data API)
+    # ============================================================
+    def transaction(self):
+        """Nova GitTransaction no mesmo repositório/branch deste arquivo."""
+        return GitTransaction(self.token, self.owner, self.repo, self.branch, session=self.session,
+                              api_base=self.api_base)
+
+    def stage(self, tx, new_data):
+        """
+        Prepara new_data em tx (mesma serialização do save) e devolve o SHA
+        do blob. O cache compartilhado só é atualizado depois do commit.
+        """
+        if not isinstance(new_data, list):
+            raise ValueError("new_data deve ser uma lista JSON serializável.")
+        if self.encoding == "json":
+            blob_sha = tx.put_json(self.path, new_data, indent=2)
+        else:
+            blob_sha = tx.put_bytes(self.path, pack(new_data, self.encoding, path=self.path))
+        tx.on_commit(lambda shas: SHARED_CACHE.put(self._cache_key, new_data, shas.get(self.path)))
+        return blob_sha
 
     # ============================================================
     # UTILITÁRIOS
@@ -0,0 +1,54 @@
+# http_pool.py
+# Conexões keep-alive compartilhadas + busca paralela dos bancos
+# Uma única requests.Session por processo (TLS negociado uma vez só)
+# Pool de threads pequeno para carregar dados.json e rotinas.json juntos
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+_session = None
+_session_lock = threading.Lock()
+
+# Poucos arquivos por página: 4 workers bastam e não estouram o rate limit
+FETCH_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="gh-fetch")
+
+
+def get_session():
+    """
+    Sessão HTTP do processo. O pool do urllib3 é thread-safe, então todas
+    as sessões do Streamlit e todas as instâncias de GitHubJSON reutilizam
+    as mesmas conexões abertas com api.github.com.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            _session = s
+        return _session
+
+
+def load_many(dbs, force=False, return_exceptions=False):
+    """
+    Executa db.load(force) de vários bancos em paralelo e devolve os
+    resultados na mesma ordem. O tempo total fica limitado pela busca mais
+    lenta, não pela soma de todas.
+
+    return_exceptions=True devolve a exceção no lugar do resultado (útil
+    para pré-carregamentos que não devem derrubar a página).
+    """
+    futures = [FETCH_POOL.submit(db.load, force) for db in dbs]
+    results = []
+    for fut in futures:
+        try:
+            results.append(fut.result())
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            results.append(e)
+    return results
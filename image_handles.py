@@ -0,0 +1,280 @@
+# image_handles.py
+# Imagens do HTML do Quill como "handles" preguiçosos e deduplicados
+#
+# O extract_images_from_html antigo (app.py e rotinas_module.py) decodificava
+# o base64 e abria um PIL.Image para cada <img> durante a substituição da
+# regex, mesmo quando só o texto era usado, e a mesma imagem colada duas
+# vezes era decodificada duas vezes. Um ImageHandle guarda só:
+#   key    -> hash do conteúdo (sha256 do blob ou blake2b do base64)
+#   format -> png / jpeg / gif / webp
+#   span   -> (início, fim) do payload base64 dentro do src (data URI)
+#   size   -> (largura, altura) lida do cabeçalho, sem decodificar os pixels
+# Os bytes só são decodificados em data() / open(), quando um renderizador
+# realmente desenha a imagem (print_images.prepare), e nada fica preso no handle.
+#
+# handle_for(src) devolve o mesmo handle para o mesmo conteúdo — dentro de um
+# documento e entre documentos (REGISTRY, por processo, limitado em entradas e bytes).
+
+import base64
+import binascii
+import hashlib
+import io
+import struct
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from blob_store import BLOB_PREFIX, BLOB_REF_RE, sniff_ext
+
+_FORMAT_BY_SUBTYPE = {"jpeg": "jpeg", "jpg": "jpeg", "pjpeg": "jpeg", "png": "png", "gif": "gif", "webp": "webp"}
+_FORMAT_BY_EXT = {"jpg": "jpeg", "png": "png", "gif": "gif", "webp": "webp"}
+
+# Prefixo do base64 decodificado para achar as dimensões (EXIF do JPEG fica
+# antes do SOF e costuma caber aqui; se não couber, decodifica tudo)
+_HEADER_B64 = 64 * 1024
+
+
+# ------------------------------------------------------------
+# Dimensões pelo cabeçalho (PNG / GIF / JPEG / WebP)
+# ------------------------------------------------------------
+def _jpeg_size(data):
+    i = 2
+    n = len(data)
+    while i + 9 < n:
+        if data[i] != 0xFF:
+            i += 1
+            continue
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        length = struct.unpack(">H", data[i + 2:i + 4])[0]
+        # SOF0..SOF15, exceto DHT (C4), JPG (C8) e DAC (CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            h, w = struct.unpack(">HH", data[i + 5:i + 9])
+            return w, h
+        i += 2 + length
+    return None
+
+
+def header_size(data):
+    """(largura, altura) a partir dos primeiros bytes; None se não achar."""
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and len(data) >= 24 and data[12:16] == b"IHDR":
+        return struct.unpack(">II", data[16:24])
+    if data[:6] in (b"GIF87a", b"GIF89a") and len(data) >= 10:
+        return struct.unpack("<HH", data[6:10])
+    if data[:3] == b"\xff\xd8\xff":
+        return _jpeg_size(data)
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP" and len(data) >= 30:
+        chunk = data[12:16]
+        if chunk == b"VP8 ":
+            w, h = struct.unpack("<HH", data[26:30])
+            return w & 0x3FFF, h & 0x3FFF
+        if chunk == b"VP8L":
+            b = data[21:25]
+            w = 1 + (((b[1] & 0x3F) << 8) | b[0])
+            h = 1 + (((b[3] & 0x0F) << 10) | (b[2] << 2) | ((b[1] & 0xC0) >> 6))
+            return w, h
+        if chunk == b"VP8X":
+            w = 1 + int.from_bytes(data[24:27], "little")
+            h = 1 + int.from_bytes(data[27:30], "little")
+            return w, h
+    try:
+        # Formato incomum: PIL lê só o cabeçalho em Image.open
+        with Image.open(io.BytesIO(data)) as img:
+            return img.size
+    except Exception:
+        return None
+
+
+# ------------------------------------------------------------
+# Handle
+# ------------------------------------------------------------
+class ImageHandle:
+    """
+    Referência leve a uma imagem de src (data URI ou blob:sha256).
+    size / width / height vêm do cabeçalho; data() e open() decodificam sob
+    demanda e devolvem None se a imagem não puder ser carregada.
+    """
+
+    __slots__ = ("key", "format", "src", "span", "_blob_store", "_size", "_lock")
+
+    def __init__(self, key, fmt, src, span=None, blob_store=None):
+        self.key = key
+        self.format = fmt
+        self.src = src
+        self.span = span
+        self._blob_store = blob_store
+        self._size = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<ImageHandle {self.format} {self.key[:12]} size={self._size}>"
+
+    @property
+    def nbytes(self):
+        """Tamanho estimado dos bytes (data URI: sem decodificar)."""
+        if self.span:
+            start, end = self.span
+            return (end - start) * 3 // 4 - self.src.count("=", max(start, end - 2), end)
+        return None
+
+    def _read(self, limit=None):
+        if self.span:
+            start, end = self.span
+            if limit is not None and end - start > limit:
+                end = start + limit - limit % 4
+            return base64.b64decode(self.src[start:end])
+        if self._blob_store is None:
+            raise ValueError(f"sem blob_store para {self.src}")
+        return self._blob_store.get(self.src)
+
+    def data(self):
+        """Bytes originais (PNG/JPEG...) ou None se falhar."""
+        try:
+            return self._read()
+        except Exception as e:
+            print(f"Erro ao processar imagem: {e}")
+            return None
+
+    def open(self):
+        """PIL.Image novo (pixels decodificados só quando usados) ou None."""
+        data = self.data()
+        if data is None:
+            return None
+        try:
+            img = Image.open(io.BytesIO(data))
+        except Exception as e:
+            print(f"Erro ao processar imagem: {e}")
+            return None
+        if self._size is None:
+            self._size = img.size
+        return img
+
+    @property
+    def size(self):
+        """(largura, altura) pelo cabeçalho; None se a imagem não carregar."""
+        if self._size is None:
+            with self._lock:
+                if self._size is None:
+                    try:
+                        head = self._read(_HEADER_B64)
+                        size = header_size(head)
+                        if size is None and self.span and len(head) < self.nbytes:
+                            size = header_size(self._read())
+                        self._size = tuple(size) if size else False
+                    except Exception as e:
+                        print(f"Erro ao processar imagem: {e}")
+                        self._size = False
+        return self._size or None
+
+    @property
+    def width(self):
+        size = self.size
+        return size[0] if size else 0
+
+    @property
+    def height(self):
+        size = self.size
+        return size[1] if size else 0
+
+
+# ------------------------------------------------------------
+# Registro por processo (dedup entre documentos e sessões)
+# ------------------------------------------------------------
+class _HandleRegistry:
+    # Handles de data URI seguram o src (string do HTML): limite também em bytes
+    def __init__(self, max_entries=512, max_bytes=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._items = OrderedDict()  # key -> (ImageHandle, bytes do src retido)
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_add(self, handle):
+        with self._lock:
+            found = self._items.get(handle.key)
+            if found is not None:
+                self._items.move_to_end(handle.key)
+                self.hits += 1
+                found = found[0]
+                if found._blob_store is None:
+                    found._blob_store = handle._blob_store
+                return found
+            self.misses += 1
+            cost = len(handle.src) if handle.span else 0
+            if cost > self.max_bytes:
+                return handle
+            self._items[handle.key] = (handle, cost)
+            self._size += cost
+            while self._items and (len(self._items) > self.max_entries or self._size > self.max_bytes):
+                _, (_, evicted) = self._items.popitem(last=False)
+                self._size -= evicted
+            return handle
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "bytes": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+
+REGISTRY = _HandleRegistry()
+
+
+def _b64_handle(src, start, end, subtype=""):
+    try:
+        # Confere o alfabeto/padding só no começo; o resto fica para data()
+        head = base64.b64decode(src[start:start + 64 - (min(64, end - start) % 4)])
+    except (binascii.Error, ValueError):
+        return None
+    fmt = _FORMAT_BY_SUBTYPE.get(subtype.lower()) or _FORMAT_BY_EXT[sniff_ext(head)]
+    digest = hashlib.blake2b(src[start:end].encode("ascii", "replace"), digest_size=20).hexdigest()
+    return ImageHandle(f"b64:{digest}", fmt, src, (start, end))
+
+
+def _blob_handle(ref, blob_store):
+    m = BLOB_REF_RE.fullmatch(ref)
+    if not m:
+        return None
+    return ImageHandle(f"sha256:{m.group(1)}", _FORMAT_BY_EXT.get(m.group(2), "png"), ref, blob_store=blob_store)
+
+
+def handle_for(src, blob_store=None):
+    """
+    src de <img> -> ImageHandle (o mesmo objeto para o mesmo conteúdo).
+    None para URL externa ou data URI sem base64 (não embutidos no PDF/Word).
+    """
+    if not src:
+        return None
+    if src.startswith("data:image/"):
+        comma = src.find(",")
+        meta = src[len("data:image/"):comma] if comma > 0 else ""
+        if not meta.endswith(";base64"):
+            return None
+        handle = _b64_handle(src, comma + 1, len(src), meta[:-len(";base64")])
+    else:
+        handle = _blob_handle(src, blob_store)
+    return REGISTRY.get_or_add(handle) if handle is not None else None
+
+
+def handle_for_field(value, blob_store=None):
+    """Campo de imagem avulsa (print_b64: base64 legado ou blob:sha256) -> ImageHandle."""
+    if not value:
+        return None
+    if value.startswith(BLOB_PREFIX):
+        handle = _blob_handle(value, blob_store)
+    else:
+        handle = _b64_handle(value, 0, len(value))
+    return REGISTRY.get_or_add(handle) if handle is not None else None
@@ -0,0 +1,96 @@
+# json_codec.py
+# Codificação dos bancos JSON no repositório — texto legado ou comprimido
+#
+#   "json" -> json.dumps(indent=...) — formato histórico (dados.json)
+#   "gzip" -> separadores compactos + gzip (dados.json.gz)
+#   "zstd" -> separadores compactos + zstd (dados.json.zst; requer zstandard)
+#
+# A leitura detecta o formato pelos bytes mágicos, então um arquivo .gz que
+# na verdade contém JSON puro (legado/edição manual) continua sendo lido.
+
+import gzip
+import json
+import threading
+
+try:
+    import zstandard
+except ImportError:  # opcional
+    zstandard = None
+
+SUFFIXES = {"json": "", "gzip": ".gz", "zstd": ".zst"}
+
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+_SIZES = {}
+_SIZES_LOCK = threading.Lock()
+
+
+def check_encoding(encoding):
+    encoding = (encoding or "json").lower()
+    if encoding not in SUFFIXES:
+        raise ValueError(f"Codificação desconhecida: {encoding}")
+    if encoding == "zstd" and zstandard is None:
+        raise ValueError("Codificação zstd requer o pacote 'zstandard'.")
+    return encoding
+
+
+def detect(raw: bytes) -> str:
+    if raw[:2] == _GZIP_MAGIC:
+        return "gzip"
+    if raw[:4] == _ZSTD_MAGIC:
+        return "zstd"
+    return "json"
+
+
+def pack(data, encoding="json", indent=4, path=None) -> bytes:
+    """Serializa data no formato de armazenamento (path: registra o tamanho)."""
+    if encoding == "json":
+        out = json.dumps(data, indent=indent, ensure_ascii=False).encode("utf-8")
+        plain = len(out)
+    else:
+        compact = json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        plain = len(compact)
+        if encoding == "gzip":
+            # mtime=0: mesmo conteúdo -> mesmos bytes -> mesmo SHA de blob
+            out = gzip.compress(compact, compresslevel=9, mtime=0)
+        else:
+            out = zstandard.ZstdCompressor(level=19).compress(compact)
+    if path is not None:
+        record_size(path, len(out), plain)
+    return out
+
+
+def unpack(raw: bytes) -> bytes:
+    """Bytes do arquivo -> bytes JSON (descomprime conforme os bytes mágicos)."""
+    kind = detect(raw)
+    if kind == "gzip":
+        return gzip.decompress(raw)
+    if kind == "zstd":
+        if zstandard is None:
+            raise ValueError("Arquivo zstd, mas o pacote 'zstandard' não está instalado.")
+        return zstandard.ZstdDecompressor().decompress(raw)
+    return raw
+
+
+# ------------------------------------------------------------
+# Relatório de tamanho por arquivo (última leitura/gravação)
+# ------------------------------------------------------------
+def record_size(path, stored_bytes, json_bytes):
+    with _SIZES_LOCK:
+        _SIZES[path] = {"armazenado": stored_bytes, "json": json_bytes}
+
+
+def size_report():
+    """[{arquivo, bytes armazenados, bytes JSON, economia}] por arquivo visto."""
+    with _SIZES_LOCK:
+        items = sorted(_SIZES.items())
+    return [
+        {
+            "arquivo": path,
+            "kb_armazenado": s["armazenado"] / 1024,
+            "kb_json": s["json"] / 1024,
+            "economia": 1 - (s["armazenado"] / s["json"]) if s["json"] else 0.0,
+        }
+        for path, s in items
+    ]
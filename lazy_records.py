@@ -0,0 +1,189 @@
+# lazy_records.py
+# Materialização preguiçosa dos registros — campos pesados só no 1º acesso
+#
+# Menus (selectbox de cadastro/consulta) só usam id e nome, mas o json.loads
+# decodifica o HTML de observacoes/descricao e o print_b64 de todos os
+# registros. parse_records() localiza os valores pesados, troca cada um por
+# um marcador curto e entrega o resto ao json.loads (em C): campos leves são
+# decodificados na hora; os pesados ficam como um trecho (início/fim) do texto
+# original e viram str apenas quando alguém lê o campo.
+#
+# LazyRecord é um dict: .get / [] / items() / dict(rec) / json.dumps / pickle
+# enxergam sempre o valor decodificado.
+
+import functools
+import json
+import re
+
+HEAVY_FIELDS = frozenset({"observacoes", "descricao", "print_b64"})
+
+
+def _string_end(text, idx):
+    """Índice logo após as aspas que fecham a string iniciada antes de idx."""
+    find = text.find
+    while True:
+        quote = find('"', idx)
+        if quote < 0:
+            raise ValueError(f"String não terminada na posição {idx}")
+        k = quote
+        while text[k - 1] == "\\":
+            k -= 1
+        if (quote - k) % 2 == 0:      # nº par de barras: aspas não escapadas
+            return quote + 1
+        idx = quote + 1
+
+
+class _Span:
+    """Literal de string JSON ainda não decodificado (text[start:end])."""
+
+    __slots__ = ("text", "start", "end")
+
+    def __init__(self, text, start, end):
+        self.text = text
+        self.start = start
+        self.end = end
+
+    def decode(self):
+        inner = self.text[self.start + 1:self.end - 1]
+        if "\\" not in inner:
+            return inner  # sem escapes: o próprio trecho já é o valor
+        return json.loads(self.text[self.start:self.end])
+
+    def __reduce__(self):
+        # pickle (snapshot em disco) guarda o texto uma vez só (memo) e os offsets
+        return (_Span, (self.text, self.start, self.end))
+
+    def __repr__(self):
+        return f"<não decodificado: {self.end - self.start} chars>"
+
+
+class LazyRecord(dict):
+    """dict cujos campos pesados são decodificados no primeiro acesso."""
+
+    __slots__ = ()
+
+    def _value(self, key, value):
+        if type(value) is _Span:
+            value = value.decode()
+            dict.__setitem__(self, key, value)  # decodifica uma vez só
+        return value
+
+    def __getitem__(self, key):
+        return self._value(key, dict.__getitem__(self, key))
+
+    def get(self, key, default=None):
+        if dict.__contains__(self, key):
+            return self[key]
+        return default
+
+    def __iter__(self):
+        # Sobrescrito de propósito: sem o tp_iter padrão, dict(rec) / {**rec}
+        # deixam o atalho em C e passam por __getitem__ (valor decodificado)
+        return dict.__iter__(self)
+
+    def items(self):
+        return [(k, self[k]) for k in dict.keys(self)]
+
+    def values(self):
+        return [self[k] for k in dict.keys(self)]
+
+    def pop(self, key, *default):
+        if dict.__contains__(self, key):
+            value = self[key]
+            dict.__delitem__(self, key)
+            return value
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def setdefault(self, key, default=None):
+        if dict.__contains__(self, key):
+            return self[key]
+        dict.__setitem__(self, key, default)
+        return default
+
+    def copy(self):
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, dict):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    __hash__ = None
+
+    def __reduce__(self):
+        # Mantém os trechos ainda não decodificados (sem materializar no pickle)
+        return (_restore, (list(dict.items(self)),))
+
+    def pending(self):
+        """Campos ainda não decodificados (diagnóstico)."""
+        return [k for k, v in dict.items(self) if type(v) is _Span]
+
+
+def _restore(items):
+    rec = LazyRecord()
+    for k, v in items:
+        dict.__setitem__(rec, k, v)
+    return rec
+
+
+_MARK = "\x00lazy:"
+
+
+@functools.lru_cache(maxsize=8)
+def _heavy_key_re(heavy):
+    names = "|".join(re.escape(h) for h in sorted(heavy))
+    # Só casa com chave de verdade: dentro de uma string as aspas viriam escapadas
+    return re.compile(r'"(?:%s)"[ \t\n\r]*:[ \t\n\r]*"' % names)
+
+
+def parse_records(text, heavy=HEAVY_FIELDS):
+    """
+    Equivalente a json.loads(text), mas com os valores string dos campos
+    `heavy` adiados. Cada literal pesado é trocado por um marcador curto, o
+    json.loads (em C) roda sobre o texto reduzido e o object_hook devolve
+    LazyRecords apontando para o trecho original.
+    """
+    key_re = _heavy_key_re(frozenset(heavy))
+
+    spans = []
+    parts = []
+    pos = 0
+    m = key_re.search(text)
+    while m is not None:
+        start = m.end() - 1                       # aspas de abertura do valor
+        end = _string_end(text, start + 1)
+        parts.append(text[pos:start])
+        parts.append(f'"\\u0000lazy:{len(spans)}"')
+        spans.append(_Span(text, start, end))
+        pos = end
+        m = key_re.search(text, pos)
+
+    if not spans:
+        return json.loads(text, object_hook=LazyRecord)
+    parts.append(text[pos:])
+
+    def _hook(obj):
+        rec = LazyRecord(obj)
+        for key in heavy:
+            value = obj.get(key)
+            if type(value) is str and value.startswith(_MARK):
+                dict.__setitem__(rec, key, spans[int(value[len(_MARK):])])
+        return rec
+
+    return json.loads("".join(parts), object_hook=_hook)
+
+
+def loads(text, heavy=HEAVY_FIELDS):
+    """parse_records com a mesma interface de erro do json.loads."""
+    if not heavy:
+        return json.loads(text)
+    try:
+        return parse_records(text, heavy)
+    except ValueError:
+        return json.loads(text)  # texto inválido: o mesmo JSONDecodeError de sempre
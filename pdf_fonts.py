@@ -0,0 +1,180 @@
+# pdf_fonts.py
+# Registro de fontes TTF por processo — DejaVu lida e analisada uma vez só
+#
+# _pdf_set_fonts chamava pdf.add_font para DejaVuSans.ttf e DejaVuSans-Bold.ttf
+# em cada FPDF (convênios e rotinas): fontTools abria os dois arquivos e o
+# fpdf2 recalculava cmap, larguras e ids de glifo de ~6 mil caracteres a cada
+# PDF (~100 ms), além de os.path.exists relativo ao diretório atual.
+#
+# O registro guarda, por (arquivo, família, estilo), um TTFFont "protótipo" já
+# analisado e os bytes do arquivo. attach() pendura no FPDF novo uma cópia rasa:
+#   compartilhado -> cmap, métricas e nome (só leitura)
+#   por documento -> índice da fonte, SubsetMap, glifos faltantes, cópias do
+#                    descritor (o output() grava nele o nome e o id do objeto),
+#                    de cw (defaultdict: ganha entradas para caracteres sem
+#                    glifo) e de glyph_ids, e um TTFont preguiçoso aberto dos
+#                    bytes em memória (o subset do output() altera o TTFont)
+# Exportações em threads diferentes (sessões do Streamlit) não dividem nada
+# que o fpdf2 altere.
+#
+# O clone mexe em detalhes internos do TTFFont, então só é usado nas versões do
+# fpdf2 em que foi conferido (_CLONE_TESTED: PDF igual ao do add_font). Fora
+# delas, ou se o clone falhar, attach() cai em pdf.add_font — mais lento, mas
+# com a mesma fonte (nunca Helvetica, que não tem o "•" das listas).
+# stats() informa o tempo economizado por PDF (análise evitada - custo do attach).
+
+import copy
+import io
+import os
+import threading
+import time
+
+import fpdf
+from fontTools import ttLib
+from fpdf import FPDF
+from fpdf.fonts import SubsetMap, TTFFont
+
+# Arquivos da DejaVu: estilo -> nome do arquivo
+DEJAVU_FILES = {"": "DejaVuSans.ttf", "B": "DejaVuSans-Bold.ttf"}
+
+# Procura no diretório atual (como antes) e, se não achar, ao lado do app
+_SEARCH_DIRS = (".", os.path.dirname(os.path.abspath(__file__)))
+
+# Versões do fpdf2 (mínima, máxima) em que o clone foi conferido
+_CLONE_TESTED = ((2, 8, 6), (2, 8, 9))
+
+
+def _fpdf_version():
+    try:
+        return tuple(int(p) for p in fpdf.__version__.split(".")[:3])
+    except ValueError:
+        return ()  # pré-lançamento (ex.: 2.9.0rc1): sem clone
+
+
+class _FontPrototype:
+    __slots__ = ("font", "data", "parse_s")
+
+    def __init__(self, font, data, parse_s):
+        self.font = font
+        self.data = data
+        self.parse_s = parse_s
+
+
+class _FontRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._paths = {}        # nome do arquivo -> caminho resolvido (ou None)
+        self._protos = {}       # (caminho, fontkey) -> _FontPrototype
+        self.clone = _CLONE_TESTED[0] <= _fpdf_version() <= _CLONE_TESTED[1]
+        self.parses = 0
+        self.documents = 0
+        self.parse_s = 0.0      # tempo total das análises (uma por fonte)
+        self.attach_s = 0.0     # tempo total dos attach
+        self.avoided_s = 0.0    # quanto os add_font equivalentes teriam custado
+
+    def _resolve(self, fname):
+        if fname not in self._paths:
+            for parent in _SEARCH_DIRS:
+                path = os.path.join(parent, fname)
+                if os.path.exists(path):
+                    self._paths[fname] = os.path.abspath(path)
+                    break
+            else:
+                self._paths[fname] = None
+        return self._paths[fname]
+
+    def _prototype(self, path, family, style):
+        fontkey = f"{family.lower()}{style}"
+        key = (os.path.abspath(path), fontkey)
+        proto = self._protos.get(key)
+        if proto is None:
+            with self._lock:
+                proto = self._protos.get(key)
+                if proto is None:
+                    t0 = time.perf_counter()
+                    with open(path, "rb") as f:
+                        data = f.read()
+                    font = TTFFont(FPDF(), path, fontkey, style)
+                    proto = _FontPrototype(font, data, time.perf_counter() - t0)
+                    self._protos[key] = proto
+                    self.parses += 1
+                    self.parse_s += proto.parse_s
+        return proto
+
+    def _clone(self, proto, pdf):
+        src = proto.font
+        if src.color_font is not None:
+            return None  # fonte colorida guarda o FPDF do protótipo: add_font
+        font = copy.copy(src)
+        font.i = len(pdf.fonts) + 1
+        font.desc = copy.copy(src.desc)
+        font.cw = copy.copy(src.cw)
+        font.glyph_ids = dict(src.glyph_ids)
+        font.ttfont = ttLib.TTFont(
+            io.BytesIO(proto.data),
+            recalcTimestamp=False,
+            fontNumber=src.collection_font_number,
+            lazy=True,
+        )
+        font._hbfont = None
+        font.biggest_size_pt = 0
+        font.missing_glyphs = []
+        font.subset = SubsetMap(font)
+        return font
+
+    def attach(self, pdf, family, files):
+        """
+        Registra no pdf a família `family` com os arquivos {estilo: arquivo}.
+        Devolve False se o arquivo do estilo regular não existir (os demais
+        estilos são opcionais, como no _pdf_set_fonts antigo).
+        """
+        regular = self._resolve(files.get("", ""))
+        if regular is None:
+            return False
+
+        t0 = time.perf_counter()
+        avoided = 0.0
+        for style, fname in files.items():
+            path = regular if style == "" else self._resolve(fname)
+            if path is None:
+                continue
+            fontkey = f"{family.lower()}{style}"
+            if fontkey in pdf.fonts:
+                continue
+            font = None
+            if self.clone:
+                try:
+                    proto = self._prototype(path, family, style)
+                    font = self._clone(proto, pdf)
+                except Exception as e:
+                    print(f"Erro ao clonar fonte {fname}: {e} — usando add_font")
+                    self.clone = False
+            if font is None:
+                pdf.add_font(family, style, path)
+                continue
+            pdf.fonts[fontkey] = font
+            if font.is_cff and font.is_cid_keyed:
+                pdf._set_min_pdf_version("1.6")
+            avoided += proto.parse_s
+        elapsed = time.perf_counter() - t0
+        with self._lock:
+            self.documents += 1
+            self.attach_s += elapsed
+            self.avoided_s += avoided
+        return True
+
+    def stats(self):
+        with self._lock:
+            docs = self.documents or 1
+            return {
+                "clone": self.clone,
+                "fonts": len(self._protos),
+                "parses": self.parses,
+                "documents": self.documents,
+                "parse_ms": round(self.parse_s * 1000, 1),
+                "attach_ms": round(self.attach_s / docs * 1000, 2),
+                "saved_ms_per_pdf": round((self.avoided_s - self.attach_s) / docs * 1000, 1),
+            }
+
+
+FONTS = _FontRegistry()
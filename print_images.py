@@ -0,0 +1,201 @@
+# print_images.py
+# Preparo das imagens para impressão (PDF / Word) — uma vez por conteúdo e largura
+#
+# O PDF embutia os prints colados em resolução cheia (só a escala do layout
+# mudava) e o Word redimensionava com o filtro padrão e refazia o PNG com
+# optimize=True a cada exportação, tanto nas imagens do Quill quanto no
+# print_b64. prepare() faz uma etapa só:
+#   1. reduz a imagem para PRINT_DPI na largura em que ela é desenhada
+#      (LANCZOS; nunca amplia);
+#   2. escolhe o formato pelo conteúdo: transparência ou poucas cores (telas,
+#      prints) -> PNG; foto -> JPEG, se ficar bem menor que o PNG;
+#   3. guarda os bytes num LRU limitado em bytes (PREPARED), chaveado por
+#      (hash do conteúdo, largura alvo em px, formato).
+# JPEG/PNG que já estão no tamanho e no formato escolhido passam sem reencode.
+# gerar_pdf, gerar_docx e RotinasModule.gerar_pdf_rotina usam o mesmo cache,
+# então a segunda exportação não decodifica nem codifica nada.
+
+import io
+import math
+import sys
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+
+from PIL import Image
+
+# Resolução de impressão das imagens (pontos por polegada na largura desenhada)
+PRINT_DPI = 150
+
+# Larguras alvo arredondadas para cima em degraus: larguras de layout quase
+# iguais (PDF / Word, margens) caem na mesma entrada do cache
+_WIDTH_STEP_PX = 64
+
+# Foto vira JPEG só se ficar abaixo desta fração do PNG
+_JPEG_GAIN = 0.5
+_JPEG_QUALITY = 85
+
+
+class PreparedImage(NamedTuple):
+    data: bytes
+    format: str      # "png" | "jpeg"
+    width: int       # px
+    height: int      # px
+
+
+def target_width_px(width_mm, dpi=PRINT_DPI):
+    """Pixels para `width_mm` milímetros a `dpi`, arredondado para cima no degrau."""
+    px = math.ceil(width_mm / 25.4 * dpi)
+    return max(_WIDTH_STEP_PX, -(-px // _WIDTH_STEP_PX) * _WIDTH_STEP_PX)
+
+
+# ------------------------------------------------------------
+# Escolha de formato e codificação
+# ------------------------------------------------------------
+def _has_alpha(img):
+    if img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info):
+        alpha = img.convert("RGBA").getchannel("A")
+        return alpha.getextrema()[0] < 255
+    return False
+
+
+def _few_colors(img, limit=256):
+    """Poucas cores (tela, diagrama, print)? Amostra sem interpolar as cores."""
+    sample = img if img.width <= 256 else img.resize(
+        (256, max(1, round(img.height * 256 / img.width))), Image.NEAREST
+    )
+    return sample.convert("RGB").getcolors(limit) is not None
+
+
+def _encode(img, fmt):
+    buf = io.BytesIO()
+    if fmt == "jpeg":
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.save(buf, format="JPEG", quality=_JPEG_QUALITY, optimize=True)
+    else:
+        if img.mode not in ("1", "L", "LA", "P", "RGB", "RGBA"):
+            img = img.convert("RGBA")
+        img.save(buf, format="PNG", optimize=True)
+    return buf.getvalue()
+
+
+def _source_format(data):
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    if data[:3] == b"\xff\xd8\xff":
+        return "jpeg"
+    return None
+
+
+def _prepare(data, target_px):
+    img = Image.open(io.BytesIO(data))
+    src_fmt = _source_format(data)
+    resize = img.width > target_px
+
+    if not resize and src_fmt == "jpeg":
+        # JPEG já no tamanho: reencode só perderia qualidade
+        return PreparedImage(data, "jpeg", img.width, img.height)
+
+    img.load()
+    if resize:
+        if img.mode not in ("RGB", "RGBA", "L", "LA"):
+            img = img.convert("RGBA" if _has_alpha(img) else "RGB")
+        height = max(1, round(img.height * target_px / img.width))
+        img = img.resize((target_px, height), Image.LANCZOS, reducing_gap=3.0)
+
+    png = data if (src_fmt == "png" and not resize) else _encode(img, "png")
+    if _has_alpha(img) or _few_colors(img):
+        return PreparedImage(png, "png", img.width, img.height)
+
+    jpeg = _encode(img, "jpeg")
+    if len(jpeg) < _JPEG_GAIN * len(png):
+        return PreparedImage(jpeg, "jpeg", img.width, img.height)
+    return PreparedImage(png, "png", img.width, img.height)
+
+
+# ------------------------------------------------------------
+# Cache por processo (compartilhado entre sessões e exportadores)
+# ------------------------------------------------------------
+class _PreparedCache:
+    def __init__(self, max_bytes=32 * 1024 * 1024, max_choices=4096):
+        self.max_bytes = max_bytes
+        self.max_choices = max_choices
+        self._lock = threading.Lock()
+        self._items = OrderedDict()   # (hash, largura px, formato) -> PreparedImage
+        self._choice = {}             # (hash, largura px) -> formato escolhido
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_in = 0             # bytes de origem preparados
+        self.bytes_out = 0            # bytes resultantes
+
+    def get(self, content_key, target_px):
+        with self._lock:
+            fmt = self._choice.get((content_key, target_px))
+            prepared = self._items.get((content_key, target_px, fmt)) if fmt else None
+            if prepared is not None:
+                self._items.move_to_end((content_key, target_px, fmt))
+                self.hits += 1
+            else:
+                self.misses += 1
+            return prepared
+
+    def put(self, content_key, target_px, prepared, source_bytes):
+        key = (content_key, target_px, prepared.format)
+        cost = sys.getsizeof(prepared.data) + 128
+        with self._lock:
+            if len(self._choice) >= self.max_choices:
+                self._choice.clear()
+            self._choice[(content_key, target_px)] = prepared.format
+            self.bytes_in += source_bytes
+            self.bytes_out += len(prepared.data)
+            if cost > self.max_bytes:
+                return
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._size -= sys.getsizeof(old.data) + 128
+            self._items[key] = prepared
+            self._size += cost
+            while self._size > self.max_bytes and self._items:
+                _, evicted = self._items.popitem(last=False)
+                self._size -= sys.getsizeof(evicted.data) + 128
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "bytes": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+                "ratio": (self.bytes_out / self.bytes_in) if self.bytes_in else 1.0,
+            }
+
+
+PREPARED = _PreparedCache()
+
+
+def prepare(handle, width_mm, dpi=PRINT_DPI):
+    """
+    ImageHandle -> PreparedImage para desenhar com `width_mm` de largura
+    (PDF: pdf.image(io.BytesIO(p.data), w=...); Word: add_picture). None se
+    a imagem não carregar.
+    """
+    if handle is None:
+        return None
+    target_px = target_width_px(width_mm, dpi)
+    prepared = PREPARED.get(handle.key, target_px)
+    if prepared is not None:
+        return prepared
+    data = handle.data()
+    if data is None:
+        return None
+    try:
+        prepared = _prepare(data, target_px)
+    except Exception as e:
+        print(f"Erro ao processar imagem: {e}")
+        return None
+    PREPARED.put(handle.key, target_px, prepared, len(data))
+    return prepared
@@ -0,0 +1,345 @@
+# quill_ir.py
+# HTML do Quill -> representação intermediária (IR) compacta, numa passada só
+#
+# Antes, a exportação passava o HTML por três regex: <img> virava [IMAGEM],
+# clean_html arrancava toda tag com <.*?> e os bullets eram redescobertos com
+# bullet_re no PDF e no Word. A formatação se perdia e o HTML era varrido
+# várias vezes. parse() lê o HTML uma vez (html.parser, em streaming) e
+# devolve uma tupla de Blocks:
+#
+#   Block(kind="p" | "h1".."h6" | "li" | "img", runs, list_type, indent, number, src, sanitized)
+#   Run(text, bold, italic, underline, strike, link)
+#
+# Texto legado (sem tags, com quebras de linha) continua válido: cada "\n"
+# é uma quebra de parágrafo e linhas iniciadas por •, -, –, —, *, ->, → viram
+# itens de lista, como no bullet_re antigo. Como no build_wrapped_lines antigo,
+# o texto legado passa inteiro pelo sanitize (parse(..., sanitize)) ANTES de ser
+# dividido em linhas: as correções de espaçamento que juntam linhas ("/\n> X")
+# continuam valendo, e esses blocos saem com sanitized=True (o sanitize não é
+# idempotente em "---", então os renderizadores não o reaplicam).
+# A IR é imutável (NamedTuple), então pode ser cacheada por versão do
+# registro e compartilhada entre sessões (record_projections).
+
+import html as _html
+import re
+from html.parser import HTMLParser
+from typing import NamedTuple, Optional, Tuple
+
+IMAGE_MARKER = "[IMAGEM]"
+
+
+class Run(NamedTuple):
+    text: str
+    bold: bool = False
+    italic: bool = False
+    underline: bool = False
+    strike: bool = False
+    link: Optional[str] = None
+
+
+class Block(NamedTuple):
+    kind: str                    # "p", "h1".."h6", "li", "img"
+    runs: Tuple[Run, ...] = ()
+    list_type: str = ""          # "bullet" | "ordered" (só em "li")
+    indent: int = 0              # nível de recuo (ql-indent-N / listas aninhadas)
+    number: int = 0              # posição na lista ordenada
+    src: str = ""                # só em "img"
+    sanitized: bool = False      # texto legado já passado pelo sanitize
+
+    @property
+    def text(self):
+        return "".join(r.text for r in self.runs)
+
+
+# Bullet digitado à mão no texto (mesmo conjunto do bullet_re antigo)
+_LEGACY_BULLET = re.compile(r"^\s*(?:[•\-–—\*]|->|→)\s*")
+_SPACES = re.compile(r"[ \t\r\f\v]+")
+_INDENT_CLASS = re.compile(r"\bql-indent-(\d+)\b")
+_TAG = re.compile(r"<[A-Za-z/!]")
+
+_BLOCK_TAGS = frozenset({"p", "div", "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "pre"})
+_STYLE_TAGS = {
+    "b": "bold", "strong": "bold",
+    "i": "italic", "em": "italic",
+    "u": "underline", "ins": "underline",
+    "s": "strike", "strike": "strike", "del": "strike",
+}
+_SKIP_TAGS = frozenset({"script", "style"})
+
+
+class _QuillParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.blocks = []
+        self._runs = []
+        self._kind = "p"
+        self._list = ("", 0)      # (list_type, indent) do bloco atual
+        self._started = False     # bloco aberto explicitamente (<p>, <li>...)
+        self._style = {"bold": 0, "italic": 0, "underline": 0, "strike": 0}
+        self._links = []
+        self._lists = []          # pilha de "ul"/"ol"
+        self._counters = {}       # nível -> último número da lista ordenada
+        self._skip = 0
+
+    # ------------------------------------------------------------
+    # Blocos
+    # ------------------------------------------------------------
+    def _flush(self, force=False):
+        runs = self._runs
+        if runs:
+            runs[0] = runs[0]._replace(text=runs[0].text.lstrip())
+            runs[-1] = runs[-1]._replace(text=runs[-1].text.rstrip())
+            runs = [r for r in runs if r.text]
+
+        if runs or force:
+            kind = self._kind
+            list_type, indent = self._list
+            if kind == "p" and runs:
+                m = _LEGACY_BULLET.match(runs[0].text)
+                if m:
+                    rest = runs[0].text[m.end():]
+                    runs = ([runs[0]._replace(text=rest)] if rest else []) + runs[1:]
+                    kind, list_type = "li", "bullet"
+            number = 0
+            if kind == "li":
+                if list_type == "ordered":
+                    number = self._counters.get(indent, 0) + 1
+                    self._counters[indent] = number
+                for deeper in [lvl for lvl in self._counters if lvl > indent]:
+                    del self._counters[deeper]
+            else:
+                self._counters.clear()
+                list_type = ""
+                indent = indent if kind == "p" else 0
+            self.blocks.append(Block(kind, tuple(runs), list_type, indent, number))
+
+        self._runs = []
+        self._started = False
+
+    def _open(self, kind, list_type="", indent=0):
+        self._flush()
+        self._kind = kind
+        self._list = (list_type, indent)
+        self._started = True
+
+    def _close(self):
+        self._flush(force=self._started)
+        self._kind = "p"
+        self._list = ("", 0)
+
+    # ------------------------------------------------------------
+    # Eventos do HTMLParser
+    # ------------------------------------------------------------
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIP_TAGS:
+            self._skip += 1
+            return
+        a = dict(attrs)
+        indent = 0
+        m = _INDENT_CLASS.search(a.get("class") or "")
+        if m:
+            indent = int(m.group(1))
+
+        if tag in _BLOCK_TAGS:
+            kind = tag if tag.startswith("h") and len(tag) == 2 and tag[1].isdigit() else "p"
+            self._open(kind, indent=indent)
+        elif tag in ("ul", "ol"):
+            self._flush()
+            self._lists.append(tag)
+        elif tag == "li":
+            data_list = a.get("data-list")  # Quill 2: <ol><li data-list="bullet">
+            if data_list:
+                list_type = "ordered" if data_list == "ordered" else "bullet"
+            else:
+                list_type = "ordered" if self._lists and self._lists[-1] == "ol" else "bullet"
+            self._open("li", list_type, indent + max(0, len(self._lists) - 1))
+        elif tag in _STYLE_TAGS:
+            self._style[_STYLE_TAGS[tag]] += 1
+        elif tag == "a":
+            self._links.append(a.get("href") or "")
+        elif tag == "br":
+            self._flush(force=True)
+            self._started = False
+        elif tag == "img":
+            src = a.get("src") or ""
+            if src:
+                kind, lst = self._kind, self._list
+                self._flush()
+                self.blocks.append(Block("img", src=src))
+                self._kind, self._list = kind, lst
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag in _BLOCK_TAGS or tag == "li":
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS:
+            self._skip = max(0, self._skip - 1)
+        elif tag in _BLOCK_TAGS or tag == "li":
+            self._close()
+        elif tag in ("ul", "ol"):
+            self._flush()
+            if self._lists:
+                self._lists.pop()
+            if not self._lists:
+                self._counters.clear()
+        elif tag in _STYLE_TAGS:
+            key = _STYLE_TAGS[tag]
+            self._style[key] = max(0, self._style[key] - 1)
+        elif tag == "a":
+            if self._links:
+                self._links.pop()
+
+    def handle_data(self, data):
+        if self._skip or not data:
+            return
+        if not self._started and not self._runs and not data.strip():
+            return  # espaço/quebra entre tags de bloco (HTML formatado à mão)
+        s = self._style
+        lines = data.split("\n")
+        for i, line in enumerate(lines):
+            if i:
+                self._flush(force=True)  # quebra de linha do texto legado
+            line = _SPACES.sub(" ", line)
+            if not line:
+                continue
+            run = Run(
+                line, s["bold"] > 0, s["italic"] > 0, s["underline"] > 0, s["strike"] > 0,
+                self._links[-1] if self._links else None,
+            )
+            prev = self._runs[-1] if self._runs else None
+            if prev is not None and prev[1:] == run[1:]:
+                text = prev.text + line
+                if prev.text.endswith(" ") and line.startswith(" "):
+                    text = prev.text + line[1:]
+                self._runs[-1] = prev._replace(text=text)
+            else:
+                if prev is not None and prev.text.endswith(" ") and line.startswith(" "):
+                    run = run._replace(text=line[1:])
+                self._runs.append(run)
+
+    def close(self):
+        super().close()
+        self._flush()
+
+
+def parse(html_content, sanitize=None):
+    """
+    HTML do Quill (ou texto legado) -> tupla imutável de Blocks.
+    sanitize: aplicado ao texto legado inteiro (sem tags) antes da divisão.
+    """
+    if not html_content:
+        return ()
+    legacy = sanitize is not None and not _TAG.search(html_content)
+    if legacy:
+        html_content = sanitize(html_content)
+    parser = _QuillParser()
+    parser.feed(html_content)
+    parser.close()
+    if legacy:
+        return tuple(b if b.kind == "img" else b._replace(sanitized=True) for b in parser.blocks)
+    return tuple(parser.blocks)
+
+
+# ------------------------------------------------------------
+# Consultas sobre a IR
+# ------------------------------------------------------------
+def image_srcs(doc):
+    return [b.src for b in doc if b.kind == "img"]
+
+
+def to_text(doc):
+    """Texto puro, um bloco por linha; imagens viram IMAGE_MARKER."""
+    return "\n".join(IMAGE_MARKER if b.kind == "img" else b.text for b in doc)
+
+
+def list_prefix(block):
+    """Marcador do item de lista ("• " / "3. "); "" fora de lista."""
+    if block.kind != "li":
+        return ""
+    return f"{block.number}. " if block.list_type == "ordered" else "• "
+
+
+def sanitized_runs(block, sanitize):
+    """
+    Runs com o texto passado por `sanitize`, preservando um espaço nas
+    bordas entre runs (sanitize_text faz strip). Runs vazios somem.
+    Blocos de texto legado (sanitized=True) saem como estão.
+    """
+    if block.sanitized:
+        return list(block.runs)
+    out = []
+    last = len(block.runs) - 1
+    for i, run in enumerate(block.runs):
+        text = sanitize(run.text)
+        if not text:
+            if out and run.text[:1].isspace() and not out[-1].text.endswith(" "):
+                out[-1] = out[-1]._replace(text=out[-1].text + " ")
+            continue
+        if i > 0 and run.text[:1].isspace() and out and not out[-1].text.endswith(" "):
+            text = " " + text
+        if i < last and run.text[-1:].isspace():
+            text += " "
+        out.append(run._replace(text=text))
+    if out:
+        out[-1] = out[-1]._replace(text=out[-1].text.rstrip())
+    return out
+
+
+def to_html(doc, sanitize, image_src=None):
+    """
+    HTML seguro para st.markdown(unsafe_allow_html=True): texto escapado,
+    negrito/itálico/sublinhado/tachado/links, listas e imagens.
+    image_src(src) -> URL exibível (ex.: blob:sha256 -> data URI) ou None.
+    """
+    parts = []
+    open_list = None
+    for b in doc:
+        want = ("ol" if b.list_type == "ordered" else "ul") if b.kind == "li" else None
+        if open_list != want:
+            if open_list:
+                parts.append(f"</{open_list}>")
+            if want:
+                parts.append(f'<{want} style="margin:0 0 0 1.2em;">')
+            open_list = want
+
+        if b.kind == "img":
+            url = image_src(b.src) if image_src else b.src
+            if url:
+                parts.append(
+                    f'<img src="{_html.escape(url, quote=True)}" '
+                    'style="max-width:100%; margin:6px 0;">'
+                )
+            continue
+
+        inner = []
+        for run in sanitized_runs(b, sanitize):
+            t = _html.escape(run.text)
+            if run.bold:
+                t = f"<strong>{t}</strong>"
+            if run.italic:
+                t = f"<em>{t}</em>"
+            if run.underline:
+                t = f"<u>{t}</u>"
+            if run.strike:
+                t = f"<s>{t}</s>"
+            if run.link:
+                t = f'<a href="{_html.escape(run.link, quote=True)}" target="_blank">{t}</a>'
+            inner.append(t)
+        body = "".join(inner)
+
+        if b.kind == "li":
+            pad = f' style="margin-left:{1.2 * b.indent}em;"' if b.indent else ""
+            parts.append(f"<li{pad}>{body}</li>")
+        elif b.kind.startswith("h"):
+            parts.append(f'<div style="font-weight:700; margin:4px 0;">{body}</div>')
+        elif body:
+            pad = f"margin-left:{1.2 * b.indent}em; " if b.indent else ""
+            parts.append(f'<div style="{pad}margin:0;">{body}</div>')
+        else:
+            parts.append("<br>")
+
+    if open_list:
+        parts.append(f"</{open_list}>")
+    return "".join(parts)
@@ -0,0 +1,219 @@
+# rate_limiter.py
+# Agendador de requisições ao GitHub ciente do rate limit (um por processo)
+# Token bucket alimentado por X-RateLimit-* | Prioridades | Leituras coalescidas
+#
+#   WRITE      -> save / update / commit do usuário: sempre têm cota reservada;
+#                 com a cota zerada, esperam o reset em vez de tomar um 403
+#   READ       -> leitura interativa: respeita a reserva das escritas; sem
+#                 cota, é adiada (o load serve o snapshot local)
+#   BACKGROUND -> revalidação em 2º plano: só roda com folga de cota
+#
+# Com a cota folgada o bucket só limita rajadas (max_rate). Abaixo de
+# pace_below, o ritmo passa a ser restante / segundos até o reset: o
+# orçamento que sobra se espalha até o fim da janela em vez de acabar de uma vez.
+# Leituras simultâneas do mesmo arquivo viram uma só requisição (collapse).
+
+import threading
+import time
+from contextlib import contextmanager
+
+WRITE, READ, BACKGROUND = 0, 1, 2
+
+
+class RateLimitDeferred(Exception):
+    """Requisição adiada para preservar a cota (ou cota esgotada até o reset)."""
+
+
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class RateLimitScheduler:
+    def __init__(self, write_reserve=100, background_floor=1000, pace_below=2000, burst=20,
+                 max_rate=10.0, read_wait=5.0, write_wait=60.0):
+        self.write_reserve = write_reserve          # cota só para escritas
+        self.background_floor = background_floor    # abaixo disso, sem 2º plano
+        self.pace_below = pace_below                # abaixo disso, ritmo da janela
+        self.burst = float(burst)
+        self.max_rate = float(max_rate)             # req/s com a cota folgada
+        self.read_wait = float(read_wait)
+        self.write_wait = float(write_wait)
+
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._inflight = {}
+
+        self.remaining = None        # None = ainda sem cabeçalho
+        self.reset_at = None
+        self.blocked_until = 0.0     # rate limit secundário (Retry-After)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+
+        # Estatísticas
+        self.granted = 0
+        self.deferred = 0
+        self.collapsed = 0
+        self.waited_s = 0.0
+
+    # ============================================================
+    # PRIORIDADE (por thread)
+    # ============================================================
+    @contextmanager
+    def priority(self, level):
+        """Define a prioridade das requisições feitas dentro do bloco."""
+        prev = getattr(self._local, "priority", None)
+        self._local.priority = level if prev is None else min(prev, level)
+        try:
+            yield
+        finally:
+            self._local.priority = prev
+
+    def current_priority(self):
+        level = getattr(self._local, "priority", None)
+        return READ if level is None else level
+
+    # ============================================================
+    # BUCKET
+    # ============================================================
+    def _rate(self):
+        if self.remaining is None or self.reset_at is None or self.remaining > self.pace_below:
+            return self.max_rate
+        window = max(1.0, self.reset_at - time.time())
+        return min(self.max_rate, max(0.05, self.remaining / window))
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self._rate())
+        self._last = now
+        if self.reset_at is not None and time.time() >= self.reset_at:
+            self.remaining, self.reset_at = None, None  # janela nova
+
+    def _budget(self, level):
+        if self.remaining is None:
+            return float("inf")
+        floor = {WRITE: 0, READ: self.write_reserve, BACKGROUND: self.background_floor}[level]
+        return self.remaining - floor
+
+    def _blocked_for(self, level):
+        """Segundos até poder enviar (0 = já pode)."""
+        now = time.time()
+        if self.blocked_until > now:
+            return self.blocked_until - now
+        if self._budget(level) <= 0:
+            if level == WRITE and self.reset_at is not None:
+                return max(0.0, self.reset_at - now) + 1.0
+            return float("inf")
+        if level != WRITE and self._tokens < 1.0:
+            return (1.0 - self._tokens) / self._rate()
+        return 0.0
+
+    def acquire(self, level=None):
+        """
+        Reserva uma requisição. Retorna os segundos esperados; levanta
+        RateLimitDeferred quando a requisição deve ser adiada.
+        """
+        level = self.current_priority() if level is None else level
+        max_wait = {WRITE: self.write_wait, READ: self.read_wait, BACKGROUND: 0.0}[level]
+        deadline = time.monotonic() + max_wait
+        waited = 0.0
+
+        with self._cond:
+            while True:
+                self._refill()
+                wait = self._blocked_for(level)
+                if wait <= 0:
+                    break
+                left = deadline - time.monotonic()
+                if wait > left:
+                    self.deferred += 1
+                    raise RateLimitDeferred(
+                        "Limite de requisições do GitHub próximo do fim — operação adiada "
+                        f"(cota restante: {self.remaining})."
+                    )
+                t0 = time.monotonic()
+                self._cond.wait(min(wait, left))
+                waited += time.monotonic() - t0
+
+            # Escritas podem deixar o bucket negativo (as leituras esperam)
+            self._tokens = max(-self.burst, self._tokens - 1.0)
+            if self.remaining is not None:
+                self.remaining -= 1      # estimativa; o cabeçalho corrige
+            self.granted += 1
+            self.waited_s += waited
+        return waited
+
+    def observe(self, r):
+        """Sincroniza com os cabeçalhos X-RateLimit-* / Retry-After da resposta."""
+        headers = r.headers
+        with self._cond:
+            try:
+                if headers.get("X-RateLimit-Remaining") is not None:
+                    self.remaining = int(headers["X-RateLimit-Remaining"])
+                if headers.get("X-RateLimit-Reset") is not None:
+                    self.reset_at = float(headers["X-RateLimit-Reset"])
+            except (TypeError, ValueError):
+                pass
+
+            if r.status_code in (403, 429):
+                retry_after = headers.get("Retry-After")
+                if retry_after is not None:
+                    try:
+                        self.blocked_until = time.time() + float(retry_after)
+                    except ValueError:
+                        pass
+                elif self.remaining == 0 and self.reset_at is not None:
+                    self.blocked_until = self.reset_at
+                elif "rate" in (r.text or "").lower():
+                    # Limite secundário sem Retry-After: GitHub pede ~1 min
+                    self.blocked_until = time.time() + 60.0
+            self._cond.notify_all()
+
+    # ============================================================
+    # COALESCÊNCIA DE LEITURAS
+    # ============================================================
+    def collapse(self, key, fn):
+        """Leituras simultâneas da mesma chave compartilham uma requisição."""
+        with self._cond:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+            else:
+                self.collapsed += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._cond:
+                self._inflight.pop(key, None)
+            flight.event.set()
+
+    def stats(self):
+        with self._cond:
+            self._refill()
+            return {
+                "remaining": self.remaining,
+                "reset_at": self.reset_at,
+                "tokens": round(self._tokens, 1),
+                "rate": round(self._rate(), 2),
+                "granted": self.granted,
+                "deferred": self.deferred,
+                "collapsed": self.collapsed,
+                "waited_s": round(self.waited_s, 1),
+            }
+
+
+RATE_LIMITER = RateLimitScheduler()
@@ -0,0 +1,81 @@
+# record_merge.py
+# Merge de três vias (base / minha / deles) por registro, chaveado por "id"
+# Edições em registros diferentes — ou em campos diferentes do mesmo
+# registro — se combinam sozinhas; só o mesmo campo alterado dos dois
+# lados com valores diferentes vira conflito.
+
+import json
+
+_MISSING = object()
+
+
+class MergeConflict(Exception):
+    """Mesmo registro/campo alterado de formas diferentes pelos dois lados."""
+
+    def __init__(self, conflicts):
+        self.conflicts = conflicts  # [(id, campo ou None)]
+        ids = sorted({str(rid) for rid, _ in conflicts})
+        super().__init__(f"Conflito de edição nos registros: {', '.join(ids)}")
+
+
+def _key(record):
+    if isinstance(record, dict) and record.get("id") not in (None, ""):
+        return str(record.get("id"))
+    # Sem id: o próprio conteúdo é a identidade
+    return "#" + json.dumps(record, sort_keys=True, ensure_ascii=False)
+
+
+def _merge_value(b, m, t):
+    """Regra de três vias; retorna (valor, conflito?)."""
+    if m == b:
+        return t, False
+    if t == b or m == t:
+        return m, False
+    return None, True
+
+
+def _merge_record(rid, b, m, t, conflicts):
+    # Remoção de um lado e edição do outro: conflito real
+    if m is _MISSING or t is _MISSING or b is _MISSING or not all(isinstance(x, dict) for x in (b, m, t)):
+        value, conflict = _merge_value(b, m, t)
+        if conflict:
+            conflicts.append((rid, None))
+        return value
+
+    out = {}
+    for field in list(t.keys()) + [f for f in m.keys() if f not in t]:
+        value, conflict = _merge_value(b.get(field, _MISSING), m.get(field, _MISSING), t.get(field, _MISSING))
+        if conflict:
+            conflicts.append((rid, field))
+        elif value is not _MISSING:
+            out[field] = value
+    return out
+
+
+def three_way_merge(base, mine, theirs):
+    """
+    Combina as listas e devolve a nova lista (ordem: a deles, seguida dos
+    registros novos da minha). Levanta MergeConflict se houver conflito real.
+    """
+    b_idx = {_key(r): r for r in base or []}
+    m_idx = {_key(r): r for r in mine or []}
+    t_idx = {_key(r): r for r in theirs or []}
+
+    order = list(t_idx.keys()) + [k for k in m_idx.keys() if k not in t_idx]
+
+    conflicts = []
+    merged = []
+    for k in order:
+        value = _merge_record(
+            k,
+            b_idx.get(k, _MISSING),
+            m_idx.get(k, _MISSING),
+            t_idx.get(k, _MISSING),
+            conflicts,
+        )
+        if value is not _MISSING and value is not None:
+            merged.append(value)
+
+    if conflicts:
+        raise MergeConflict(conflicts)
+    return merged
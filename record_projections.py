@@ -0,0 +1,249 @@
+# record_projections.py
+# Projeções prontas para exibição/exportação — calculadas uma vez por versão
+#
+# page_consulta sanitizava cada campo a cada rerun e os exportadores limpavam
+# o HTML de observacoes/descricao a cada clique. Uma Projection guarda, para
+# uma versão do registro:
+#   display -> valores sanitizados (sanitize_text) dos campos texto
+#   doc     -> IR do campo rico (quill_ir)                        (sob demanda)
+#   text    -> IR em texto puro, com marcadores [IMAGEM]          (idem)
+#   images  -> ImageHandles dos blocos "img" da IR, na ordem      (idem)
+#   html    -> HTML seguro do campo rico para a tela              (idem)
+#   search  -> texto normalizado para busca (normalize)           (idem)
+#
+# A chave é uma impressão digital dos campos de origem + PROJECTION_VERSION +
+# text_sanitizer.VERSION: mudou o registro ou o saneador, recalcula. O cache é
+# do processo (compartilhado entre sessões); o save aquece a entrada do registro
+# gravado, e cada snapshot novo recalcula só os registros que mudaram.
+#
+# O cache é limitado em bytes, como os demais (MEMO, WRAP_CACHE, PREPARED): uma
+# projeção segura o HTML bruto (com base64 nos registros legados), a IR e, depois
+# de exibida, o html com cada imagem em data URI. O custo é contado na criação
+# e de novo quando um campo preguiçoso é calculado.
+
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
+
+import quill_ir
+import text_sanitizer
+from text_sanitizer import normalize, sanitize_text
+
+PROJECTION_VERSION = 3
+
+# Campos que nunca viram valor de exibição (base64 da imagem avulsa)
+SKIP_FIELDS = frozenset({"print_b64"})
+
+
+class Projection:
+    """
+    display fica pronto na criação; doc / text / images / html / search
+    dependem do campo rico e só são calculados no 1º acesso (a tela de
+    consulta não precisa buscar os blobs das imagens, só o PDF/Word).
+    """
+
+    __slots__ = ("display", "_html", "_projector", "_search_prefix", "_lazy", "_lock", "_cache", "_key")
+
+    def __init__(self, display, html="", projector=None, search_prefix=""):
+        self.display = display
+        self._html = html
+        self._projector = projector
+        self._search_prefix = search_prefix
+        self._lazy = {}
+        self._lock = threading.RLock()  # images/html/text dependem de doc
+        self._cache = None              # _ProjectionCache que guarda esta projeção
+        self._key = None
+
+    def get(self, key, default=""):
+        """Valor sanitizado do campo — o mesmo que sanitize_text(safe_get(rec, key))."""
+        return self.display.get(key, default)
+
+    def _once(self, name, compute):
+        value = self._lazy.get(name, _MISSING)
+        if value is _MISSING:
+            with self._lock:  # sessões simultâneas: calcula uma vez só
+                value = self._lazy.get(name, _MISSING)
+                if value is _MISSING:
+                    value = self._lazy[name] = compute()
+                    if self._cache is not None:
+                        self._cache.grow(self, _sizeof(value, name))
+        return value
+
+    @property
+    def nbytes(self):
+        """Bytes estimados retidos (HTML bruto, valores de exibição e campos já calculados)."""
+        total = sys.getsizeof(self._html) + _sizeof(self.display) + sys.getsizeof(self._search_prefix)
+        return total + sum(_sizeof(v, name) for name, v in list(self._lazy.items()))
+
+    @property
+    def doc(self):
+        """IR do campo rico (quill_ir.parse), uma vez por versão do registro."""
+        return self._once("doc", lambda: quill_ir.parse(self._html, sanitize_text))
+
+    @property
+    def text(self):
+        return self._once("text", lambda: quill_ir.to_text(self.doc))
+
+    @property
+    def images(self):
+        """
+        ImageHandles na ordem dos blocos "img" da IR (None = src não embutível).
+        Nada é decodificado aqui: o renderizador chama handle.open()/data().
+        """
+        def load():
+            image_handle = self._projector.image_handle if self._projector else None
+            return tuple(image_handle(src) if image_handle else None for src in quill_ir.image_srcs(self.doc))
+        return self._once("images", load)
+
+    @property
+    def html(self):
+        """HTML seguro para a tela (texto sanitizado e escapado)."""
+        def render():
+            image_url = self._projector.image_url if self._projector else None
+            return quill_ir.to_html(self.doc, sanitize_text, image_url)
+        return self._once("html", render)
+
+    @property
+    def search(self):
+        return self._once("search", lambda: normalize(f"{self._search_prefix} {self.text}"))
+
+
+_MISSING = object()
+
+
+def _sizeof(value, name=""):
+    """Estimativa (rasa nos objetos, recursiva em tuplas/listas/dicts) dos bytes retidos."""
+    if name == "images":
+        return 64 * len(value)  # handles: os bytes ficam no REGISTRY (image_handles)
+    if value is None or isinstance(value, bool):
+        return 0  # singletons compartilhados
+    if isinstance(value, str):
+        return sys.getsizeof(value)
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(_sizeof(v) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_sizeof(k) + _sizeof(v) for k, v in value.items())
+    return sys.getsizeof(value)
+
+
+class _ProjectionCache:
+    def __init__(self, max_entries=256, max_bytes=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._items = OrderedDict()  # (nome, versões, impressão digital) -> (Projection, bytes)
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            hit = self._items.get(key)
+            if hit is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return hit[0]
+            self.misses += 1
+            return None
+
+    def _evict(self):
+        while self._items and (len(self._items) > self.max_entries or self._size > self.max_bytes):
+            _, (proj, cost) = self._items.popitem(last=False)
+            proj._cache = None
+            self._size -= cost
+            self.evictions += 1
+
+    def put(self, key, proj):
+        cost = proj.nbytes
+        if cost > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                old[0]._cache = None
+                self._size -= old[1]
+            proj._cache, proj._key = self, key
+            self._items[key] = (proj, cost)
+            self._size += cost
+            self._evict()
+
+    def grow(self, proj, added):
+        """Campo preguiçoso calculado: soma o custo e descarta as mais antigas se passar do limite."""
+        with self._lock:
+            entry = self._items.get(proj._key)
+            if entry is None or entry[0] is not proj:
+                return
+            self._items[proj._key] = (proj, entry[1] + added)
+            self._size += added
+            self._evict()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+
+CACHE = _ProjectionCache()
+
+
+class Projector:
+    """
+    Projeções dos registros de um banco. `rich_field` é o campo HTML do
+    editor (observacoes / descricao); image_handle(src) -> ImageHandle | None
+    referencia uma imagem da IR (image_handles) e image_url(src) a converte
+    para exibição na tela.
+    """
+
+    def __init__(self, name, rich_field, image_handle=None, image_url=None, search_fields=("nome",)):
+        self.name = name
+        self.rich_field = rich_field
+        self.image_handle = image_handle
+        self.image_url = image_url
+        self.search_fields = tuple(search_fields)
+
+    def _fields(self, record):
+        return sorted(
+            k for k, v in record.items()
+            if k not in SKIP_FIELDS and isinstance(v, (str, int, float))
+        )
+
+    def _key(self, record, fields):
+        h = hashlib.blake2b(digest_size=16)
+        for k in fields:
+            v = record[k]
+            h.update(f"{k}\x00{type(v).__name__}\x00".encode("utf-8"))
+            h.update(str(v).encode("utf-8", "surrogatepass"))
+            h.update(b"\x01")
+        return (self.name, PROJECTION_VERSION, text_sanitizer.VERSION, h.digest())
+
+    def _compute(self, record, fields):
+        rich = self.rich_field
+        display = {k: sanitize_text(record[k]) for k in fields if k != rich}
+        html = record.get(rich) or ""
+        prefix = " ".join(str(record.get(k) or "") for k in self.search_fields)
+        return Projection(display, html if isinstance(html, str) else "", self, prefix)
+
+    def project(self, record):
+        """Projeção do registro (do cache, se a versão já foi vista)."""
+        if not isinstance(record, dict):
+            return Projection({})
+        fields = self._fields(record)
+        key = self._key(record, fields)
+        proj = CACHE.get(key)
+        if proj is None:
+            proj = self._compute(record, fields)
+            CACHE.put(key, proj)
+        return proj
+
+    # Ao salvar: deixa a projeção pronta para o próximo rerun
+    warm = project
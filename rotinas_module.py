@@ -5,14 +5,17 @@
 
 from typing import Callable, Any, List, Tuple
 from fpdf import FPDF
-from PIL import Image
 import streamlit as st
 import pandas as pd
 import time
 import re
 import io
-import os
-import base64
+
+from rate_limiter import RateLimitDeferred
+from record_merge import MergeConflict
+from record_projections import Projector
+from image_handles import handle_for
+from print_images import prepare as prepare_image
 
 # Import do editor
 from streamlit_quill import st_quill
@@ -20,51 +23,18 @@ from streamlit_quill import st_quill
 from streamlit_paste_button import paste_image_button
 
 
-def extract_images_from_html(html_content):
-    """
-    Extrai imagens base64 de tags <img> do HTML e retorna tupla (texto_sem_imagens, lista_imagens)
-    """
-    if not html_content:
-        return html_content, []
-
-    images = []
-
-    # Regex para encontrar tags <img src="data:image/...;base64,DATA">
-    img_pattern = r'<img[^>]+src="data:image/([^;]+);base64,([^"]+)"[^>]*>'
-
-    def replace_img(match):
-        image_format = match.group(1)  # png, jpeg, etc
-        base64_data = match.group(2)
-
-        try:
-            # Decodifica base64
-            img_data = base64.b64decode(base64_data)
-            # Cria objeto Image do Pillow
-            img = Image.open(io.BytesIO(img_data))
-            images.append(img)
-            # Retorna marcador de texto para manter espaçamento
-            return "\n[IMAGEM]\n"
-        except Exception as e:
-            print(f"Erro ao processar imagem: {e}")
-            return ""
-
-    # Substitui tags de imagem por marcador
-    html_without_images = re.sub(img_pattern, replace_img, html_content)
-
-    return html_without_images, images
-
-
 class RotinasModule:
     """
     Rotinas do Setor — módulo desacoplado do app principal.
 
     Dependências (injeção via __init__):
-      - db_rotinas: instância de GitHubJSON
+      - db_rotinas: instância de GitHubJSON ou ShardedJSON (API por registro)
       - sanitize_text: função(str) -> str
-      - build_wrapped_lines: função(str, FPDF, float, float, float) -> List[Tuple[str, float]]
+      - build_doc_lines: função(IR, FPDF, float, float, float) -> List[Tuple[str, float | None]]
       - _pdf_set_fonts: função(FPDF) -> str  (retorna o nome da fonte ativa)
       - generate_id: função(list) -> int
       - safe_get: função(dict, str, default) -> str
+      - blob_store: BlobStore (imagens fora do JSON) ou None
       - primary_color: str (hex)
       - setores_opcoes: List[str]
     """
@@ -73,32 +43,36 @@ class RotinasModule:
         self,
         db_rotinas: Any,
         sanitize_text: Callable[[str], str],
-        build_wrapped_lines: Callable[[str, FPDF, float, float, float], List[Tuple[str, float]]],
+        build_doc_lines: Callable[[tuple, FPDF, float, float, float], List[Tuple[str, Any]]],
         _pdf_set_fonts: Callable[[FPDF], str],
         generate_id: Callable[[list], int],
         safe_get: Callable[[dict, str, str], str],
+        blob_store: Any = None,
         primary_color: str = "#1F497D",
         setores_opcoes: List[str] = None,
     ):
         self.db = db_rotinas
         self.sanitize_text = sanitize_text
-        self.build_wrapped_lines = build_wrapped_lines
+        self.build_doc_lines = build_doc_lines
         self._pdf_set_fonts = _pdf_set_fonts
         self.generate_id = generate_id
         self.safe_get = safe_get
+        self.blob_store = blob_store
         self.primary_color = primary_color
         self.setores_opcoes = list(setores_opcoes or [])
 
+        # Projeções por versão da rotina (IR da descrição + imagens)
+        self.projector = Projector(
+            "rotinas", "descricao", image_handle=self._image_handle,
+            search_fields=("nome", "setor"),
+        )
+
     # ============================================================
-    # LIMPEZA DE HTML (igual ao módulo principal)
+    # IMAGENS DA DESCRIÇÃO (src de <img> na IR)
     # ============================================================
-    def _clean_html(self, raw_html: str) -> str:
-        """Remove tags HTML e normaliza espaços — compatível com PDF premium."""
-        if not raw_html:
-            return ""
-        cleanr = re.compile('<.*?>|&nbsp;')
-        cleantext = re.sub(cleanr, ' ', raw_html)
-        return re.sub(r' +', ' ', cleantext).strip()
+    def _image_handle(self, src: str):
+        """data URI (legado) ou blob:sha256 -> ImageHandle (decodifica só ao desenhar)."""
+        return handle_for(src, self.blob_store)
 
     # ============================================================
     # PDF PREMIUM DA ROTINA
@@ -131,7 +105,8 @@ class RotinasModule:
             pdf.ln(1.5)
 
         # -------- CABEÇALHO --------
-        nome_rot = self.sanitize_text(self.safe_get(dados, "nome")).upper()
+        proj = self.projector.project(dados)
+        nome_rot = proj.get("nome").upper()
         pdf.set_fill_color(*BLUE)
         pdf.set_text_color(255, 255, 255)
         set_font(18, True)
@@ -139,7 +114,7 @@ class RotinasModule:
         pdf.set_text_color(*TEXT)
         pdf.ln(5)
 
-        setor_val = self.sanitize_text(self.safe_get(dados, "setor"))
+        setor_val = proj.get("setor")
         if setor_val:
             pdf.set_text_color(80, 80, 80)
             set_font(11, False)
@@ -150,10 +125,8 @@ class RotinasModule:
         # -------- DESCRIÇÃO --------
         bar_title("Descrição")
 
-        descricao_raw = self.safe_get(dados, "descricao")
-        # Extrai imagens antes de limpar HTML
-        descricao_with_markers, desc_images = extract_images_from_html(descricao_raw)
-        descricao = self._clean_html(descricao_with_markers)
+        # IR da descrição + imagens (uma vez por versão da rotina)
+        desc_images = proj.images
 
         width = CONTENT_W
         line_h = 6.6
@@ -163,8 +136,8 @@ class RotinasModule:
 
         set_font(10, False)
 
-        wrapped_lines = self.build_wrapped_lines(
-            descricao, pdf, usable_w, line_h, bullet_indent=bullet_indent
+        wrapped_lines = self.build_doc_lines(
+            proj.doc, pdf, usable_w, line_h, bullet_indent=bullet_indent
         )
 
         # Renderiza texto e imagens
@@ -172,17 +145,17 @@ class RotinasModule:
         img_idx = 0
         while i < len(wrapped_lines):
             # Verifica se a linha atual contém marcador de imagem
-            if i < len(wrapped_lines) and "[IMAGEM]" in wrapped_lines[i][0]:
-                # Adiciona imagem se houver
-                if img_idx < len(desc_images):
-                    img = desc_images[img_idx]
-                    # Salva imagem temporariamente
-                    temp_img_path = f"/tmp/temp_rot_img_{img_idx}.png"
-                    img.save(temp_img_path, "PNG")
-
-                    # Calcula dimensões para caber na largura disponível
-                    img_width = CONTENT_W - 10  # margem de 5mm de cada lado
-                    aspect_ratio = img.height / img.width
+            if wrapped_lines[i][1] is None:
+                # Adiciona imagem se houver (None = não carregou)
+                handle = desc_images[img_idx] if img_idx < len(desc_images) else None
+                img_idx += 1
+                # Calcula dimensões para caber na largura disponível
+                img_width = CONTENT_W - 10  # margem de 5mm de cada lado
+                # Reduzida para impressão (cache por conteúdo e largura); JPEG/PNG vão
+                # da memória direto para o fpdf, sem arquivo em /tmp
+                prepared = prepare_image(handle, img_width)
+                if prepared is not None:
+                    aspect_ratio = prepared.height / prepared.width
                     img_height = img_width * aspect_ratio
 
                     # Verifica se cabe na página
@@ -194,16 +167,8 @@ class RotinasModule:
 
                     # Adiciona imagem centralizada
                     x_img = pdf.l_margin + 5
-                    pdf.image(temp_img_path, x=x_img, y=y_curr, w=img_width)
+                    pdf.image(io.BytesIO(prepared.data), x=x_img, y=y_curr, w=img_width)
                     pdf.set_y(y_curr + img_height + 5)  # espaço após imagem
-
-                    # Remove arquivo temporário
-                    try:
-                        os.remove(temp_img_path)
-                    except:
-                        pass
-
-                    img_idx += 1
                 # Pula linha com marcador
                 i += 1
                 continue
@@ -220,8 +185,12 @@ class RotinasModule:
             end = min(len(wrapped_lines), i + lines_per_page)
             slice_lines = wrapped_lines[i:end]
 
-            # Filtra linhas com marcador de imagem
-            slice_lines = [(txt, ind) for (txt, ind) in slice_lines if "[IMAGEM]" not in txt]
+            # Para antes do próximo bloco de imagem
+            for k, (_, ind) in enumerate(slice_lines):
+                if ind is None:
+                    slice_lines = slice_lines[:k]
+                    end = i + k
+                    break
             if not slice_lines:
                 i = end
                 continue
@@ -248,7 +217,9 @@ class RotinasModule:
     # ============================================================
     def page(self):
         try:
-            rotinas_atuais, _ = self.db.load(force=True)
+            # Índice (lista completa ou manifesto) basta para o menu
+            # Sem ir à rede: snapshot compartilhado, que o poller e os saves atualizam
+            rotinas_atuais = self.db.load_index()
         except Exception:
             rotinas_atuais = []
 
@@ -273,10 +244,26 @@ class RotinasModule:
             dados_rotina = {}
         else:
             rotina_id = escolha.split(" — ")[0]
-            dados_rotina = next(
-                (r for r in rotinas_atuais if str(r.get("id")) == str(rotina_id)),
-                {}
-            )
+            dados_rotina = self.db.load_record(rotina_id) or {}
+            if getattr(self.db, "write_behind", False) and self.db.is_pending(rotina_id):
+                st.caption("⏳ Alterações desta rotina ainda não foram enviadas ao GitHub.")
+            conflito = self.db.conflict(rotina_id) if getattr(self.db, "write_behind", False) else None
+            if conflito is not None:
+                campos = conflito["conflict"] if isinstance(conflito["conflict"], list) else []
+                st.warning(
+                    "⚠️ Sua última alteração desta rotina não foi enviada: outra pessoa mudou "
+                    + (f"os mesmos campos ({', '.join(campos)})" if campos else "o mesmo registro")
+                    + ". O formulário mostra a versão atual — refaça a edição e salve, ou descarte a pendência."
+                )
+                if st.button("Descartar minha alteração pendente", key=f"descartar_rotina_{rotina_id}"):
+                    self.db.discard(rotina_id)
+                    st.rerun()
+
+        # Versão aberta no formulário = base do merge ao salvar
+        edicao = st.session_state.get("edicao_rotina")
+        if edicao is None or edicao[0] != rotina_id:
+            st.session_state["edicao_rotina"] = edicao = (rotina_id, dados_rotina or None)
+        base_rotina = edicao[1]
 
         st.markdown("</div>", unsafe_allow_html=True)
 
@@ -307,6 +294,9 @@ class RotinasModule:
 
         # Garante string (nunca None)
         desc_inicial = str(self.safe_get(dados_rotina, "descricao", ""))
+        if self.blob_store is not None:
+            # Referências blob:sha256 viram data URI só para o editor exibir
+            desc_inicial = self.blob_store.inline_html(desc_inicial)
 
         descricao_html = st_quill(
             value=desc_inicial,
@@ -332,19 +322,34 @@ class RotinasModule:
                     "setor": setor,
                     "descricao": descricao_html,  # HTML salvo no JSON
                 }
-
-                if rotina_id == "novo":
-                    rotinas_atuais.append(novo_registro)
-                else:
-                    for i, r in enumerate(rotinas_atuais):
-                        if str(r.get("id")) == str(rotina_id):
-                            rotinas_atuais[i] = novo_registro
-                            break
-
-                if self.db.save(rotinas_atuais):
-                    st.success("✔ Rotina salva com sucesso!")
-                    self.db._cache_data = None
-                    time.sleep(1)
+                if self.blob_store is not None:
+                    # Imagens saem do JSON: blobs gravados antes do registro
+                    novo_registro = self.blob_store.externalize_record(
+                        novo_registro, html_fields=("descricao",)
+                    )
+
+                # Grava só este registro (no layout fatiado, só o arquivo dele)
+                try:
+                    salvo = self.db.save_record(novo_registro, base=base_rotina)
+                    if salvo:
+                        self.projector.warm(novo_registro)
+                        st.session_state.pop("edicao_rotina", None)
+                except MergeConflict as e:
+                    st.error(f"⚠️ {e}. Outra pessoa alterou os mesmos campos — recarregue e refaça a edição.")
+                    # A próxima tentativa compara com a versão atual, não com a de quando foi aberto
+                    st.session_state["edicao_rotina"] = (rotina_id, self.db.load_record(rotina_id, force=True))
+                    salvo = False
+                except RateLimitDeferred:
+                    st.warning("⏳ Limite de requisições do GitHub quase no fim — a rotina não foi salva. Tente novamente em alguns minutos.")
+                    salvo = False
+
+                if salvo:
+                    if getattr(self.db, "write_behind", False):
+                        st.toast("✔ Rotina salva — enviando ao GitHub em segundo plano")
+                    else:
+                        st.success("✔ Rotina salva com sucesso!")
+                        self.db.invalidate()
+                        time.sleep(1)
                     st.rerun()
 
         # ============================================================
@@ -397,23 +402,17 @@ class RotinasModule:
                     disabled=not can_delete,
                 ):
                     try:
-                        def _update(data):
-                            return [
-                                r for r in (data or [])
-                                if str(r.get("id")) != rotina_id_str
-                            ]
-
-                        self.db.update(_update)
+                        self.db.delete_record(rotina_id_str)
 
                         st.success(f"✔ Rotina {rotina_id_str} excluída com sucesso!")
 
-                        self.db._cache_data = None
-                        self.db._cache_sha = None
-                        self.db._cache_time = 0.0
+                        self.db.invalidate()
                         st.session_state.clear()
                         time.sleep(1)
                         st.rerun()
 
+                    except RateLimitDeferred:
+                        st.warning("⏳ Limite de requisições do GitHub quase no fim — a rotina não foi excluída. Tente novamente em alguns minutos.")
                     except Exception as e:
                         st.error(f"Falha ao excluir rotina {rotina_id_str}: {e}")
 
@@ -426,7 +425,7 @@ class RotinasModule:
         )
 
         if rotinas_atuais:
-            df = pd.DataFrame(rotinas_atuais)
+            df = pd.DataFrame(self.db.load_all())
             preferidas = ["id", "setor", "nome", "descricao"]
             col_order = (
                 [c for c in preferidas if c in df.columns]
@@ -0,0 +1,169 @@
+# sharded_store.py
+# Layout fatiado (opcional): um JSON por registro + manifesto leve
+# Save toca só o arquivo do registro alterado | Conflito de SHA por registro
+#
+#   dados/manifest.json  -> [{"id", "nome", "empresa", ..., "sha"}, ...]
+#   dados/<id>.json      -> [registro completo]
+#
+# Cada arquivo é tratado por um cliente de arquivo único (GitHubJSON),
+# então cache compartilhado, GET condicional e sessão keep-alive valem
+# também para os fragmentos.
+
+from http_pool import FETCH_POOL
+from record_merge import three_way_merge
+
+
+class ShardedJSON:
+    """
+    Mesma API por registro do GitHubJSON (load_index / load_record /
+    load_all / save_record / delete_record), mas com um arquivo por registro.
+
+    make_file: função(path) -> cliente de arquivo JSON (ex.: GitHubJSON)
+    base_dir: pasta no repositório (ex.: "dados")
+    index_fields: campos copiados para o manifesto (menus/listagens)
+    """
+
+    MANIFEST_NAME = "manifest.json"
+
+    def __init__(self, make_file, base_dir, index_fields=("id", "nome")):
+        self.make_file = make_file
+        self.base_dir = base_dir.strip("/")
+        self.index_fields = tuple(index_fields)
+        self.manifest = make_file(f"{self.base_dir}/{self.MANIFEST_NAME}")
+
+    def _shard(self, record_id):
+        return self.make_file(f"{self.base_dir}/{record_id}.json")
+
+    def _index_entry(self, record, sha):
+        entry = {f: record.get(f, "") for f in self.index_fields}
+        entry["id"] = record.get("id")
+        entry["sha"] = sha
+        return entry
+
+    def invalidate(self):
+        self.manifest.invalidate()
+
+    # ============================================================
+    # LEITURA
+    # ============================================================
+    def load(self, force=False):
+        """(manifesto, sha) — compatível com load_many()."""
+        return self.manifest.load(force=force)
+
+    def load_index(self, force=False):
+        entries, _ = self.manifest.load(force=force)
+        return entries
+
+    def load_record(self, record_id, force=False):
+        data, _ = self._shard(record_id).load(force=force)
+        return data[0] if data and isinstance(data[0], dict) else None
+
+    def load_all(self, force=False):
+        """Todos os registros completos (fragmentos buscados em paralelo)."""
+        ids = [e.get("id") for e in self.load_index(force=force)]
+        futures = [FETCH_POOL.submit(self.load_record, rid, force) for rid in ids]
+        return [rec for rec in (f.result() for f in futures) if rec is not None]
+
+    # ============================================================
+    # ESCRITA
+    # ============================================================
+    def apply_batch(self, upserts=(), deletes=(), bases=None):
+        """
+        Grava vários registros/remoções: os fragmentos vão em um único commit
+        (GitTransaction, quando disponível) e o manifesto em um update com
+        SHA locking — 2 commits por lote, independente do tamanho.
+
+        bases: {id: registro como estava quando a edição começou}; o fragmento
+        é combinado (três vias) com a versão atual em vez de sobrescrito.
+        """
+        for rec in upserts:
+            if rec.get("id") in (None, ""):
+                raise ValueError("record precisa de 'id' para o layout fatiado.")
+        bases = {str(k): v for k, v in (bases or {}).items()}
+
+        novos = {}
+        if len(upserts) + len(deletes) > 1 and hasattr(self.manifest, "transaction"):
+            tx = self.manifest.transaction()
+            for rec in upserts:
+                shard = self._shard(rec.get("id"))
+                base = bases.get(str(rec.get("id")))
+                if base is not None:
+                    atual, _ = shard.load(force=True)
+                    merged = three_way_merge([base], [rec], atual)
+                    rec = merged[0] if merged else rec
+                sha = shard.stage(tx, [rec])
+                novos[str(rec.get("id"))] = self._index_entry(rec, sha)
+            for rid in deletes:
+                self._shard(rid).stage(tx, [])  # lápide
+            tx.commit(f"Atualização de {len(upserts) + len(deletes)} registros — Manual Faturamento")
+        else:
+            for rec in upserts:
+                shard = self._shard(rec.get("id"))
+                base = bases.get(str(rec.get("id")))
+                if base is not None:
+                    shard.update(lambda data, rec=rec: [rec], base=[base])
+                    data, sha = shard.load()  # servido pelo cache (gravado no update)
+                    rec = data[0] if data else rec
+                else:
+                    shard.save([rec])
+                    _, sha = shard.load()  # servido pelo cache (gravado no save)
+                novos[str(rec.get("id"))] = self._index_entry(rec, sha)
+            for rid in deletes:
+                self._shard(rid).save([])  # lápide
+
+        removidos = {str(i) for i in deletes}
+
+        def _apply(entries):
+            pendentes = dict(novos)  # update() pode reexecutar esta função
+            out = []
+            for e in entries or []:
+                rid = str(e.get("id"))
+                if rid in removidos:
+                    continue
+                out.append(pendentes.pop(rid, e))
+            out.extend(pendentes.values())
+            return out
+
+        return self.manifest.update(_apply)
+
+    def save_record(self, record, base=None):
+        """base: o registro como foi aberto no formulário (None = sobrescreve)."""
+        return self.apply_batch([record], (), {record.get("id"): base} if base is not None else None)
+
+    def delete_record(self, record_id):
+        # Fragmento vira [] (lápide) e sai do manifesto
+        return self.apply_batch((), [record_id])
+
+    def import_records(self, records, prepare=None):
+        """
+        Importação/migração em lote a partir do layout monolítico: todos os
+        fragmentos e o manifesto vão em UM commit (GitTransaction) quando o
+        cliente de arquivo suporta transação; senão, um save por arquivo
+        (sequencial: commits paralelos no mesmo branch geram 409).
+
+        prepare: função opcional (registro, tx) -> registro, aplicada antes de
+        gravar (ex.: extrair imagens para o blob store no mesmo commit).
+        """
+        records = [r for r in (records or []) if isinstance(r, dict) and r.get("id") not in (None, "")]
+
+        if hasattr(self.manifest, "transaction"):
+            tx = self.manifest.transaction()
+            entries = []
+            for rec in records:
+                if prepare is not None:
+                    rec = prepare(rec, tx)
+                sha = self._shard(rec.get("id")).stage(tx, [rec])
+                entries.append(self._index_entry(rec, sha))
+            self.manifest.stage(tx, entries)
+            tx.commit(f"Importação de {len(records)} registros — layout fatiado")
+            return True
+
+        entries = []
+        for rec in records:
+            if prepare is not None:
+                rec = prepare(rec, None)
+            shard = self._shard(rec.get("id"))
+            shard.save([rec])
+            _, sha = shard.load()
+            entries.append(self._index_entry(rec, sha))
+        return self.manifest.save(entries)
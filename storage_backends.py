@@ -0,0 +1,432 @@
+# storage_backends.py
+# Backends plugáveis para o GitHubJSON — GitHub real, pasta local e emulador HTTP
+#
+#   "github"   -> https://api.github.com + sessão keep-alive (produção)
+#   "local"    -> LocalSession: contents API resolvida em processo, sobre uma pasta
+#   "emulador" -> ContentsAPIEmulator: servidor HTTP local que imita a API
+#                 (SHA locking, 409/422, ETag/304, cabeçalhos de rate limit,
+#                 latência configurável) para benchmark e testes de carga
+#
+# O GitHubJSON não muda: só recebe api_base + session. Tudo que fala HTTP
+# com o GitHub (GitHubJSON, GitTransaction, GitHubBlobStore) funciona nos três.
+
+import base64
+import hashlib
+import json
+import os
+import random
+import re
+import shutil
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from http_pool import get_session
+
+GITHUB_API = "https://api.github.com"
+
+_ROUTE_RE = re.compile(r"^/repos/([^/]+)/([^/]+)/(contents|git|commits)/?(.*)$")
+
+
+def _blob_sha(data: bytes) -> str:
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+class LocalContentsRepo:
+    """
+    Núcleo da emulação: um repositório = uma pasta. Implementa o subconjunto
+    da API usado pelo app (contents GET/PUT/DELETE e Git Data API para
+    commits atômicos). Thread-safe; cada escrita gera um "commit" novo, então
+    commits concorrentes se comportam como no GitHub (409/422).
+    """
+
+    def __init__(self, root, latency=0.0, jitter=0.0, rate_limit=5000, rate_window=3600.0):
+        self.root = os.path.abspath(root)
+        self.latency = float(latency)
+        self.jitter = float(jitter)
+        self.rate_limit = int(rate_limit)
+        self.rate_window = float(rate_window)
+
+        self._lock = threading.RLock()
+        self._head = "0" * 40
+        self._commits = {}   # sha -> {"tree", "parent"}
+        self._trees = {}     # sha -> [entradas da POST git/trees]
+        self._blobs = {}     # sha -> bytes (git/blobs ainda não commitados)
+        self._touched = {}   # path -> último commit que alterou o arquivo
+
+        self._remaining = self.rate_limit
+        self._reset_at = time.time() + self.rate_window
+
+        # Contadores para benchmark
+        self.requests = 0
+        self.conflicts = 0
+        self.rate_limited = 0
+
+        os.makedirs(self.root, exist_ok=True)
+
+    # ============================================================
+    # INFRA
+    # ============================================================
+    def _file(self, path):
+        full = os.path.abspath(os.path.join(self.root, path))
+        if not full.startswith(self.root + os.sep):
+            raise ValueError(f"Caminho fora do repositório: {path}")
+        return full
+
+    def _read(self, path):
+        try:
+            with open(self._file(path), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, path, data):
+        full = self._file(path)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        tmp = f"{full}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, full)
+
+    def _delete(self, path):
+        try:
+            os.remove(self._file(path))
+        except FileNotFoundError:
+            pass
+
+    def _new_commit(self, tree, parent):
+        sha = hashlib.sha1(f"{parent}{tree}{time.time()}{random.random()}".encode()).hexdigest()
+        self._commits[sha] = {"tree": tree, "parent": parent}
+        self._head = sha
+        return sha
+
+    def _rate_headers(self):
+        return {
+            "X-RateLimit-Limit": str(self.rate_limit),
+            "X-RateLimit-Remaining": str(max(0, self._remaining)),
+            "X-RateLimit-Reset": str(int(self._reset_at)),
+        }
+
+    # ============================================================
+    # DESPACHO
+    # ============================================================
+    def handle(self, method, url_path, params=None, headers=None, body=None):
+        """
+        Retorna (status, headers, payload); payload é dict/list (JSON),
+        bytes (conteúdo cru) ou None.
+        """
+        headers = {k.lower(): v for k, v in (headers or {}).items()}
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.random() * self.jitter)
+
+        with self._lock:
+            self.requests += 1
+            now = time.time()
+            if now >= self._reset_at:
+                self._remaining = self.rate_limit
+                self._reset_at = now + self.rate_window
+            if self._remaining <= 0:
+                self.rate_limited += 1
+                return 403, self._rate_headers(), {"message": "API rate limit exceeded (emulador)"}
+
+            m = _ROUTE_RE.match(url_path)
+            if not m:
+                return 404, self._rate_headers(), {"message": "Not Found"}
+            kind, rest = m.group(3), m.group(4)
+
+            if kind == "contents":
+                status, extra, payload = self._contents(method, rest, headers, body or {})
+            elif kind == "commits":
+                status, extra, payload = self._commits_for_path(params or {}, headers)
+            else:
+                status, extra, payload = self._git(method, rest, body or {})
+
+            # Como no GitHub: 304 de requisição condicional não consome cota
+            if status != 304:
+                self._remaining -= 1
+            out = self._rate_headers()
+            out.update(extra)
+            if status == 409:
+                self.conflicts += 1
+            return status, out, payload
+
+    # ------------------------------------------------------------
+    # contents API
+    # ------------------------------------------------------------
+    def _contents(self, method, path, headers, body):
+        current = self._read(path)
+        current_sha = _blob_sha(current) if current is not None else None
+
+        if method == "GET":
+            if current is None:
+                return 404, {}, {"message": "Not Found"}
+            etag = f'"{current_sha}"'
+            if headers.get("if-none-match") == etag:
+                return 304, {"ETag": etag}, None
+            if "raw" in headers.get("accept", ""):
+                return 200, {"ETag": etag}, current
+            return 200, {"ETag": etag}, {
+                "type": "file",
+                "path": path,
+                "sha": current_sha,
+                "size": len(current),
+                "encoding": "base64",
+                "content": base64.b64encode(current).decode("utf-8"),
+            }
+
+        if method == "PUT":
+            sent_sha = body.get("sha")
+            if current is not None and not sent_sha:
+                return 422, {}, {"message": 'Invalid request.\n\n"sha" wasn\'t supplied.'}
+            if sent_sha != current_sha:
+                return 409, {}, {"message": f"{path} does not match {sent_sha}"}
+            data = base64.b64decode(body.get("content") or "")
+            self._write(path, data)
+            commit = self._new_commit(None, self._head)
+            self._touched[path] = commit
+            return (201 if current is None else 200), {}, {
+                "content": {"path": path, "sha": _blob_sha(data)},
+                "commit": {"sha": commit},
+            }
+
+        if method == "DELETE":
+            if current is None:
+                return 404, {}, {"message": "Not Found"}
+            if body.get("sha") != current_sha:
+                return 409, {}, {"message": f"{path} does not match {body.get('sha')}"}
+            self._delete(path)
+            self._touched[path] = self._new_commit(None, self._head)
+            return 200, {}, {"commit": {"sha": self._touched[path]}}
+
+        return 405, {}, {"message": "Method Not Allowed"}
+
+    # ------------------------------------------------------------
+    # commits?path=... (último commit que tocou o arquivo; usado pelo poller)
+    # ------------------------------------------------------------
+    def _commits_for_path(self, params, headers):
+        path = params.get("path")
+        if isinstance(path, list):  # parse_qs do servidor HTTP
+            path = path[0]
+        commit = self._touched.get(path)
+        if commit is None:
+            current = self._read(path) if path else None
+            if current is None:
+                return 200, {}, []
+            # Arquivo que já estava na pasta: "commit inicial" derivado do conteúdo
+            commit = hashlib.sha1(b"inicial" + _blob_sha(current).encode()).hexdigest()
+        etag = f'"{commit}"'
+        if headers.get("if-none-match") == etag:
+            return 304, {"ETag": etag}, None
+        return 200, {"ETag": etag}, [{"sha": commit}]
+
+    # ------------------------------------------------------------
+    # Git Data API (subconjunto usado pela GitTransaction)
+    # ------------------------------------------------------------
+    def _git(self, method, rest, body):
+        if method == "GET" and rest.startswith("ref/heads/"):
+            return 200, {}, {"object": {"sha": self._head, "type": "commit"}}
+
+        if method == "GET" and rest.startswith("commits/"):
+            sha = rest.split("/", 1)[1]
+            return 200, {}, {"sha": sha, "tree": {"sha": f"tree-{sha}"}}
+
+        if method == "POST" and rest == "blobs":
+            data = base64.b64decode(body.get("content") or "")
+            sha = _blob_sha(data)
+            self._blobs[sha] = data
+            return 201, {}, {"sha": sha}
+
+        if method == "POST" and rest == "trees":
+            entries = list(body.get("tree") or [])
+            sha = hashlib.sha1(json.dumps(entries, sort_keys=True).encode()).hexdigest()
+            self._trees[sha] = entries
+            return 201, {}, {"sha": sha}
+
+        if method == "POST" and rest == "commits":
+            parents = body.get("parents") or [None]
+            sha = hashlib.sha1(f"{body.get('tree')}{parents}{random.random()}".encode()).hexdigest()
+            self._commits[sha] = {"tree": body.get("tree"), "parent": parents[0]}
+            return 201, {}, {"sha": sha}
+
+        if method == "PATCH" and rest.startswith("refs/heads/"):
+            commit = self._commits.get(body.get("sha"))
+            if commit is None:
+                return 422, {}, {"message": "Object does not exist"}
+            if commit["parent"] != self._head and not body.get("force"):
+                return 422, {}, {"message": "Update is not a fast forward"}
+            for entry in self._trees.get(commit["tree"], []):
+                if "content" in entry:
+                    self._write(entry["path"], entry["content"].encode("utf-8"))
+                elif entry.get("sha") is None:
+                    self._delete(entry["path"])
+                else:
+                    self._write(entry["path"], self._blobs[entry["sha"]])
+                self._touched[entry["path"]] = body["sha"]
+            self._head = body["sha"]
+            return 200, {}, {"object": {"sha": self._head}}
+
+        return 404, {}, {"message": "Not Found"}
+
+
+# ------------------------------------------------------------
+# Backend "local": sessão falsa que resolve tudo em processo
+# ------------------------------------------------------------
+class LocalResponse:
+    def __init__(self, status, headers, payload):
+        self.status_code = status
+        self.headers = headers
+        if isinstance(payload, (bytes, bytearray)):
+            self.content = bytes(payload)
+        elif payload is None:
+            self.content = b""
+        else:
+            self.content = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class LocalSession:
+    """Mesma interface usada de requests.Session (get/put/request)."""
+
+    def __init__(self, repo):
+        self.repo = repo
+
+    def request(self, method, url, headers=None, params=None, json=None, timeout=None, **kwargs):
+        status, out_headers, payload = self.repo.handle(
+            method.upper(), urlsplit(url).path, params, headers, json
+        )
+        return LocalResponse(status, out_headers, payload)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+
+# ------------------------------------------------------------
+# Backend "emulador": servidor HTTP real em 127.0.0.1
+# ------------------------------------------------------------
+class _EmulatorHandler(BaseHTTPRequestHandler):
+    repo = None  # definido por ContentsAPIEmulator
+
+    def _dispatch(self, method):
+        parts = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        try:
+            body = json.loads(raw) if raw else None
+        except json.JSONDecodeError:
+            body = None
+
+        status, headers, payload = self.repo.handle(
+            method, parts.path, parse_qs(parts.query), dict(self.headers.items()), body
+        )
+        if isinstance(payload, (bytes, bytearray)):
+            data, ctype = bytes(payload), "application/octet-stream"
+        elif payload is None:
+            data, ctype = b"", "application/json"
+        else:
+            data, ctype = json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json"
+
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if data:
+            self.wfile.write(data)
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PATCH(self):
+        self._dispatch("PATCH")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def log_message(self, *args):
+        pass  # silencioso (benchmarks)
+
+
+class ContentsAPIEmulator:
+    """
+    Servidor HTTP da contents API sobre um LocalContentsRepo.
+    Uso: emu = ContentsAPIEmulator(repo).start(); GitHubJSON(..., api_base=emu.base_url)
+    """
+
+    def __init__(self, repo, host="127.0.0.1", port=0):
+        handler = type("Handler", (_EmulatorHandler,), {"repo": repo})
+        self.repo = repo
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="gh-emulador", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# ------------------------------------------------------------
+# Seleção de backend (um por processo)
+# ------------------------------------------------------------
+_BACKENDS = {}
+_BACKENDS_LOCK = threading.Lock()
+
+
+def make_backend(kind="github", data_dir=".local_data", latency=0.0, seed_files=()):
+    """
+    Retorna (api_base, session) para o GitHubJSON.
+
+    seed_files: arquivos copiados para data_dir na primeira vez (ex.: os
+    dados.json / rotinas.json do repositório, para demonstrações).
+    """
+    kind = (kind or "github").lower()
+    if kind == "github":
+        return GITHUB_API, get_session()
+
+    key = (kind, os.path.abspath(data_dir), float(latency))
+    with _BACKENDS_LOCK:
+        if key not in _BACKENDS:
+            os.makedirs(data_dir, exist_ok=True)
+            for src in seed_files:
+                dst = os.path.join(data_dir, os.path.basename(src))
+                if os.path.exists(src) and not os.path.exists(dst):
+                    shutil.copyfile(src, dst)
+
+            repo = LocalContentsRepo(data_dir, latency=latency)
+            if kind == "local":
+                _BACKENDS[key] = ("local://", LocalSession(repo))
+            elif kind == "emulador":
+                emu = ContentsAPIEmulator(repo).start()
+                _BACKENDS[key] = (emu.base_url, get_session())
+            else:
+                raise ValueError(f"Backend de armazenamento desconhecido: {kind}")
+        return _BACKENDS[key]
@@ -0,0 +1,258 @@
+# storage_cache.py
+# Cache de snapshots compartilhado pelo processo — sobrevive a reruns e sessões
+# Chave owner/repo/path/branch | TTL configurável | Invalidação explícita | Hit/Miss
+# ETag guardado junto do snapshot para GETs condicionais (304 Not Modified)
+#
+# Cópia em disco (SQLite, payload em pickle) por path + SHA: partida a frio
+# instantânea, revalidação em 2º plano e fallback só-leitura sem GitHub
+#
+# O Streamlit reexecuta o app.py inteiro a cada interação e recria os objetos
+# GitHubJSON; módulos importados, porém, ficam em sys.modules durante toda a
+# vida do processo. Por isso o cache mora aqui e não dentro da instância.
+
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+
+class DiskSnapshotStore:
+    """
+    Último snapshot de cada arquivo em SQLite. O payload é a lista já
+    parseada em pickle (carrega bem mais rápido que base64 + json.loads).
+    Uma conexão por operação: seguro entre threads sem lock global.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS snapshots ("
+                " key TEXT PRIMARY KEY, path TEXT, sha TEXT, etag TEXT,"
+                " saved_at REAL, payload BLOB)"
+            )
+            con.execute("CREATE INDEX IF NOT EXISTS idx_snapshots_sha ON snapshots (path, sha)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    @staticmethod
+    def _key(key):
+        return "|".join(key)
+
+    def read(self, key):
+        with self._connect() as con:
+            row = con.execute(
+                "SELECT sha, etag, saved_at, payload FROM snapshots WHERE key = ?",
+                (self._key(key),),
+            ).fetchone()
+        if row is None:
+            return None
+        try:
+            data = pickle.loads(row[3])
+        except Exception:
+            return None  # cópia corrompida: ignora
+        return {"data": data, "sha": row[0], "etag": row[1], "saved_at": row[2]}
+
+    def write(self, key, data, sha, etag):
+        payload = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._connect() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO snapshots (key, path, sha, etag, saved_at, payload)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (self._key(key), key[2], sha, etag, time.time(), payload),
+            )
+
+
+class SnapshotCache:
+    """
+    Guarda, por arquivo, a lista já parseada junto com o SHA do GitHub.
+
+    Todas as sessões do processo compartilham a mesma instância
+    (SHARED_CACHE), então N analistas navegando custam um único GET
+    por janela de TTL.
+    """
+
+    def __init__(self, ttl=30.0):
+        self.ttl = float(ttl)
+        self._lock = threading.RLock()
+        self._entries = {}  # key -> {"data", "sha", "etag", "time"}
+        self._disk = None
+        self._refreshing = set()
+        self._offline = {}  # key -> momento em que o GitHub falhou
+        self._no_stale = set()  # invalidadas: exigem ida ao GitHub
+
+        # Contadores para diagnóstico
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.not_modified = 0  # respostas 304 reaproveitadas
+        self.stale_served = 0  # snapshots vencidos/do disco servidos na hora
+
+    def attach_disk(self, path):
+        """Liga a cópia persistente (idempotente entre reruns)."""
+        with self._lock:
+            if self._disk is None or self._disk.path != path:
+                self._disk = DiskSnapshotStore(path)
+
+    def _entry(self, key):
+        """Entrada em memória ou, na falta dela, a cópia do disco (já vencida)."""
+        entry = self._entries.get(key)
+        if entry is None and self._disk is not None:
+            try:
+                saved = self._disk.read(key)
+            except Exception:
+                saved = None
+            if saved is not None:
+                entry = {"data": saved["data"], "sha": saved["sha"], "etag": saved["etag"], "time": 0.0}
+                self._entries[key] = entry
+        return entry
+
+    @staticmethod
+    def make_key(owner, repo, path, branch, api_base=None):
+        # Backends locais/emulador (storage_backends) não se misturam com o GitHub
+        if api_base and "api.github.com" not in api_base:
+            owner = f"{api_base}|{owner}"
+        return (str(owner), str(repo), str(path), str(branch))
+
+    # ============================================================
+    # LEITURA / ESCRITA
+    # ============================================================
+    def get(self, key, ttl=None):
+        """
+        Retorna (data, sha) se houver entrada dentro do TTL; senão None.
+        A lista devolvida é uma cópia rasa: quem chama pode dar append/replace
+        sem sujar o snapshot compartilhado.
+        """
+        max_age = self.ttl if ttl is None else float(ttl)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (time.time() - entry["time"]) >= max_age:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return list(entry["data"]), entry["sha"]
+
+    def put(self, key, data, sha, etag=None):
+        data = list(data) if isinstance(data, list) else []
+        with self._lock:
+            self._entries[key] = {
+                "data": data,
+                "sha": sha,
+                "etag": etag,
+                "time": time.time(),
+            }
+            self._offline.pop(key, None)
+            self._no_stale.discard(key)
+            disk = self._disk
+        if disk is not None:
+            try:
+                disk.write(key, data, sha, etag)
+            except Exception as e:
+                print(f"Falha ao gravar snapshot em disco: {e}")
+
+    # ============================================================
+    # SNAPSHOT VENCIDO (stale-while-revalidate / fallback)
+    # ============================================================
+    def get_stale(self, key):
+        """(data, sha) de qualquer idade — memória ou disco — ou None."""
+        with self._lock:
+            if key in self._no_stale:
+                return None
+            entry = self._entry(key)
+            if entry is None:
+                return None
+            self.stale_served += 1
+            return list(entry["data"]), entry["sha"]
+
+    def parsed_for_sha(self, key, sha):
+        """Lista já parseada se o SHA recebido for o mesmo do snapshot guardado."""
+        with self._lock:
+            entry = self._entry(key)
+            if entry is not None and sha and entry["sha"] == sha:
+                return list(entry["data"])
+            return None
+
+    def begin_refresh(self, key):
+        """True se esta thread deve revalidar (evita N revalidações simultâneas)."""
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def end_refresh(self, key):
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def mark_offline(self, key):
+        with self._lock:
+            self._offline.setdefault(key, time.time())
+
+    def offline_since(self, key=None):
+        """Momento da primeira falha ainda não recuperada (ou None)."""
+        with self._lock:
+            if key is not None:
+                return self._offline.get(key)
+            return min(self._offline.values()) if self._offline else None
+
+    # ============================================================
+    # GET CONDICIONAL (ETag / If-None-Match)
+    # ============================================================
+    def etag(self, key):
+        """ETag do último GET completo (mesmo com TTL vencido) ou None."""
+        with self._lock:
+            entry = self._entry(key)
+            return entry.get("etag") if entry else None
+
+    def revalidate(self, key):
+        """
+        Chamado quando o GitHub responde 304: renova o TTL e devolve o
+        snapshot já parseado (sem base64 nem json.loads). Retorna None se a
+        entrada tiver sido invalidada entre o envio do GET e a resposta.
+        """
+        with self._lock:
+            entry = self._entry(key)
+            if entry is None:
+                return None
+            entry["time"] = time.time()
+            self._offline.pop(key, None)
+            self._no_stale.discard(key)
+            self.not_modified += 1
+            return list(entry["data"]), entry["sha"]
+
+    def invalidate(self, key=None):
+        """Remove uma entrada (ou todas, se key=None)."""
+        with self._lock:
+            if key is None:
+                self.invalidations += len(self._entries)
+                self._no_stale.update(self._entries.keys())
+                self._entries.clear()
+            else:
+                self._no_stale.add(key)
+                if self._entries.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    # ============================================================
+    # DIAGNÓSTICO
+    # ============================================================
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+                "invalidations": self.invalidations,
+                "not_modified": self.not_modified,
+                "stale_served": self.stale_served,
+                "offline": len(self._offline),
+                "entries": len(self._entries),
+                "ttl": self.ttl,
+            }
+
+
+# Instância única por processo (compartilhada entre sessões do Streamlit)
+SHARED_CACHE = SnapshotCache()
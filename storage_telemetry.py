@@ -0,0 +1,172 @@
+# storage_telemetry.py
+# Telemetria do armazenamento — uma linha por load / save / update / commit
+# Latência HTTP | Bytes antes/depois do base64 | Tempo de decode/parse
+# Tentativas | Espera que nós mesmos adicionamos | X-RateLimit-Remaining
+#
+# Cada operação abre um StorageTrace (por thread). Chamadas aninhadas —
+# save() chamando load(force=True), por exemplo — somam no trace de fora,
+# então um save lento mostra de onde veio o tempo: HTTP, backoff de 409 ou
+# espera de rate limit. Os traces fechados vão para um buffer circular.
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class StorageTrace:
+    """Medições de uma operação de armazenamento."""
+
+    def __init__(self, op, path):
+        self.op = op
+        self.path = path
+        self.source = "network"      # network | cache | stale | 304 | offline
+        self.started = time.time()
+        self.total_s = 0.0
+
+        self.requests = 0
+        self.http_s = 0.0
+        self.statuses = []
+        self.rate_remaining = None
+
+        self.raw_bytes = 0           # arquivo em bytes (antes do base64)
+        self.b64_bytes = 0           # tamanho trafegado em base64
+        self.b64_s = 0.0             # base64 encode/decode
+        self.json_s = 0.0            # json.loads / json.dumps
+
+        self.attempts = 0
+        self.sleep_s = 0.0           # backoff/rate limit adicionados por nós
+        self.error = None
+
+    def call(self, fn, *args, **kwargs):
+        """Executa uma requisição HTTP e registra latência/status/cota."""
+        t0 = time.perf_counter()
+        try:
+            r = fn(*args, **kwargs)
+        finally:
+            self.http_s += time.perf_counter() - t0
+            self.requests += 1
+        self.statuses.append(r.status_code)
+        remaining = r.headers.get("X-RateLimit-Remaining")
+        if remaining is not None:
+            try:
+                self.rate_remaining = int(remaining)
+                TELEMETRY.rate_remaining = self.rate_remaining
+            except ValueError:
+                pass
+        return r
+
+    def served(self, source):
+        """Origem da leitura; num save/update (load aninhado) não se aplica."""
+        if self.op in ("load", "refresh"):
+            self.source = source
+
+    def sleep(self, seconds):
+        """time.sleep contabilizado (backoff de 409, espera de rate limit)."""
+        seconds = max(0.0, float(seconds))
+        time.sleep(seconds)
+        self.sleep_s += seconds
+
+    def as_dict(self):
+        return {
+            "op": self.op,
+            "path": self.path,
+            "source": self.source,
+            "started": self.started,
+            "total_ms": self.total_s * 1000,
+            "http_ms": self.http_s * 1000,
+            "requests": self.requests,
+            "statuses": list(self.statuses),
+            "raw_bytes": self.raw_bytes,
+            "b64_bytes": self.b64_bytes,
+            "b64_ms": self.b64_s * 1000,
+            "json_ms": self.json_s * 1000,
+            "attempts": self.attempts,
+            "sleep_ms": self.sleep_s * 1000,
+            "rate_remaining": self.rate_remaining,
+            "error": self.error,
+        }
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+class StorageTelemetry:
+    """Buffer circular (por processo) com os últimos traces fechados."""
+
+    def __init__(self, maxlen=500):
+        self._lock = threading.Lock()
+        self._buffer = deque(maxlen=maxlen)
+        self._local = threading.local()
+        self.rate_remaining = None   # última X-RateLimit-Remaining vista
+
+    def current(self):
+        """Trace ativo nesta thread (ou um avulso, que não é registrado)."""
+        tr = getattr(self._local, "trace", None)
+        return tr if tr is not None else StorageTrace("avulso", "")
+
+    @contextmanager
+    def trace(self, op, path=""):
+        outer = getattr(self._local, "trace", None)
+        if outer is not None:
+            yield outer  # aninhado: soma no trace de fora
+            return
+
+        tr = StorageTrace(op, path)
+        self._local.trace = tr
+        t0 = time.perf_counter()
+        try:
+            yield tr
+        except BaseException as e:
+            tr.error = f"{type(e).__name__}: {e}"[:200]
+            raise
+        finally:
+            tr.total_s = time.perf_counter() - t0
+            self._local.trace = None
+            with self._lock:
+                self._buffer.append(tr.as_dict())
+
+    def recent(self, n=50):
+        with self._lock:
+            return list(self._buffer)[-n:]
+
+    def clear(self):
+        with self._lock:
+            self._buffer.clear()
+
+    def summary(self):
+        """Agregado por (op, origem): contagem, p50/p95 e causas de espera."""
+        with self._lock:
+            rows = list(self._buffer)
+
+        groups = {}
+        for row in rows:
+            groups.setdefault((row["op"], row["source"]), []).append(row)
+
+        out = []
+        for (op, source), items in sorted(groups.items()):
+            total = [i["total_ms"] for i in items]
+            http = [i["http_ms"] for i in items]
+            sleep = [i["sleep_ms"] for i in items]
+            out.append({
+                "op": op,
+                "origem": source,
+                "n": len(items),
+                "p50_ms": _percentile(total, 0.50),
+                "p95_ms": _percentile(total, 0.95),
+                "http_p95_ms": _percentile(http, 0.95),
+                "espera_p95_ms": _percentile(sleep, 0.95),
+                "tentativas_max": max(i["attempts"] for i in items),
+                "kb_json": items[-1]["raw_bytes"] / 1024,
+                "kb_base64": items[-1]["b64_bytes"] / 1024,
+                "erros": sum(1 for i in items if i["error"]),
+            })
+        return out
+
+
+TELEMETRY = StorageTelemetry()
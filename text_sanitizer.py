@@ -0,0 +1,225 @@
+# text_sanitizer.py
+# Saneamento de texto (PDF / Word / UI) — padrões compilados uma vez só
+#
+# Mesma saída, byte a byte, da versão antiga (≈15 re.sub por chamada e as
+# correções recompiladas com IGNORECASE a cada texto), mas com:
+#   - todas as regex compiladas no import;
+#   - passes independentes fundidos (números/letras e pontuação);
+#   - as correções de colagem numa única alternação + tabela de troca;
+#   - cada pass pulado quando o texto não tem o caractere que ele procura.
+# bench_sanitizer.py confere a equivalência e mede MB/s no dados.json real.
+#
+# sanitize_text / normalize passam por um LRU limitado em bytes (MEMO).
+
+import hashlib
+import re
+import sys
+import threading
+import unicodedata
+from collections import OrderedDict
+
+# ------------------------------------------------------------
+# Padrões
+# ------------------------------------------------------------
+# Sobe quando a saída muda (invalida projeções calculadas: record_projections)
+VERSION = 1
+
+_LETRA = "A-Za-zÁÉÍÓÚÂÊÔÃÕÀÇáéíóúâêôãõàç"
+
+# Caracteres invisíveis que causam colagem -> espaço
+_INVISIVEIS = re.compile(r"[\u00A0\u200B-\u200F\uFEFF]")
+
+_URL = re.compile(r"https?://[^\s<>\"']+")
+
+# 90dias -> 90 dias | PAG2 -> PAG 2 (os dois sentidos num pass só)
+_DIGITO = re.compile(r"\d")
+_NUM_LETRA = re.compile(rf"\d(?=[{_LETRA}])|[{_LETRA}](?=\d)")
+
+# fechar.> -> fechar. > | a:b -> a: b | a;b -> a; b (ignora decimais)
+_PONTUACAO = re.compile(r"[.:;](?:(?<=[:;])(?!\s)|(?<!\d\.)(?=[^\s\d]))")
+
+# Espaços ao redor de > e /. Operadores vizinhos (">/", "/ >") dependem da
+# ordem dos dois passes antigos; só nesse caso raro eles rodam em sequência
+_OPERADOR = re.compile(r"\s*([>/])\s*")
+_OPERADORES_VIZINHOS = re.compile(r"[>/]\s*[>/]")
+_MAIOR = re.compile(r"\s*>\s*")
+_BARRA = re.compile(r"\s*/\s*")
+
+# Correções específicas de colagem comuns em faturamento
+CORRECOES = {
+    "PELASMARTKIDS": "PELA SMARTKIDS",
+    "serpediatria": "ser pediatria",
+    "depacote": "de pacote",
+    "diasútil": "dias útil",
+    "às12:00": "às 12:00",
+    "sófechar": "só fechar",
+    "gera oXML": "gera o XML",
+    "noSisAmil": "no SisAmil",
+}
+_CORRECOES_LOWER = {erro.lower(): certo for erro, certo in CORRECOES.items()}
+_CORRECOES_RE = re.compile("|".join(re.escape(e) for e in CORRECOES), re.IGNORECASE)
+# Letras que o IGNORECASE iguala a i/s mas que str.lower() não converte
+_CASO_ESPECIAL = str.maketrans({"ı": "i", "ſ": "s", "\u0307": None})
+
+# •Texto -> • Texto
+_BULLET = re.compile(r"([•\-–—\*→])([^\s])")
+_BULLET_CHARS = frozenset("•-–—*→")
+
+_ESPACOS = re.compile(r"[ \t]+")
+
+
+def _tem_correcao(txt):
+    """Pré-filtro barato (lower + busca de substring) antes da regex IGNORECASE."""
+    low = txt.lower()
+    if "ı" in low or "ſ" in low or "\u0307" in low:
+        low = low.translate(_CASO_ESPECIAL)
+    return any(erro in low for erro in _CORRECOES_LOWER)
+
+
+def _correcao(m):
+    return _CORRECOES_LOWER[m.group(0).lower().translate(_CASO_ESPECIAL)]
+
+
+# ------------------------------------------------------------
+# API
+# ------------------------------------------------------------
+def fix_technical_spacing(txt: str) -> str:
+    if not txt:
+        return ""
+
+    # 1) Protege URLs para não inserir espaços no meio delas
+    urls = []
+    if "http" in txt:
+        def _url_replacer(match):
+            urls.append(match.group(0))
+            return f"\u0000{len(urls) - 1}\u0000"
+        txt = _URL.sub(_url_replacer, txt)
+
+    # 2) Espaço entre números e letras
+    if _DIGITO.search(txt):
+        txt = _NUM_LETRA.sub(r"\g<0> ", txt)
+
+    # 3) Espaço após pontuação colada
+    if "." in txt or ":" in txt or ";" in txt:
+        txt = _PONTUACAO.sub(r"\g<0> ", txt)
+
+    # 4) Espaços ao redor de > e /
+    if ">" in txt or "/" in txt:
+        if _OPERADORES_VIZINHOS.search(txt):
+            txt = _BARRA.sub(" / ", _MAIOR.sub(" > ", txt))
+        else:
+            txt = _OPERADOR.sub(r" \1 ", txt)
+
+    # 5) Correções de colagem (uma alternação só)
+    if _tem_correcao(txt):
+        txt = _CORRECOES_RE.sub(_correcao, txt)
+
+    # 6) Bullets coladas
+    if not _BULLET_CHARS.isdisjoint(txt):
+        txt = _BULLET.sub(r"\1 \2", txt)
+
+    # 7) Restaura URLs
+    for i, url in enumerate(urls):
+        txt = txt.replace(f"\u0000{i}\u0000", url)
+
+    return txt
+
+
+def _sanitize(txt):
+    # Normalização e remoção de caracteres invisíveis que causam colagem
+    txt = _INVISIVEIS.sub(" ", unicodedata.normalize("NFKC", txt))
+
+    # Aplica correções de espaçamento
+    txt = fix_technical_spacing(txt)
+
+    # Remove espaços duplos
+    if "  " in txt or "\t" in txt:
+        txt = _ESPACOS.sub(" ", txt)
+    return txt.strip()
+
+
+# ------------------------------------------------------------
+# Memo por processo — os mesmos valores (nome, setor, células de tabela)
+# passam aqui a cada rerun e exportação. Função pura: seguro entre sessões.
+# ------------------------------------------------------------
+class _TextMemo:
+    def __init__(self, max_bytes=16 * 1024 * 1024, hash_above=4096):
+        self.max_bytes = max_bytes
+        self.hash_above = hash_above    # textos maiores: chave = digest
+        self._lock = threading.Lock()
+        self._items = OrderedDict()     # (função, chave) -> (resultado, bytes)
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _key(self, kind, txt):
+        if len(txt) > self.hash_above:
+            digest = hashlib.blake2b(txt.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+            return (kind, len(txt), digest)
+        return (kind, txt)
+
+    def get_or_compute(self, kind, txt, fn):
+        key = self._key(kind, txt)
+        with self._lock:
+            hit = self._items.get(key)
+            if hit is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return hit[0]
+            self.misses += 1
+
+        result = fn(txt)  # fora do lock: sessões não se bloqueiam
+
+        cost = sys.getsizeof(result) + (sys.getsizeof(key[1]) if len(key) == 2 else 64)
+        if cost > self.max_bytes:
+            return result
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            self._items[key] = (result, cost)
+            self._size += cost
+            while self._size > self.max_bytes and self._items:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self._size -= evicted
+                self.evictions += 1
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._size = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+
+MEMO = _TextMemo()
+
+
+def _normalize(txt):
+    return sanitize_text(txt).strip().lower()
+
+
+def sanitize_text(text: str) -> str:
+    if not text:
+        return ""
+    return MEMO.get_or_compute("sanitize", str(text), _sanitize)
+
+
+def normalize(value):
+    if not value:
+        return ""
+    return MEMO.get_or_compute("normalize", str(value), _normalize)
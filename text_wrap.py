@@ -0,0 +1,307 @@
+# text_wrap.py
+# Quebra de linha do PDF com tabela de larguras por fonte — O(n) por parágrafo
+#
+# O wrap_text antigo chamava pdf.get_string_width(candidate) para cada palavra,
+# com `candidate` sendo a linha inteira até ali: custo quadrático no tamanho da
+# linha, em cada parágrafo das observações, célula de tabela e valor de
+# one_column_info. Aqui a largura de uma linha é a soma das larguras (em
+# unidades da fonte, inteiras) das palavras, cada palavra medida uma vez só.
+#
+# As linhas são idênticas às de antes: o fpdf2 calcula
+#     soma(cw[ord(c)]) * font_size_pt * 0.001 / k
+# e a soma em inteiros é exata, então basta achar (uma vez por chamada) o
+# maior total de unidades que ainda cabe em max_width com a mesma conta.
+# Fonte sem tabela (Helvetica, shaping, char_spacing...) usa o caminho antigo.
+# bench_wrap.py confere a equivalência e mede o ganho.
+#
+# O resultado fica num LRU limitado em bytes (WRAP_CACHE), chaveado por
+# (texto ou digest, arquivo da fonte + estilo, tamanho, largura útil): exportar
+# de novo um registro que não mudou não refaz a quebra de nenhum parágrafo.
+
+import hashlib
+import re
+import sys
+import threading
+from collections import OrderedDict
+
+_DELIMS = "/?&=._-"
+_DELIM_SPLIT = re.compile(r"([/?&=._-])")
+
+
+def _split_token_preserving_delims(token: str):
+    """
+    Para tokens tipo URL/caminho, quebra por delimitadores mantendo-os
+    NO FIM do segmento (sem inserir espaços).
+    Ex.: 'https://a/b?x=1' -> ['https://a/', 'b?', 'x=', '1']
+    """
+    parts = _DELIM_SPLIT.split(token)
+    segs = []
+    i = 0
+    while i < len(parts):
+        seg = parts[i]
+        if seg == "":
+            i += 1
+            continue
+        if i + 1 < len(parts) and len(parts[i + 1]) == 1 and parts[i + 1] in _DELIMS:
+            seg += parts[i + 1]
+            i += 2
+        else:
+            i += 1
+        segs.append(seg)
+    return segs
+
+
+# ------------------------------------------------------------
+# Tabela de larguras (por arquivo de fonte, no processo todo)
+# ------------------------------------------------------------
+class FontMetrics:
+    """Larguras de avanço (unidades /1000 em) de uma fonte TTF + memo por palavra."""
+
+    def __init__(self, cw, missing, max_words=65536):
+        self._cw = dict(cw)
+        self._missing = missing
+        self._words = {}
+        self.max_words = max_words
+
+    def measure(self, text):
+        cw, missing = self._cw, self._missing
+        return sum([cw.get(o, missing) for o in map(ord, text)])
+
+    def units(self, word):
+        u = self._words.get(word)
+        if u is None:
+            u = self.measure(word)
+            if len(self._words) >= self.max_words:
+                self._words.clear()
+            self._words[word] = u
+        return u
+
+
+_METRICS = {}
+_METRICS_LOCK = threading.Lock()
+
+
+def metrics_for(pdf):
+    """FontMetrics da fonte atual do pdf; None se a largura não for só soma de glifos."""
+    font = pdf.current_font
+    if (
+        font is None
+        or not hasattr(font, "ttffile")
+        or getattr(font, "is_symbol", False)
+        or pdf.text_shaping
+        or pdf._fallback_font_ids
+        or pdf.char_spacing
+        or pdf.font_stretching != 100
+    ):
+        return None
+    key = (str(font.ttffile), font.fontkey)
+    m = _METRICS.get(key)
+    if m is None:
+        with _METRICS_LOCK:
+            m = _METRICS.get(key)
+            if m is None:
+                m = _METRICS[key] = FontMetrics(font.cw, font.cw.default_factory())
+    # get_text_width do fpdf2 (>= 2.8.4) registra o maior tamanho usado na fonte
+    if pdf.font_size_pt > getattr(font, "biggest_size_pt", pdf.font_size_pt):
+        font.biggest_size_pt = pdf.font_size_pt
+    return m
+
+
+def _unit_limit(pdf, max_width):
+    """Maior total de unidades u com u * font_size_pt * 0.001 / k <= max_width."""
+    size, k = pdf.font_size_pt, pdf.k
+
+    def fits(u):
+        return u * size * 0.001 / k <= max_width
+
+    if not fits(0):
+        return -1
+    lo, hi = 0, 1
+    while fits(hi):
+        lo, hi = hi, hi * 2
+        if hi > 1 << 62:
+            return lo
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if fits(mid):
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+
+# ------------------------------------------------------------
+# Cache de linhas quebradas (por processo, limitado em bytes)
+# ------------------------------------------------------------
+class _WrapCache:
+    def __init__(self, max_bytes=8 * 1024 * 1024, hash_above=256):
+        self.max_bytes = max_bytes
+        self.hash_above = hash_above    # parágrafos maiores: chave = digest
+        self._lock = threading.Lock()
+        self._items = OrderedDict()     # chave -> (linhas, bytes)
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, text, font, size, k, width):
+        if len(text) > self.hash_above:
+            text = (len(text), hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest())
+        return (str(font.ttffile), font.fontkey, size, k, width, text)
+
+    def get(self, key):
+        with self._lock:
+            hit = self._items.get(key)
+            if hit is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return hit[0]
+            self.misses += 1
+            return None
+
+    def put(self, key, lines):
+        text = key[-1]
+        cost = sys.getsizeof(lines) + sum(sys.getsizeof(ln) for ln in lines) + (
+            sys.getsizeof(text) if isinstance(text, str) else 64
+        )
+        if cost > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            self._items[key] = (lines, cost)
+            self._size += cost
+            while self._size > self.max_bytes and self._items:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self._size -= evicted
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._size = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+
+WRAP_CACHE = _WrapCache()
+
+
+# ------------------------------------------------------------
+# API
+# ------------------------------------------------------------
+def wrap_text(text, pdf, max_width):
+    """
+    Linhas de `text` que cabem em max_width (mm) na fonte atual do pdf.
+    O recuo de bullet já vem descontado em max_width, então o mesmo
+    parágrafo com a mesma largura efetiva reaproveita o cache.
+    """
+    if not text:
+        return [""]
+
+    m = metrics_for(pdf)
+    alias = pdf.str_alias_nb_pages
+    if m is None or (alias and alias in text):
+        return _wrap_text_measured(text, pdf, max_width)
+
+    key = WRAP_CACHE.key(text, pdf.current_font, pdf.font_size_pt, pdf.k, max_width)
+    lines = WRAP_CACHE.get(key)
+    if lines is None:
+        lines = tuple(_wrap_text_table(text, m, _unit_limit(pdf, max_width)))
+        WRAP_CACHE.put(key, lines)
+    return list(lines)
+
+
+def _wrap_text_table(text, m, limit):
+    units = m.units
+    space = units(" ")
+
+    # Divide por espaços preservando a intenção original
+    lines = []
+    parts, cur = [], 0   # linha atual = "".join(parts), cur = largura em unidades
+
+    for w in text.split(" "):
+        if not w: continue
+        wu = units(w)
+
+        # Se for uma URL ou texto com delimitadores, usamos a lógica de quebra por caractere
+        if wu > limit and any(ch in w for ch in _DELIMS):
+            for seg in _split_token_preserving_delims(w):
+                su = units(seg)
+                if cur + su <= limit:
+                    parts.append(seg)
+                    cur += su
+                else:
+                    if parts: lines.append("".join(parts))
+                    parts, cur = [seg], su
+            continue
+
+        # Palavra normal
+        if not parts:
+            parts, cur = [w], wu
+        elif parts[0][0].isspace() or w[-1].isspace():
+            # Raro: o strip() do candidato corta espaço das pontas
+            candidate = f"{''.join(parts)} {w}".strip()
+            cu = m.measure(candidate)
+            if cu <= limit:
+                parts, cur = ([candidate] if candidate else []), cu
+            else:
+                lines.append("".join(parts))
+                parts, cur = [w], wu
+        elif cur + space + wu <= limit:
+            parts.append(" ")
+            parts.append(w)
+            cur += space + wu
+        else:
+            lines.append("".join(parts))
+            parts, cur = [w], wu
+
+    if parts:
+        lines.append("".join(parts))
+    return lines
+
+
+def _wrap_text_measured(text, pdf, max_width):
+    """Caminho antigo (get_string_width por candidato) para fontes sem tabela."""
+    words = text.split(" ")
+    lines, current = [], ""
+
+    def width(s): return pdf.get_string_width(s)
+
+    for w in words:
+        if not w: continue
+
+        if any(ch in w for ch in _DELIMS) and width(w) > max_width:
+            segments = _split_token_preserving_delims(w)
+            for seg in segments:
+                candidate = current + seg
+                if width(candidate) <= max_width:
+                    current = candidate
+                else:
+                    if current: lines.append(current)
+                    current = seg
+            continue
+
+        candidate = f"{current} {w}".strip() if current else w
+        if width(candidate) <= max_width:
+            current = candidate
+        else:
+            if current: lines.append(current)
+            current = w
+
+    if current:
+        lines.append(current)
+    return lines
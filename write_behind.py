@@ -0,0 +1,333 @@
+# write_behind.py
+# Gravação assíncrona (write-behind) — opcional
+# Diário local durável (JSONL + fsync) | Coalescência por registro | Worker em 2º plano
+#
+# O clique em "Salvar" só anexa a operação ao diário e retorna. Um único
+# worker por processo junta as operações pendentes (última versão de cada
+# registro vence) e envia ao GitHub via apply_batch() do banco — um commit
+# por banco por lote, em vez de um commit (com retries) por clique.
+#
+# Conflito de merge (mesmo campo alterado por outra pessoa): só os registros
+# em conflito saem do lote e ficam no diário marcados ("conflict"); o resto
+# segue com suas bases. Nada é sobrescrito — o usuário resolve pela UI
+# (refaz a edição sobre a versão atual ou descarta a pendência).
+
+import json
+import os
+import threading
+import time
+
+from record_merge import MergeConflict
+
+
+class WriteBehindQueue:
+    """
+    Fila durável compartilhada pelo processo. Sobrevive a reinícios: ao
+    abrir, as operações que estavam no diário voltam a ficar pendentes.
+    """
+
+    def __init__(self, journal_path, flush_interval=3.0):
+        self.journal_path = journal_path
+        self.flush_interval = float(flush_interval)
+
+        self._lock = threading.RLock()
+        self._stores = {}       # nome -> banco com apply_batch()
+        self._ops = []          # operações pendentes (ordem de chegada)
+        self._seq = 0
+        self._wake = threading.Event()
+        self._worker = None
+
+        # Status para a UI
+        self.flushed = 0
+        self.last_flush = None
+        self.last_error = None
+
+        os.makedirs(os.path.dirname(os.path.abspath(journal_path)), exist_ok=True)
+        self._replay()
+
+    # ============================================================
+    # DIÁRIO
+    # ============================================================
+    def _replay(self):
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    op = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # linha truncada por queda no meio da escrita
+                self._ops.append(op)
+                self._seq = max(self._seq, int(op.get("seq", 0)))
+
+    def _append(self, op):
+        with open(self.journal_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(op, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _rewrite(self):
+        tmp = f"{self.journal_path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for op in self._ops:
+                f.write(json.dumps(op, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.journal_path)
+
+    # ============================================================
+    # ENFILEIRAR
+    # ============================================================
+    def register(self, name, store):
+        """Associa um nome do diário ao banco que receberá o lote."""
+        with self._lock:
+            self._stores[name] = store
+
+    def enqueue(self, name, kind, record_id, record=None, base=None):
+        with self._lock:
+            self._seq += 1
+            op = {
+                "seq": self._seq,
+                "db": name,
+                "op": kind,            # "save" | "delete"
+                "id": str(record_id),
+                "record": record,
+                "ts": time.time(),
+            }
+            if base is not None:
+                op["base"] = base      # registro de quando a edição começou
+            self._append(op)
+            self._ops.append(op)
+        self.start()
+        return op["seq"]
+
+    def _latest(self, name=None, conflict=False):
+        with self._lock:
+            latest = {}
+            for op in self._ops:
+                if name is None or op["db"] == name:
+                    latest[(op["db"], op["id"])] = op
+            latest = {k: op for k, op in latest.items() if bool(op.get("conflict")) == conflict}
+            if name is None:
+                return latest
+            return {rid: op for (_, rid), op in latest.items()}
+
+    def pending(self, name=None):
+        """Última operação pendente de cada registro: {id: op} (sem os conflitos)."""
+        return self._latest(name)
+
+    def conflicts(self, name=None):
+        """Registros parados por conflito, aguardando o usuário: {id: op}."""
+        return self._latest(name, conflict=True)
+
+    def discard(self, name, record_id):
+        """Descarta as operações pendentes de um registro (fica a versão remota)."""
+        with self._lock:
+            rid = str(record_id)
+            self._ops = [op for op in self._ops if (op["db"], op["id"]) != (name, rid)]
+            self._rewrite()
+
+    def status(self):
+        with self._lock:
+            conflicts = {}
+            for (name, rid), op in self.conflicts().items():
+                conflicts.setdefault(name, []).append(rid)
+            return {
+                "pending": len(self.pending()),
+                "conflicts": conflicts,
+                "flushed": self.flushed,
+                "last_flush": self.last_flush,
+                "last_error": self.last_error,
+            }
+
+    # ============================================================
+    # ENVIO (FLUSH)
+    # ============================================================
+    def flush(self):
+        """Envia tudo que está pendente. Retorna nº de registros enviados."""
+        with self._lock:
+            batch = list(self._ops)
+            upto = self._seq
+        if not batch:
+            return 0
+
+        by_db = {}
+        bases = {}
+        for op in batch:
+            if op.get("conflict"):
+                # Parado à espera do usuário; uma edição posterior recomeça
+                # com a própria base (a versão que ele abriu depois)
+                by_db.get(op["db"], {}).pop(op["id"], None)
+                bases.get(op["db"], {}).pop(op["id"], None)
+                continue
+            by_db.setdefault(op["db"], {})[op["id"]] = op  # último vence
+            if "base" in op:
+                # Várias edições do mesmo registro no lote: vale a base da primeira
+                bases.setdefault(op["db"], {}).setdefault(op["id"], op["base"])
+
+        sent = 0
+        done_dbs = set()
+        new_conflicts = {}      # (banco, id) -> (seq da operação, campos)
+        error = None
+        for name, ops in by_db.items():
+            store = self._stores.get(name)
+            if store is None:
+                continue  # banco ainda não registrado nesta execução
+            db_bases = bases.get(name, {})
+            held = {}           # id -> campos em conflito
+            try:
+                while True:
+                    live = {rid: op for rid, op in ops.items() if rid not in held}
+                    if not live:
+                        break
+                    upserts = [op["record"] for op in live.values() if op["op"] == "save"]
+                    deletes = [op["id"] for op in live.values() if op["op"] == "delete"]
+                    live_bases = {rid: db_bases[rid] for rid, op in live.items() if op["op"] == "save" and rid in db_bases}
+                    try:
+                        store.apply_batch(upserts, deletes, live_bases or None)
+                        break
+                    except MergeConflict as e:
+                        # Tira do lote só os registros em conflito; o resto
+                        # vai na próxima tentativa, com as mesmas bases
+                        fresh = {}
+                        for rid, field in e.conflicts:
+                            if str(rid) in live:
+                                fresh.setdefault(str(rid), []).append(field)
+                        if not fresh:
+                            raise
+                        for rid, fields in fresh.items():
+                            held.setdefault(rid, []).extend(fields)
+                for rid, fields in held.items():
+                    new_conflicts[(name, rid)] = (ops[rid]["seq"], fields)
+                sent += len(ops) - len(held)
+                done_dbs.add(name)
+            except Exception as e:
+                error = f"{name}: {e}"
+
+        with self._lock:
+            for op in self._ops:
+                hit = new_conflicts.get((op["db"], op["id"]))
+                if hit and op["seq"] == hit[0]:
+                    op["conflict"] = [f for f in hit[1] if f is not None] or True
+            latest = {}
+            for op in self._ops:
+                latest[(op["db"], op["id"])] = op
+            # Enviados saem do diário; o conflito fica até o usuário resolver
+            # (nova edição enviada ou descarte)
+            self._ops = [
+                op for op in self._ops
+                if op["seq"] > upto
+                or op["db"] not in done_dbs
+                or (op.get("conflict") and latest[(op["db"], op["id"])] is op)
+            ]
+            self._rewrite()
+            self.flushed += sent
+            if done_dbs:
+                self.last_flush = time.time()
+            self.last_error = error
+        return sent
+
+    def _run(self):
+        backoff = self.flush_interval
+        while True:
+            self._wake.wait(backoff)
+            self._wake.clear()
+            # Pequena espera para juntar cliques em sequência no mesmo lote
+            time.sleep(self.flush_interval)
+            self.flush()
+            backoff = self.flush_interval if self.last_error is None else min(backoff * 2, 60.0)
+
+    def start(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                self._worker.start()
+        self._wake.set()
+
+
+class WriteBehindStore:
+    """
+    Envelopa um banco (GitHubJSON / ShardedJSON) com a mesma API por
+    registro: leituras enxergam as edições pendentes (read-your-writes) e
+    escritas vão para a fila.
+    """
+
+    write_behind = True
+
+    def __init__(self, store, queue, name):
+        self.store = store
+        self.queue = queue
+        self.name = name
+        queue.register(name, store)
+
+    def _overlay(self, records):
+        pending = self.queue.pending(self.name)
+        if not pending:
+            return records
+        out = []
+        for r in records or []:
+            op = pending.pop(str(r.get("id")), None)
+            if op is None:
+                out.append(r)
+            elif op["op"] == "save":
+                out.append(op["record"])
+        out.extend(op["record"] for op in pending.values() if op["op"] == "save")
+        return out
+
+    def is_pending(self, record_id):
+        return str(record_id) in self.queue.pending(self.name)
+
+    def conflict(self, record_id):
+        """Operação parada por conflito deste registro (ou None)."""
+        return self.queue.conflicts(self.name).get(str(record_id))
+
+    def discard(self, record_id):
+        self.queue.discard(self.name, record_id)
+
+    # Leitura
+    def load(self, force=False):
+        data, sha = self.store.load(force=force)
+        return self._overlay(data), sha
+
+    def load_index(self, force=False):
+        return self._overlay(self.store.load_index(force=force))
+
+    def load_record(self, record_id, force=False):
+        op = self.queue.pending(self.name).get(str(record_id))
+        if op is not None:
+            return op["record"] if op["op"] == "save" else None
+        return self.store.load_record(record_id, force=force)
+
+    def load_all(self, force=False):
+        return self._overlay(self.store.load_all(force=force))
+
+    def invalidate(self):
+        self.store.invalidate()
+
+    # Escrita (retorna na hora)
+    def save_record(self, record, base=None):
+        self.queue.enqueue(self.name, "save", record.get("id"), record, base)
+        return True
+
+    def delete_record(self, record_id):
+        self.queue.enqueue(self.name, "delete", record_id)
+        return True
+
+
+_QUEUES = {}
+_QUEUES_LOCK = threading.Lock()
+
+
+def get_queue(journal_path, flush_interval=3.0):
+    """Uma fila por diário, por processo (o app.py é reexecutado a cada rerun)."""
+    key = os.path.abspath(journal_path)
+    with _QUEUES_LOCK:
+        if key not in _QUEUES:
+            _QUEUES[key] = WriteBehindQueue(journal_path, flush_interval)
+        queue = _QUEUES[key]
+    if queue.pending():
+        queue.start()  # retoma o que ficou no diário antes do reinício
+    return queue